@@ -2,6 +2,34 @@ import { NextRequest, NextResponse } from 'next/server';
 
 const DIFY_BASE_URL = 'https://api.dify.ai/v1';
 const DIFY_IMAGE_MATCHER_API_KEY = process.env.DIFY_API_KEY_MATCHER;
+// Optional local dish index service (scripts/dish_index.py serve)
+const DISH_INDEX_URL = process.env.DISH_INDEX_URL;
+const DISH_INDEX_TIMEOUT_MS = 300;
+
+// Look up photos in the local dish index. Returns null when the index is
+// not configured, unreachable or has no match, so the caller can fall
+// back to the Dify workflow.
+const searchDishIndex = async (
+  name: string,
+  placeId: string,
+  count: string,
+): Promise<string[] | null> => {
+  if (!DISH_INDEX_URL) return null;
+  const params = new URLSearchParams({ name, count: count || '10' });
+  if (placeId) params.set('place_id', placeId);
+  try {
+    const res = await fetch(`${DISH_INDEX_URL}/search?${params}`, {
+      signal: AbortSignal.timeout(DISH_INDEX_TIMEOUT_MS),
+    });
+    if (!res.ok) return null;
+    const data = await res.json();
+    const imageUrls: string[] = data?.imageUrls || [];
+    return imageUrls.length > 0 ? imageUrls : null;
+  } catch (error) {
+    console.warn('Dish index lookup failed, falling back to Dify:', error);
+    return null;
+  }
+};
 
 // Input validation helpers
 const validateString = (
@@ -57,6 +85,23 @@ export async function GET(req: NextRequest) {
       );
     }
 
+    const localImageUrls = await searchDishIndex(name, place_id, count);
+    if (localImageUrls) {
+      return NextResponse.json({
+        imageUrls: localImageUrls,
+        status: 200,
+        source: 'dish-index',
+        dishInfo: {
+          name,
+          desc,
+          gen_desc,
+          category,
+          count,
+          place_id,
+        },
+      });
+    }
+
     if (!DIFY_IMAGE_MATCHER_API_KEY) {
       return NextResponse.json(
         { error: 'Missing Dify image matcher configuration' },
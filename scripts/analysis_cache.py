@@ -0,0 +1,133 @@
+import json
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+from image_utils import normalize_photo_url
+
+
+class AnalysisCache:
+    """
+    Persistent cache of Dify photo analyses.
+
+    Entries are keyed by normalized photo URL and can optionally also be
+    found by a perceptual hash of the image bytes, so the same photo seen
+    under a different URL is not analyzed twice. Entries expire after
+    `ttl_seconds` and the least recently used ones are dropped once the
+    cache holds more than `max_entries`.
+    """
+
+    def __init__(self, path: str, ttl_seconds: float = None, max_entries: int = None):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.hash_hits = 0
+        self.misses = 0
+        self.evicted = 0
+        self._lock = threading.Lock()
+
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS analyses (
+                url_key TEXT PRIMARY KEY,
+                image_hash TEXT,
+                analysis TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            )""")
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS analyses_image_hash ON analyses (image_hash)")
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS analyses_last_used ON analyses (last_used)")
+        self._db.commit()
+        self.evict()
+
+    def _expiry_cutoff(self) -> float:
+        if self.ttl_seconds is None:
+            return float('-inf')
+        return time.time() - self.ttl_seconds
+
+    def get(self, photo_url: str,
+            image_hash: Callable[[], Optional[str]] = None) -> Optional[Dict]:
+        """
+        Cached analysis for a photo URL.
+
+        On a URL miss, `image_hash` is called (it may download the image)
+        and the analysis of any photo with the same hash is reused.
+        """
+        url_key = normalize_photo_url(photo_url)
+        cutoff = self._expiry_cutoff()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT analysis FROM analyses WHERE url_key = ? AND created_at >= ?",
+                (url_key, cutoff)).fetchone()
+
+        if row is None and image_hash is not None:
+            hash_value = image_hash()
+            if hash_value is not None:
+                with self._lock:
+                    row = self._db.execute(
+                        "SELECT analysis FROM analyses WHERE image_hash = ? AND created_at >= ? "
+                        "ORDER BY created_at DESC LIMIT 1",
+                        (hash_value, cutoff)).fetchone()
+                if row is not None:
+                    # Remember the new URL so the next lookup skips the download
+                    self.put(photo_url, json.loads(row[0]), hash_value)
+                    with self._lock:
+                        self.hash_hits += 1
+
+        with self._lock:
+            if row is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self._db.execute("UPDATE analyses SET last_used = ? WHERE url_key = ?",
+                             (time.time(), url_key))
+            self._db.commit()
+        return json.loads(row[0])
+
+    def put(self, photo_url: str, analysis: Dict, image_hash: str = None):
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO analyses VALUES (?, ?, ?, ?, ?)",
+                (normalize_photo_url(photo_url), image_hash,
+                 json.dumps(analysis, ensure_ascii=False), now, now))
+            self._db.commit()
+
+    def evict(self):
+        """
+        Drop expired entries, then trim to `max_entries` by last use
+        """
+        with self._lock:
+            removed = self._db.execute(
+                "DELETE FROM analyses WHERE created_at < ?", (self._expiry_cutoff(),)).rowcount
+            if self.max_entries is not None:
+                removed += self._db.execute("""
+                    DELETE FROM analyses WHERE url_key IN (
+                        SELECT url_key FROM analyses ORDER BY last_used DESC
+                        LIMIT -1 OFFSET ?)""", (self.max_entries,)).rowcount
+            self._db.commit()
+            self.evicted += removed
+
+    def stats(self) -> Dict:
+        with self._lock:
+            entries = self._db.execute(
+                "SELECT COUNT(*) FROM analyses").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'hash_hits': self.hash_hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'evicted': self.evicted,
+            'entries': entries
+        }
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,186 @@
+import math
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+EARTH_RADIUS_M = 6371000.0
+
+# A tile is a search circle: (latitude, longitude, radius in meters)
+Tile = Tuple[float, float, float]
+Point = Tuple[float, float]
+
+
+def offset_point(lat: float, lng: float, north_m: float, east_m: float) -> Point:
+    """
+    Move a coordinate by a distance in meters (equirectangular approximation)
+    """
+    dlat = math.degrees(north_m / EARTH_RADIUS_M)
+    dlng = math.degrees(
+        east_m / (EARTH_RADIUS_M * math.cos(math.radians(lat))))
+    return lat + dlat, lng + dlng
+
+
+def _to_meters(origin: Point, point: Point) -> Tuple[float, float]:
+    """
+    Local (east, north) offset of `point` from `origin` in meters
+    """
+    east = math.radians(point[1] - origin[1]) * EARTH_RADIUS_M * \
+        math.cos(math.radians(origin[0]))
+    north = math.radians(point[0] - origin[0]) * EARTH_RADIUS_M
+    return east, north
+
+
+def tile_bounding_box(south: float, west: float, north: float, east: float,
+                      radius: float) -> List[Tile]:
+    """
+    Cover a bounding box with overlapping circles of `radius` meters.
+
+    Circles sit on a square grid with spacing radius * sqrt(2), so each
+    grid cell is fully inside its circle and neighbours overlap.
+    """
+    spacing = radius * math.sqrt(2)
+    height, width = _to_meters((south, west), (north, east))[::-1]
+    rows = max(1, math.ceil(height / spacing))
+    cols = max(1, math.ceil(width / spacing))
+
+    tiles = []
+    for row in range(rows):
+        for col in range(cols):
+            lat, lng = offset_point(south, west,
+                                    (row + 0.5) * spacing, (col + 0.5) * spacing)
+            tiles.append((lat, lng, radius))
+    return tiles
+
+
+def point_in_polygon(point: Point, polygon: Sequence[Point]) -> bool:
+    """
+    Ray casting test for a (lat, lng) point against a (lat, lng) polygon
+    """
+    lat, lng = point
+    inside = False
+    for i in range(len(polygon)):
+        lat1, lng1 = polygon[i]
+        lat2, lng2 = polygon[i - 1]
+        if (lng1 > lng) != (lng2 > lng):
+            crossing = lat1 + (lng - lng1) * (lat2 - lat1) / (lng2 - lng1)
+            if lat < crossing:
+                inside = not inside
+    return inside
+
+
+def circle_intersects_polygon(tile: Tile, polygon: Sequence[Point]) -> bool:
+    lat, lng, radius = tile
+    if point_in_polygon((lat, lng), polygon):
+        return True
+
+    # Otherwise the circle must reach one of the polygon's edges
+    for i in range(len(polygon)):
+        ax, ay = _to_meters((lat, lng), polygon[i - 1])
+        bx, by = _to_meters((lat, lng), polygon[i])
+        dx, dy = bx - ax, by - ay
+        length = dx * dx + dy * dy
+        t = 0.0 if length == 0 else max(
+            0.0, min(1.0, -(ax * dx + ay * dy) / length))
+        if math.hypot(ax + t * dx, ay + t * dy) <= radius:
+            return True
+    return False
+
+
+def tile_polygon(polygon: Sequence[Point], radius: float) -> List[Tile]:
+    """
+    Cover a (lat, lng) polygon with overlapping circles of `radius` meters
+    """
+    lats = [p[0] for p in polygon]
+    lngs = [p[1] for p in polygon]
+    return [tile for tile in tile_bounding_box(min(lats), min(lngs), max(lats), max(lngs), radius)
+            if circle_intersects_polygon(tile, polygon)]
+
+
+def subdivide(tile: Tile) -> List[Tile]:
+    """
+    Split a circle into four circles covering the quadrants of its
+    bounding square
+    """
+    lat, lng, radius = tile
+    half = radius / 2
+    child_radius = radius / math.sqrt(2)
+    return [offset_point(lat, lng, north, east) + (child_radius,)
+            for north in (-half, half) for east in (-half, half)]
+
+
+def place_in_area(place: Dict, polygon: Optional[Sequence[Point]]) -> bool:
+    """
+    Whether a search result lies inside the swept area. Search circles
+    reach past the area's edges, so results are clipped to it; places
+    without a location are kept
+    """
+    if polygon is None or place.get('latitude') is None or place.get('longitude') is None:
+        return True
+    return point_in_polygon((place['latitude'], place['longitude']), polygon)
+
+
+def sweep_area(search: Callable[[float, float, float, int], Optional[List[Dict]]],
+               tiles: List[Tile], max_results: int = 20, min_radius: float = 100,
+               max_workers: int = 4, polygon: Optional[Sequence[Point]] = None,
+               attempts: int = 3) -> List[Dict]:
+    """
+    Query every tile concurrently and return unique places in discovery order.
+
+    `search(lat, lng, radius, max_results)` is the Places query (for
+    example get_nearby_restaurants, or a stub) and returns None when it
+    failed. A failed tile is queried again, up to `attempts` times, and
+    reported if it never succeeds. A tile that hits the result cap is
+    assumed to be truncated and is split into four smaller tiles, down to
+    `min_radius`. Places outside `polygon` are dropped.
+    """
+    seen = set()
+    places = []
+    queried = 0
+    subdivided = 0
+    clipped = 0
+    failed = []
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        def submit(tile: Tile, attempt: int = 1):
+            pending[executor.submit(search, tile[0], tile[1], tile[2], max_results)] = \
+                (tile, attempt)
+
+        pending = {}
+        for tile in tiles:
+            submit(tile)
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                tile, attempt = pending.pop(future)
+                results = future.result()
+                queried += 1
+
+                if results is None:
+                    if attempt < attempts:
+                        submit(tile, attempt + 1)
+                    else:
+                        failed.append(tile)
+                    continue
+
+                for place in results:
+                    place_id = place.get('place_id')
+                    if not place_id or place_id in seen:
+                        continue
+                    seen.add(place_id)
+                    if place_in_area(place, polygon):
+                        places.append(place)
+                    else:
+                        clipped += 1
+
+                if len(results) >= max_results and tile[2] / math.sqrt(2) >= min_radius:
+                    subdivided += 1
+                    for child in subdivide(tile):
+                        if polygon is None or circle_intersects_polygon(child, polygon):
+                            submit(child)
+
+    print(f"Area sweep: {queried} tile queries, {subdivided} tiles subdivided, "
+          f"{clipped} places outside the area, {len(places)} unique places")
+    for lat, lng, radius in failed:
+        print(f"Area sweep: search failed {attempts} times for tile "
+              f"({lat:.6f}, {lng:.6f}, {radius:.0f}m), its places may be missing")
+    return places
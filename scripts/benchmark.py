@@ -0,0 +1,303 @@
+import argparse
+import importlib
+import json
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional
+
+import mock_servers
+from rate_limiter import add_quota_arguments
+
+# The stage scripts have hyphenated file names, so they are imported by
+# name, and only for the stage being measured: the crawler needs
+# apify_client, which the analysis benchmark doesn't
+STAGE_SCRIPTS = {'analyze': "image-marker", 'crawl': "place-scrawler"}
+
+
+class CallTimer:
+    """
+    Wall-clock latency samples of module functions, per function name.
+
+    Wrapping replaces the module attribute, so calls made through the
+    module globals (as the scripts do) are timed, retries included
+    """
+
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def wrap(self, module, name: str):
+        original = getattr(module, name)
+        samples = self.samples.setdefault(name, [])
+
+        def timed(*args, **kwargs):
+            start = time.monotonic()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                with self._lock:
+                    samples.append(time.monotonic() - start)
+
+        setattr(module, name, timed)
+
+    def summary(self) -> Dict[str, Dict]:
+        with self._lock:
+            return {name: {
+                'calls': len(samples),
+                'p50_ms': percentile(samples, 50) * 1000,
+                'p99_ms': percentile(samples, 99) * 1000
+            } for name, samples in self.samples.items() if samples}
+
+
+def percentile(values: List[float], q: float) -> float:
+    """
+    Nearest-rank percentile, 0.0 for no values
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, int(round(q / 100 * len(ordered) + 0.5)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def peak_rss_mb() -> float:
+    """
+    Peak resident set size of this process so far
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def server_url(server) -> str:
+    host, port = server.server_address[:2]
+    return f"http://{host}:{port}"
+
+
+def request_counts(server) -> Dict:
+    with server.lock:
+        counts = dict(server.status_counts)
+    return {'requests': sum(counts.values()),
+            'status_counts': {str(status): count for status, count in sorted(counts.items())}}
+
+
+def benchmark_analyze(args, corpus: mock_servers.MockCorpus, behavior: mock_servers.MockBehavior) -> Dict:
+    """
+    Analyze every corpus photo against the mock Dify workflow, the way
+    `process_restaurant_photos()` does
+    """
+    marker = importlib.import_module(STAGE_SCRIPTS['analyze'])
+    dify = mock_servers.start_server(mock_servers.MockDifyHandler, behavior)
+    marker.DIFY_WORKFLOW_URL = f"{server_url(dify)}/v1/workflows/run"
+    marker.DIFY_FILES_URL = f"{server_url(dify)}/v1/files/upload"
+    restaurants = list(corpus.restaurants.values())
+    photo_host = None
+    if args.prefetch != "off":
+        # Photos are downloaded for real, so serve them locally
+        photo_host = mock_servers.start_server(
+            mock_servers.MockPhotoHandler, behavior)
+        restaurants = [dict(restaurant, photo_urls=[
+            url.replace("https://lh3.googleusercontent.com", server_url(photo_host))
+            for url in restaurant.get('photo_urls', [])]) for restaurant in restaurants]
+
+    timer = CallTimer()
+    timer.wrap(marker, 'call_dify_workflow')
+    timer.wrap(marker, 'call_dify_workflow_batch')
+    timer.wrap(marker, 'upload_dify_file')
+
+    input_file = os.path.join(marker.OUTPUT_DIR, "benchmark_corpus.json")
+    os.makedirs(marker.OUTPUT_DIR, exist_ok=True)
+    with open(input_file, 'w', encoding='utf-8') as f:
+        json.dump(restaurants, f, ensure_ascii=False)
+
+    start = time.monotonic()
+    run = marker.AnalysisRun(**marker.analysis_options(args))
+    run.process_file(input_file)
+    run.close()
+    elapsed = time.monotonic() - start
+    dify.shutdown()
+    if photo_host is not None:
+        photo_host.shutdown()
+
+    calls = request_counts(dify)
+    return {
+        'stage': 'analyze',
+        'elapsed_s': elapsed,
+        'photos': run.total_photos,
+        'dishes': run.total_dishes,
+        'photos_per_s': run.total_photos / elapsed if elapsed else 0.0,
+        'dify': calls,
+        'api_calls_per_dish': calls['requests'] / run.total_dishes if run.total_dishes else None,
+        'latency': timer.summary(),
+        'peak_rss_mb': peak_rss_mb()
+    }
+
+
+def benchmark_crawl(args, corpus: mock_servers.MockCorpus, behavior: mock_servers.MockBehavior) -> Dict:
+    """
+    Crawl the corpus through the mock Places and Apify APIs
+    """
+    from apify_client import ApifyClient
+
+    crawler = importlib.import_module(STAGE_SCRIPTS['crawl'])
+    places = mock_servers.start_server(
+        mock_servers.MockPlacesHandler, behavior, corpus=corpus)
+    apify = mock_servers.start_server(
+        mock_servers.MockApifyHandler, behavior, corpus=corpus)
+    crawler.PLACES_API_URL = f"{server_url(places)}/v1"
+    crawler.client = ApifyClient("mock-token", api_url=server_url(apify))
+    if args.apify_rps is not None:
+        crawler.APIFY_RUNS_PER_SECOND = args.apify_rps
+
+    timer = CallTimer()
+    timer.wrap(crawler, 'get_nearby_restaurants')
+    timer.wrap(crawler, 'get_restaurants_photos')
+
+    # A failed actor run returns None; counted so the run is not reported
+    # as a throughput figure
+    failed_runs = []
+    get_restaurants_photos = crawler.get_restaurants_photos
+
+    def checked(restaurants):
+        photos = get_restaurants_photos(restaurants)
+        if photos is None:
+            failed_runs.append(len(restaurants))
+        return photos
+
+    crawler.get_restaurants_photos = checked
+
+    found = {'restaurants': 0, 'photos': 0}
+
+    def count(restaurant):
+        found['restaurants'] += 1
+        found['photos'] += len(restaurant.get('photo_urls', []))
+
+    start = time.monotonic()
+    crawler.crawl(args, on_restaurant=count)
+    elapsed = time.monotonic() - start
+    places.shutdown()
+    apify.shutdown()
+
+    places_calls, apify_calls = request_counts(places), request_counts(apify)
+    total_calls = places_calls['requests'] + apify_calls['requests']
+    return {
+        'stage': 'crawl',
+        'elapsed_s': elapsed,
+        'restaurants': found['restaurants'],
+        'photos': found['photos'],
+        'failed_actor_runs': len(failed_runs),
+        'photos_per_s': found['photos'] / elapsed if elapsed else 0.0,
+        'places': places_calls,
+        'apify': apify_calls,
+        'api_calls_per_restaurant': total_calls / found['restaurants'] if found['restaurants'] else None,
+        'latency': timer.summary(),
+        'peak_rss_mb': peak_rss_mb()
+    }
+
+
+def report_failure(report: Dict) -> Optional[str]:
+    """
+    Why a run measured nothing useful, if it didn't
+    """
+    if report['stage'] != 'crawl':
+        return None
+    if report['failed_actor_runs']:
+        return f"{report['failed_actor_runs']} actor runs errored, see the errors above"
+    if not report['restaurants']:
+        return "no restaurants were crawled, see the errors above"
+    return None
+
+
+def print_report(report: Dict):
+    print(f"\n{'='*60}")
+    print(f"Benchmark: {report['stage']}")
+    print(f"{'='*60}")
+    print(f"Elapsed: {report['elapsed_s']:.2f}s")
+    print(f"Photos: {report['photos']} ({report['photos_per_s']:.1f} photos/s)")
+    if report['stage'] == 'analyze':
+        print(f"Dishes: {report['dishes']}")
+        print(f"Dify requests: {report['dify']['requests']} {report['dify']['status_counts']}")
+        print(f"API calls per dish: {report['api_calls_per_dish']}")
+    else:
+        print(f"Restaurants: {report['restaurants']}")
+        print(f"Places requests: {report['places']['requests']} {report['places']['status_counts']}")
+        print(f"Apify requests: {report['apify']['requests']} {report['apify']['status_counts']}")
+        print(f"API calls per restaurant: {report['api_calls_per_restaurant']}")
+    for name, latency in sorted(report['latency'].items()):
+        print(f"{name}: {latency['calls']} calls, p50 {latency['p50_ms']:.0f}ms, "
+              f"p99 {latency['p99_ms']:.0f}ms")
+    print(f"Peak RSS: {report['peak_rss_mb']:.1f} MB")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Measure ingestion throughput against local mock APIs")
+    mock_servers.add_mock_arguments(parser)
+    parser.add_argument('--json', help="Also write the report to this file")
+    parser.add_argument('--keep-workdir', action='store_true',
+                        help="Keep the temporary directory with the run outputs")
+    add_quota_arguments(parser)
+    subparsers = parser.add_subparsers(dest='stage', required=True)
+
+    subparsers.add_parser(
+        'analyze', help="Benchmark photo analysis against the mock Dify workflow")
+    crawl_parser = subparsers.add_parser(
+        'crawl', help="Benchmark the crawler against mock Places and Apify APIs")
+    crawl_parser.add_argument('--apify-rps', type=float, default=None,
+                              help="Override the Apify actor run start rate")
+
+    # Stage options come from the stage script, imported only for the
+    # stage being measured
+    argv = sys.argv[1:] if argv is None else argv
+    stage = next((arg for arg in argv if arg in STAGE_SCRIPTS), None)
+    if stage == 'analyze':
+        importlib.import_module(STAGE_SCRIPTS[stage]).add_analysis_arguments(
+            subparsers.choices[stage])
+    elif stage == 'crawl':
+        importlib.import_module(STAGE_SCRIPTS[stage]).add_crawl_arguments(
+            subparsers.choices[stage])
+
+    args = parser.parse_args(argv)
+    if args.corpus:
+        args.corpus = [os.path.abspath(path) for path in args.corpus]
+    if args.quota_file:
+        args.quota_file = os.path.abspath(args.quota_file)
+    corpus = mock_servers.mock_corpus(args)
+    behavior = mock_servers.mock_behavior(args)
+    json_path = os.path.abspath(args.json) if args.json else None
+    print(f"Corpus: {len(corpus.restaurants)} restaurants, "
+          f"{corpus.photo_count()} photos")
+
+    # Outputs, checkpoints and caches are written relative to the working
+    # directory, so every run starts cold in a scratch directory
+    workdir = tempfile.mkdtemp(prefix="snapfood-benchmark-")
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        if args.stage == 'analyze':
+            report = benchmark_analyze(args, corpus, behavior)
+        else:
+            report = benchmark_crawl(args, corpus, behavior)
+    finally:
+        os.chdir(cwd)
+        if args.keep_workdir:
+            print(f"Run outputs kept in {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    failure = report_failure(report)
+    if failure:
+        sys.exit(f"Benchmark failed: {failure}")
+    print_report(report)
+    if json_path:
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+import json
+import os
+import threading
+from typing import Dict, Optional, Set
+
+from output_writers import truncate_torn_line
+
+
+class CheckpointStore:
+    """
+    Append-only resume checkpoint for photo analysis.
+
+    Every analyzed photo and every completed place is appended as one JSON
+    line to a journal, so writes are O(1) and a crash can at worst leave a
+    torn last line, which is ignored on load. Membership checks run against
+    in-memory sets built once at startup.
+
+    A `base_path` journal is read but never written, so a worker with a
+    journal of its own still skips what the main run already finished.
+
+    A place can be marked done with the fingerprint of the photo list it
+    was completed with, so a later incremental record for the same place
+    (new photos found by a re-crawl, or photos deferred by sampling) is
+    processed exactly once. Every completed fingerprint is kept, so
+    completing one record of a place never reopens another.
+    """
+
+    def __init__(self, path: str, legacy_path: str = None, fsync: bool = True,
+                 base_path: str = None):
+        self.path = path
+        self.fsync = fsync
+        self.places = set()
+        self.fingerprints: Dict[str, Set[str]] = {}
+        self.photos: Dict[str, Dict[str, Dict]] = {}
+        self._lock = threading.Lock()
+
+        if legacy_path:
+            self._load_legacy(legacy_path)
+        if base_path:
+            self._load(base_path)
+        self._load(self.path)
+        truncate_torn_line(self.path)
+        self._file = open(self.path, 'a', encoding='utf-8')
+
+    def _load_legacy(self, legacy_path: str):
+        """
+        Import place IDs from the old processed_places.json list
+        """
+        if not os.path.exists(legacy_path):
+            return
+        try:
+            with open(legacy_path, 'r', encoding='utf-8') as f:
+                self.places.update(json.load(f))
+        except (OSError, ValueError):
+            print(f"Warning: could not read legacy checkpoint {legacy_path}")
+
+    def _load(self, path: str):
+        if not os.path.exists(path):
+            return
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Torn write from an interrupted run
+                    continue
+                self._apply(record)
+
+    def _apply(self, record: Dict):
+        place_id = record.get('place_id')
+        if record.get('done'):
+            self.places.add(place_id)
+            self.photos.pop(place_id, None)
+            if record.get('fingerprint'):
+                self.fingerprints.setdefault(place_id, set()).add(record['fingerprint'])
+        elif 'photo_url' in record:
+            self.photos.setdefault(place_id, {})[
+                record['photo_url']] = record.get('analysis')
+
+    def _append(self, record: Dict):
+        with self._lock:
+            self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+            self._apply(record)
+
+    def is_place_done(self, place_id: str, fingerprint: Optional[str] = None) -> bool:
+        """
+        Whether a place was completed, and with `fingerprint` if given
+        """
+        if place_id not in self.places:
+            return False
+        return fingerprint is None or fingerprint in self.fingerprints.get(place_id, ())
+
+    def photo_result(self, place_id: str, photo_url: str) -> Optional[Dict]:
+        """
+        Analysis recorded for a photo of an unfinished place, if any
+        """
+        return self.photos.get(place_id, {}).get(photo_url)
+
+    def mark_photo(self, place_id: str, photo_url: str, analysis: Dict):
+        self._append({'place_id': place_id,
+                      'photo_url': photo_url, 'analysis': analysis})
+
+    def mark_place(self, place_id: str, fingerprint: Optional[str] = None):
+        record = {'place_id': place_id, 'done': True}
+        if fingerprint:
+            record['fingerprint'] = fingerprint
+        self._append(record)
+
+    def close(self):
+        with self._lock:
+            self._file.close()
@@ -0,0 +1,243 @@
+import argparse
+import os
+import time
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional, Set, Tuple
+
+from dish_index import normalize_text
+from kb_store import CANONICAL_COLUMNS, KnowledgeBase, segment_paths, write_segment
+
+CANONICAL_DIR = "knowledge_base_canonical"
+
+# Names differing only by these words ("le croque monsieur", "tiramisu
+# maison") are the same dish. Any other extra word makes another dish:
+# "chicken curry rice" is not "chicken curry"
+FILLER_WORDS = frozenset((
+    "a", "an", "and", "the", "of", "with", "our", "house", "homemade",
+    "classic", "special", "traditional", "style",
+    "le", "la", "les", "l", "de", "du", "des", "d", "au", "aux", "et",
+    "maison", "fait", "notre", "classique", "traditionnel", "traditionnelle", "facon"))
+# Words naming the kind of serving rather than the dish: "croque monsieur
+# sandwich" is "croque monsieur". A name made only of them is kept whole
+GENERIC_WORDS = frozenset((
+    "sandwich", "sandwiches", "dish", "dishes", "plate", "plates", "platter",
+    "bowl", "portion", "serving", "set", "meal", "menu",
+    "assiette", "plat", "formule"))
+# Typos allowed in a word grow by one past each of these lengths: none
+# up to 3 letters ("ham" is not "jam"), one up to 7, two beyond
+TYPO_LENGTHS = (3, 7)
+
+
+def name_key(name: str) -> str:
+    """
+    Case, accent, punctuation and word order insensitive form of a name
+    """
+    return ' '.join(sorted(normalize_text(name).split()))
+
+
+def content_words(key: str) -> Tuple[str, ...]:
+    """
+    Sorted words of a name key without fillers and generic dish words
+    """
+    words = [word for word in key.split() if word not in FILLER_WORDS]
+    specific = [word for word in words if word not in GENERIC_WORDS]
+    return tuple(specific or words)
+
+
+def blocking_keys(words: Tuple[str, ...]) -> Set[str]:
+    """
+    First letters of a name's content words. Matching words must share
+    theirs, so only names sharing one are compared, which keeps
+    clustering a place far from all pairs
+    """
+    return {word[0] for word in words}
+
+
+def edit_distance(a: str, b: str, limit: int) -> int:
+    """
+    Levenshtein distance of two words, or `limit + 1` once it is known
+    to exceed `limit`
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, char in enumerate(a, 1):
+        current = [i]
+        for j, other in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1,
+                               previous[j - 1] + (char != other)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+def same_word(word: str, other: str) -> bool:
+    """
+    Whether two words are one spelled alike: the same first letter and a
+    few typos at most (see TYPO_LENGTHS)
+    """
+    if word == other:
+        return True
+    if word[0] != other[0]:
+        return False
+    length = max(len(word), len(other))
+    typos = sum(length > limit for limit in TYPO_LENGTHS)
+    return typos > 0 and edit_distance(word, other, typos) <= typos
+
+
+def same_dish(words: Tuple[str, ...], other_words: Tuple[str, ...]) -> bool:
+    """
+    Whether two names, given by their content words, denote the same
+    dish: as many words, each spelled alike to its own counterpart
+    """
+    if words == other_words:
+        return True
+    if len(words) != len(other_words):
+        return False
+    unmatched = list(other_words)
+    for word in words:
+        match = next((other for other in unmatched if same_word(word, other)), None)
+        if match is None:
+            return False
+        unmatched.remove(match)
+    return True
+
+
+def cluster_names(names: List[str], counts: Optional[Dict[str, int]] = None) -> List[List[str]]:
+    """
+    Group names of one place that denote the same dish. Names with the
+    same key are merged outright. The other keys are taken most frequent
+    first (by `counts` of rows per name) and each joins the first
+    cluster whose leading key it matches, comparing only within shared
+    blocks; matching the leader rather than any member keeps a cluster
+    from drifting through a chain of near matches
+    """
+    key_names = defaultdict(list)
+    key_counts = Counter()
+    for name in names:
+        key = name_key(name)
+        key_names[key].append(name)
+        key_counts[key] += counts.get(name, 1) if counts else 1
+
+    leaders: List[Tuple[str, ...]] = []
+    members: List[List[str]] = []
+    blocks = defaultdict(list)
+    # Sorting is stable, so ties keep first-seen order
+    for key in sorted(key_names, key=lambda key: -key_counts[key]):
+        words = content_words(key)
+        candidates = sorted({i for block in blocking_keys(words) for i in blocks[block]})
+        cluster = next((i for i in candidates if same_dish(words, leaders[i])), None)
+        if cluster is None:
+            cluster = len(leaders)
+            leaders.append(words)
+            members.append([])
+            for block in blocking_keys(words):
+                blocks[block].append(cluster)
+        members[cluster].append(key)
+
+    return [[name for key in keys for name in key_names[key]] for keys in members]
+
+
+def canonical_dish(rows: List[Dict]) -> Dict:
+    """
+    One record for all rows of a cluster: the most frequent spelling as
+    the name, its longest description and every photo, first seen first
+    """
+    # Counter keeps first-seen order, so ties go to the earliest spelling
+    spellings = Counter(row['dish_name'] for row in rows)
+    name = max(spellings, key=spellings.get)
+    named = [row for row in rows if row['dish_name'] == name]
+    description = max((row.get('description') or '' for row in named), key=len)
+    photo_urls = list(dict.fromkeys(row['photo_url'] for row in named + rows if row.get('photo_url')))
+    return {
+        'restaurant_name': rows[-1].get('restaurant_name', ''),
+        'place_id': rows[0].get('place_id', ''),
+        'photo_url': photo_urls[0] if photo_urls else '',
+        'dish_name': name,
+        'description': description,
+        'photo_urls': '\n'.join(photo_urls),
+        'aliases': '\n'.join(spelling for spelling in spellings if spelling != name),
+        'photo_count': str(len(photo_urls))
+    }
+
+
+def canonicalize_dishes(dishes: List[Dict]) -> List[Dict]:
+    """
+    Canonical dishes of knowledge base rows, clustered per place_id
+    """
+    by_place = defaultdict(list)
+    for dish in dishes:
+        if dish.get('dish_name'):
+            by_place[dish.get('place_id') or ''].append(dish)
+
+    canonical = []
+    for rows in by_place.values():
+        by_name = defaultdict(list)
+        for row in rows:
+            by_name[row['dish_name']].append(row)
+        counts = {name: len(named) for name, named in by_name.items()}
+        for cluster in cluster_names(list(by_name), counts):
+            canonical.append(canonical_dish([row for name in cluster for row in by_name[name]]))
+    return canonical
+
+
+def build_canonical(kb_dir: str, output_dir: str = CANONICAL_DIR) -> Tuple[int, int]:
+    """
+    Rewrite a knowledge base directory as one segment of canonical dishes
+    in `output_dir`, replacing an earlier build. Returns the number of
+    rows read and of dishes written
+    """
+    kb = KnowledgeBase(kb_dir)
+    dishes = kb.load()
+    kb.close()
+    canonical = canonicalize_dishes(dishes)
+
+    os.makedirs(output_dir, exist_ok=True)
+    previous = segment_paths(output_dir)
+    write_segment(output_dir, canonical, columns=CANONICAL_COLUMNS)
+    for path in previous:
+        os.remove(path)
+    return len(dishes), len(canonical)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Merge spelling variants of dish names per restaurant into canonical dishes")
+    parser.add_argument('--kb', default="knowledge_base",
+                        help="Knowledge base directory")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build_parser = subparsers.add_parser(
+        'build', help="Write the canonical knowledge base")
+    build_parser.add_argument('--output', default=CANONICAL_DIR,
+                              help="Canonical knowledge base directory")
+
+    clusters_parser = subparsers.add_parser(
+        'clusters', help="Show the names that would be merged")
+    clusters_parser.add_argument('--place-id', default=None,
+                                 help="Only this restaurant")
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'build':
+        start = time.monotonic()
+        rows, dishes = build_canonical(args.kb, args.output)
+        shrink = (1 - dishes / rows) * 100 if rows else 0.0
+        print(f"Merged {rows} knowledge base rows into {dishes} canonical dishes "
+              f"({shrink:.1f}% fewer) in {args.output}/ "
+              f"in {time.monotonic() - start:.1f}s")
+    elif args.command == 'clusters':
+        kb = KnowledgeBase(args.kb)
+        dishes = [dish for dish in kb.load()
+                  if args.place_id is None or dish.get('place_id') == args.place_id]
+        kb.close()
+        for dish in canonicalize_dishes(dishes):
+            if dish['aliases']:
+                aliases = ', '.join(dish['aliases'].split('\n'))
+                print(f"{dish['restaurant_name']}: {dish['dish_name']} "
+                      f"<- {aliases} ({dish['photo_count']} photos)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,410 @@
+import argparse
+import json
+import os
+import time
+import zlib
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from dish_index import normalize_text
+from kb_store import KnowledgeBase, Segment, write_segment
+
+try:
+    from sentence_transformers import SentenceTransformer
+except ImportError:  # Hashed n-gram embeddings are used without it
+    SentenceTransformer = None
+
+EMBEDDINGS_DIR = "dish_embeddings"
+DISHES_FILE = "dishes.kbseg"  # Dishes in matrix row order
+MATRIX_FILE = "embeddings.npy"  # float32 rows, L2-normalized
+IDF_FILE = "idf.npy"
+CENTROIDS_FILE = "centroids.npy"
+LIST_OFFSETS_FILE = "list_offsets.npy"
+META_FILE = "meta.json"
+
+HASH_DIM = 1024  # Buckets of the hashed n-gram embedding
+NGRAM_SIZES = (2, 3, 4)  # Character n-gram lengths, besides whole words
+DESCRIPTION_WEIGHT = 0.5  # Description features count half as much as the name
+SEARCH_CHUNK_ROWS = 65536  # Matrix rows scored per step, bounds memory
+EMBED_CHUNK_ROWS = 16384  # Dishes embedded per step of a build, bounds memory
+IVF_ITERATIONS = 10  # k-means iterations when building IVF lists
+DEFAULT_NPROBE = 8  # IVF lists scanned per query
+
+
+@lru_cache(maxsize=1 << 18)
+def word_features(word: str, dim: int):
+    """
+    Signed buckets of a word and its padded character n-grams. Menu
+    vocabularies are small, so most words come from the cache
+    """
+    padded = f" {word} "
+    grams = [word]
+    for size in NGRAM_SIZES:
+        grams.extend(padded[i:i + size] for i in range(len(padded) - size + 1))
+    buckets, signs = [], []
+    for gram in grams:
+        h = zlib.crc32(gram.encode('utf-8'))
+        buckets.append(h % dim)
+        # The top hash bit picks the sign so collisions tend to cancel out
+        signs.append(-1.0 if h & 0x80000000 else 1.0)
+    return buckets, signs
+
+
+def hashed_features(text: str, weight: float, dim: int,
+                    buckets: List[int], values: List[float]):
+    """
+    Append signed hashed word and character n-gram counts of `text`
+    """
+    for word in normalize_text(text).split():
+        word_buckets, signs = word_features(word, dim)
+        buckets.extend(word_buckets)
+        values.extend(signs if weight == 1.0 else [sign * weight for sign in signs])
+
+
+@lru_cache(maxsize=1 << 16)
+def dish_features(name: str, description: str, dim: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Sorted nonzero buckets of a dish and their summed values. Knowledge
+    base rows repeat names and descriptions, so most come from the cache
+    """
+    buckets, values = [], []
+    hashed_features(name, 1.0, dim, buckets, values)
+    if description:
+        hashed_features(description, DESCRIPTION_WEIGHT, dim, buckets, values)
+    unique, inverse = np.unique(np.array(buckets, dtype=np.int64), return_inverse=True)
+    sums = np.bincount(inverse, weights=values, minlength=len(unique)).astype(np.float32)
+    nonzero = sums != 0
+    return unique[nonzero], sums[nonzero]
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class DishEmbedder:
+    """
+    Turns dish text into unit float32 vectors, with a sentence-transformers
+    model when one is configured and installed, or TF-IDF weighted hashed
+    character n-grams otherwise
+    """
+
+    def __init__(self, model_name: Optional[str] = None, dim: int = HASH_DIM,
+                 idf: Optional[np.ndarray] = None):
+        self.model = None
+        if model_name and SentenceTransformer is not None:
+            self.model = SentenceTransformer(model_name, device='cpu')
+        elif model_name:
+            print(f"Warning: sentence-transformers is not installed, "
+                  f"using hashed n-gram embeddings instead of {model_name}")
+        self.model_name = model_name if self.model is not None else None
+        self.dim = self.model.get_sentence_embedding_dimension() if self.model else dim
+        self.idf = idf
+
+    def sparse(self, names: List[str], descriptions: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Unweighted hashed counts of dishes as ascending flat indices
+        `row * dim + bucket` and their nonzero values
+        """
+        features = [dish_features(name, description or '', self.dim)
+                    for name, description in zip(names, descriptions)]
+        if not features:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        rows = np.repeat(np.arange(len(features), dtype=np.int64),
+                         [len(buckets) for buckets, _ in features])
+        keys = rows * self.dim + np.concatenate([buckets for buckets, _ in features])
+        return keys, np.concatenate([values for _, values in features])
+
+    def dense(self, keys: np.ndarray, values: np.ndarray, rows: int) -> np.ndarray:
+        matrix = np.zeros((rows, self.dim), dtype=np.float32)
+        matrix.reshape(-1)[keys] = values
+        return matrix
+
+    def raw(self, names: List[str], descriptions: List[str]) -> np.ndarray:
+        """
+        Unweighted hashed counts, one row per dish
+        """
+        return self.dense(*self.sparse(names, descriptions), len(names))
+
+    def document_frequency(self, keys: np.ndarray) -> np.ndarray:
+        """
+        Number of dishes counting each hash bucket, from sparse keys
+        """
+        return np.bincount(keys % self.dim, minlength=self.dim)
+
+    def fit_idf(self, df: np.ndarray, count: int):
+        """
+        Inverse document frequency of each hash bucket, from the document
+        frequencies of `count` dishes
+        """
+        self.idf = (np.log((1 + count) / (1 + df.astype(np.float32))) + 1).astype(np.float32)
+
+    def weigh(self, matrix: np.ndarray) -> np.ndarray:
+        """
+        IDF weighted unit rows of raw hashed counts
+        """
+        if self.idf is not None:
+            matrix *= self.idf
+        return normalize_rows(matrix).astype(np.float32)
+
+    def embed(self, names: List[str], descriptions: Optional[List[str]] = None) -> np.ndarray:
+        descriptions = descriptions or [''] * len(names)
+        if self.model is not None:
+            texts = [f"{name}. {description}" if description else name
+                     for name, description in zip(names, descriptions)]
+            return self.model.encode(texts, batch_size=256, normalize_embeddings=True,
+                                     convert_to_numpy=True).astype(np.float32)
+        return self.weigh(self.raw(names, descriptions))
+
+
+def kmeans(matrix: np.ndarray, clusters: int, iterations: int = IVF_ITERATIONS,
+           seed: int = 0) -> np.ndarray:
+    """
+    Spherical k-means centroids of unit rows
+    """
+    rng = np.random.default_rng(seed)
+    centroids = matrix[rng.choice(len(matrix), clusters, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = assign_lists(matrix, centroids)
+        for cluster in range(clusters):
+            members = matrix[assignment == cluster]
+            if len(members):
+                centroids[cluster] = members.sum(axis=0)
+        centroids = normalize_rows(centroids).astype(np.float32)
+    return centroids
+
+
+def assign_lists(matrix: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    assignment = np.empty(len(matrix), dtype=np.int64)
+    for start in range(0, len(matrix), SEARCH_CHUNK_ROWS):
+        chunk = matrix[start:start + SEARCH_CHUNK_ROWS]
+        assignment[start:start + len(chunk)] = np.argmax(
+            chunk @ centroids.T, axis=1)
+    return assignment
+
+
+def build_embeddings(kb_dir: str, output_dir: str = EMBEDDINGS_DIR,
+                     model_name: Optional[str] = None, ivf_lists: int = 0) -> int:
+    """
+    Embed every knowledge base dish into a memory-mappable matrix and
+    return the number of dishes.
+
+    Dishes are embedded `EMBED_CHUNK_ROWS` at a time straight into the
+    memory-mapped matrix file; until the IDF weights are known, hashed
+    counts are kept sparse. Peak memory is a chunk of dense rows plus the
+    sparse counts, rather than several copies of the matrix.
+
+    With `ivf_lists`, rows are clustered and stored grouped by list, so
+    each list is a contiguous row range that a query can scan on its own
+    """
+    kb = KnowledgeBase(kb_dir)
+    dishes = [dish for dish in kb.load() if dish.get('dish_name')]
+    kb.close()
+
+    embedder = DishEmbedder(model_name)
+    names = [dish['dish_name'] for dish in dishes]
+    descriptions = [dish.get('description') or '' for dish in dishes]
+    chunks = [(start, min(start + EMBED_CHUNK_ROWS, len(dishes)))
+              for start in range(0, len(dishes), EMBED_CHUNK_ROWS)]
+    sparse_chunks = []
+    if embedder.model is None:
+        df = np.zeros(embedder.dim, dtype=np.int64)
+        for start, stop in chunks:
+            keys, values = embedder.sparse(names[start:stop], descriptions[start:stop])
+            df += embedder.document_frequency(keys)
+            sparse_chunks.append((keys, values))
+        embedder.fit_idf(df, len(dishes))
+
+    os.makedirs(output_dir, exist_ok=True)
+    meta = {'count': len(dishes), 'dim': int(embedder.dim),
+            'model': embedder.model_name, 'ngram_sizes': list(NGRAM_SIZES),
+            'ivf_lists': 0}
+
+    matrix_path = os.path.join(output_dir, MATRIX_FILE)
+    cluster = bool(ivf_lists and len(dishes) > ivf_lists)
+    # Clustered rows are reordered into the final file afterwards
+    embedded_path = matrix_path + (".unordered" if cluster else ".tmp")
+    matrix = np.lib.format.open_memmap(embedded_path, mode='w+', dtype=np.float32,
+                                       shape=(len(dishes), embedder.dim))
+    for i, (start, stop) in enumerate(chunks):
+        if sparse_chunks:
+            keys, values = sparse_chunks[i]
+            sparse_chunks[i] = None
+            matrix[start:stop] = embedder.weigh(embedder.dense(keys, values, stop - start))
+        else:
+            matrix[start:stop] = embedder.embed(names[start:stop], descriptions[start:stop])
+    matrix.flush()
+
+    if cluster:
+        centroids = kmeans(matrix, ivf_lists)
+        assignment = assign_lists(matrix, centroids)
+        order = np.argsort(assignment, kind='stable')
+        ordered = np.lib.format.open_memmap(matrix_path + ".tmp", mode='w+', dtype=np.float32,
+                                            shape=matrix.shape)
+        for start, stop in chunks:
+            ordered[start:stop] = matrix[order[start:stop]]
+        ordered.flush()
+        del matrix, ordered
+        os.remove(embedded_path)
+        dishes = [dishes[i] for i in order]
+        counts = np.bincount(assignment, minlength=ivf_lists)
+        np.save(os.path.join(output_dir, CENTROIDS_FILE), centroids)
+        np.save(os.path.join(output_dir, LIST_OFFSETS_FILE),
+                np.concatenate([[0], np.cumsum(counts)]).astype(np.int64))
+        meta['ivf_lists'] = ivf_lists
+    else:
+        del matrix
+
+    os.replace(matrix_path + ".tmp", matrix_path)
+    if embedder.idf is not None:
+        np.save(os.path.join(output_dir, IDF_FILE), embedder.idf)
+    os.replace(write_segment(output_dir, dishes),
+               os.path.join(output_dir, DISHES_FILE))
+    with open(os.path.join(output_dir, META_FILE), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, indent=2)
+    return len(dishes)
+
+
+class DishEmbeddingIndex:
+    """
+    Memory-mapped dish embeddings with batched top-k cosine search.
+
+    Queries are embedded together and scored against the matrix in
+    chunks of rows, keeping only the running top-k per query. With IVF
+    lists, each query only scans the `nprobe` lists nearest to it
+    """
+
+    def __init__(self, index_dir: str = EMBEDDINGS_DIR):
+        with open(os.path.join(index_dir, META_FILE), 'r', encoding='utf-8') as f:
+            self.meta = json.load(f)
+        self.matrix = np.load(os.path.join(
+            index_dir, MATRIX_FILE), mmap_mode='r')
+        self.dishes = Segment(os.path.join(index_dir, DISHES_FILE))
+        idf_path = os.path.join(index_dir, IDF_FILE)
+        idf = np.load(idf_path) if os.path.exists(idf_path) else None
+        self.embedder = DishEmbedder(
+            self.meta['model'], self.meta['dim'], idf)
+
+        self.centroids = self.list_offsets = None
+        if self.meta.get('ivf_lists'):
+            self.centroids = np.load(os.path.join(index_dir, CENTROIDS_FILE))
+            self.list_offsets = np.load(
+                os.path.join(index_dir, LIST_OFFSETS_FILE))
+
+    def __len__(self) -> int:
+        return len(self.matrix)
+
+    def _top_k(self, queries: np.ndarray, row_ranges: List[range], k: int):
+        """
+        Best (score, row) pairs over the given row ranges for each query
+        """
+        best_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        best_rows = np.full((len(queries), k), -1, dtype=np.int64)
+        for rows in row_ranges:
+            for start in range(rows.start, rows.stop, SEARCH_CHUNK_ROWS):
+                stop = min(start + SEARCH_CHUNK_ROWS, rows.stop)
+                scores = queries @ self.matrix[start:stop].T
+                candidate_scores = np.concatenate([best_scores, scores], axis=1)
+                candidate_rows = np.concatenate(
+                    [best_rows, np.broadcast_to(np.arange(start, stop), scores.shape)], axis=1)
+                keep = np.argpartition(-candidate_scores, k - 1, axis=1)[:, :k]
+                best_scores = np.take_along_axis(candidate_scores, keep, axis=1)
+                best_rows = np.take_along_axis(candidate_rows, keep, axis=1)
+        return best_scores, best_rows
+
+    def search(self, names: List[str], k: int = 5, nprobe: int = DEFAULT_NPROBE,
+               min_score: float = 0.0) -> List[List[Dict]]:
+        """
+        Top-k dishes for each query text, best first, with a cosine 'score'
+        """
+        if not names or not len(self.matrix):
+            return [[] for _ in names]
+        k = min(k, len(self.matrix))
+        queries = self.embedder.embed(names)
+
+        if self.centroids is None:
+            groups = [(np.arange(len(queries)), [range(0, len(self.matrix))])]
+        else:
+            # Queries probing the same lists are scored together
+            nearest = np.argsort(-(queries @ self.centroids.T), axis=1)[:, :nprobe]
+            by_lists: Dict[tuple, List[int]] = {}
+            for i, lists in enumerate(nearest):
+                by_lists.setdefault(tuple(sorted(lists)), []).append(i)
+            groups = [(np.array(members),
+                       [range(int(self.list_offsets[i]), int(self.list_offsets[i + 1]))
+                        for i in lists])
+                      for lists, members in by_lists.items()]
+
+        results: List[List[Dict]] = [[] for _ in names]
+        for members, row_ranges in groups:
+            scores, rows = self._top_k(queries[members], row_ranges, k)
+            for query, query_scores, query_rows in zip(members, scores, rows):
+                for score, row in sorted(zip(query_scores, query_rows), reverse=True):
+                    if row < 0 or score < min_score:
+                        continue
+                    dish = self.dishes.row(int(row))
+                    dish['score'] = round(float(score), 4)
+                    results[query].append(dish)
+        return results
+
+    def close(self):
+        self.dishes.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Embed knowledge base dishes and match menu items against them")
+    parser.add_argument('--index', default=EMBEDDINGS_DIR,
+                        help="Embeddings directory")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build_parser = subparsers.add_parser(
+        'build', help="Embed a knowledge base directory")
+    build_parser.add_argument('--kb', default="knowledge_base",
+                              help="Knowledge base directory")
+    build_parser.add_argument('--model', default=None,
+                              help="sentence-transformers model name (default: hashed n-grams)")
+    build_parser.add_argument('--ivf', type=int, default=0,
+                              help="Number of IVF lists (0 scans every row)")
+
+    match_parser = subparsers.add_parser(
+        'match', help="Match menu items, one per line, to dishes")
+    match_parser.add_argument('menu', nargs='?', default=None,
+                              help="Text file of menu items (default: items from --item)")
+    match_parser.add_argument('--item', action='append', default=[],
+                              help="Menu item to match; repeatable")
+    match_parser.add_argument('-k', type=int, default=5)
+    match_parser.add_argument('--nprobe', type=int, default=DEFAULT_NPROBE)
+    match_parser.add_argument('--min-score', type=float, default=0.0)
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'build':
+        start = time.monotonic()
+        count = build_embeddings(args.kb, args.index, args.model, args.ivf)
+        print(f"Embedded {count} dishes into {args.index}/ "
+              f"in {time.monotonic() - start:.1f}s")
+    elif args.command == 'match':
+        items = list(args.item)
+        if args.menu:
+            with open(args.menu, 'r', encoding='utf-8') as f:
+                items.extend(line.strip() for line in f if line.strip())
+        index = DishEmbeddingIndex(args.index)
+        start = time.perf_counter()
+        matches = index.search(items, k=args.k, nprobe=args.nprobe,
+                               min_score=args.min_score)
+        took = (time.perf_counter() - start) * 1000
+        for item, dishes in zip(items, matches):
+            print(json.dumps({'item': item, 'matches': [
+                {'dish_name': dish['dish_name'], 'place_id': dish['place_id'],
+                 'photo_url': dish['photo_url'], 'score': dish['score']}
+                for dish in dishes]}, ensure_ascii=False))
+        print(f"Matched {len(items)} items in {took:.1f}ms")
+        index.close()
+
+
+if __name__ == "__main__":
+    main()
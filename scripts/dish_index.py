@@ -0,0 +1,327 @@
+import argparse
+import bisect
+import hashlib
+import json
+import mmap
+import os
+import re
+import struct
+import time
+import unicodedata
+from array import array
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Set
+from urllib.parse import parse_qs, urlsplit
+
+from kb_store import COLUMNS, KnowledgeBase, Segment, dish_photo_urls, write_segment
+
+INDEX_DIR = "dish_index"
+DISHES_FILE = "dishes.kbseg"  # Dishes sorted by place, as a kb_store segment
+INDEX_FILE = "names.idx"  # Trigram postings and the per-place partition
+
+INDEX_MAGIC = b"SFDI"
+INDEX_VERSION = 1
+# magic, version, dishes, grams, postings, places
+INDEX_HEADER = struct.Struct('<4sHIIII')
+
+MIN_SCORE = 0.35  # Minimum trigram Dice similarity for a fuzzy match
+DEFAULT_LIMIT = 10
+
+
+def normalize_text(text: str) -> str:
+    """
+    Lowercase, strip accents and collapse punctuation to single spaces
+    """
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    return re.sub(r'[\W_]+', ' ', text.lower()).strip()
+
+
+def name_grams(name: str) -> Set[str]:
+    """
+    Character trigrams of each word, padded so short words and word
+    boundaries still produce grams
+    """
+    grams = set()
+    for word in normalize_text(name).split():
+        padded = f" {word} "
+        for i in range(len(padded) - 2):
+            grams.add(padded[i:i + 3])
+    return grams
+
+
+def gram_hash(gram: str) -> int:
+    return int.from_bytes(hashlib.blake2b(gram.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+def _align(f, boundary: int = 8):
+    padding = -f.tell() % boundary
+    if padding:
+        f.write(b"\0" * padding)
+
+
+def build_index(kb_dir: str, index_dir: str = INDEX_DIR) -> int:
+    """
+    Build the dish name index from a knowledge base directory and return
+    the number of indexed dishes.
+
+    Dishes are sorted by place_id so each place is one contiguous row
+    range; postings are sorted row numbers, so restricting a lookup to a
+    place is two binary searches per gram. A canonical knowledge base
+    (see dish_dedup.py) keeps its photo lists
+    """
+    kb = KnowledgeBase(kb_dir)
+    dishes = [dish for dish in kb.load() if dish.get('dish_name')]
+    columns = list(COLUMNS)
+    for segment in kb.segments:
+        columns += [column for column in segment.columns if column not in columns]
+    kb.close()
+    dishes.sort(key=lambda dish: (dish.get('place_id') or '',
+                                  normalize_text(dish['dish_name'])))
+
+    postings = defaultdict(list)
+    gram_counts = array('H')
+    places = {}
+    for row, dish in enumerate(dishes):
+        grams = name_grams(dish['dish_name'])
+        gram_counts.append(min(len(grams), 0xFFFF))
+        for gram in grams:
+            postings[gram_hash(gram)].append(row)
+        start, _ = places.get(dish.get('place_id') or '', (row, row))
+        places[dish.get('place_id') or ''] = (start, row + 1)
+
+    os.makedirs(index_dir, exist_ok=True)
+    segment_path = write_segment(index_dir, dishes, columns=columns)
+    os.replace(segment_path, os.path.join(index_dir, DISHES_FILE))
+
+    gram_keys = sorted(postings)
+    place_keys = sorted((gram_hash(place_id), place_id) for place_id in places)
+    offsets = array('Q', [0])
+    rows = array('I')
+    for key in gram_keys:
+        rows.extend(postings[key])
+        offsets.append(len(rows))
+
+    temp_path = os.path.join(index_dir, INDEX_FILE + ".tmp")
+    with open(temp_path, 'wb') as f:
+        f.write(INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, len(dishes),
+                                  len(gram_keys), len(rows), len(place_keys)))
+        for section in (array('Q', gram_keys), offsets, rows, gram_counts,
+                        array('Q', [key for key, _ in place_keys]),
+                        array('I', [places[place_id][0]
+                              for _, place_id in place_keys]),
+                        array('I', [places[place_id][1] for _, place_id in place_keys])):
+            _align(f)
+            f.write(section.tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, os.path.join(index_dir, INDEX_FILE))
+    return len(dishes)
+
+
+class DishIndex:
+    """
+    Memory-mapped dish name index answering fuzzy name → photos lookups.
+
+    Matching is by trigram Dice similarity, optionally restricted to one
+    place_id. Nothing is parsed at open time beyond the header, so a
+    fresh process can answer its first query right away
+    """
+
+    def __init__(self, index_dir: str = INDEX_DIR):
+        self.dishes = Segment(os.path.join(index_dir, DISHES_FILE))
+        self._file = open(os.path.join(index_dir, INDEX_FILE), 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, dish_count, gram_count, posting_count, place_count = \
+            INDEX_HEADER.unpack_from(self._map, 0)
+        if magic != INDEX_MAGIC or version != INDEX_VERSION:
+            raise ValueError(f"Not a dish index: {index_dir}")
+
+        view = memoryview(self._map)
+        position = INDEX_HEADER.size
+        sections = []
+        for code, count in (('Q', gram_count), ('Q', gram_count + 1), ('I', posting_count),
+                            ('H', dish_count), ('Q', place_count), ('I', place_count),
+                            ('I', place_count)):
+            position += -position % 8
+            size = array(code).itemsize * count
+            sections.append(view[position:position + size].cast(code))
+            position += size
+        (self._gram_keys, self._offsets, self._postings, self._gram_counts,
+         self._place_keys, self._place_starts, self._place_ends) = sections
+
+    def __len__(self) -> int:
+        return len(self.dishes)
+
+    def place_range(self, place_id: str) -> Optional[range]:
+        key = gram_hash(place_id)
+        i = bisect.bisect_left(self._place_keys, key)
+        while i < len(self._place_keys) and self._place_keys[i] == key:
+            start = self._place_starts[i]
+            # Hashes can collide; the dish rows tell places apart
+            if self.dishes.value('place_id', start) == place_id:
+                return range(start, self._place_ends[i])
+            i += 1
+        return None
+
+    def search(self, name: str, place_id: Optional[str] = None,
+               limit: int = DEFAULT_LIMIT, min_score: float = MIN_SCORE) -> List[Dict]:
+        """
+        Dishes whose names best match `name`, best first, each with a
+        'score' between 0 and 1
+        """
+        grams = name_grams(name)
+        if not grams:
+            return []
+        rows = None
+        if place_id:
+            rows = self.place_range(place_id)
+            if rows is None:
+                return []
+
+        hits: Dict[int, int] = defaultdict(int)
+        for gram in grams:
+            key = gram_hash(gram)
+            i = bisect.bisect_left(self._gram_keys, key)
+            if i == len(self._gram_keys) or self._gram_keys[i] != key:
+                continue
+            postings = self._postings[self._offsets[i]:self._offsets[i + 1]]
+            if rows is not None:
+                postings = postings[bisect.bisect_left(postings, rows.start):
+                                    bisect.bisect_left(postings, rows.stop)]
+            for row in postings:
+                hits[row] += 1
+
+        scored = []
+        for row, count in hits.items():
+            score = 2 * count / (len(grams) + self._gram_counts[row])
+            if score >= min_score:
+                scored.append((score, row))
+        scored.sort(key=lambda match: (-match[0], match[1]))
+
+        results = []
+        for score, row in scored[:limit]:
+            dish = self.dishes.row(row)
+            dish['score'] = round(score, 4)
+            results.append(dish)
+        return results
+
+    def image_urls(self, name: str, place_id: Optional[str] = None,
+                   count: int = DEFAULT_LIMIT) -> List[str]:
+        """
+        Photo URLs of the best matching dishes, without repeats
+        """
+        urls = []
+        for dish in self.search(name, place_id, limit=max(count * 2, count + 5)):
+            urls.extend(url for url in dish_photo_urls(dish) if url not in urls)
+            if len(urls) >= count:
+                break
+        return urls[:count]
+
+    def close(self):
+        for section in (self._gram_keys, self._offsets, self._postings, self._gram_counts,
+                        self._place_keys, self._place_starts, self._place_ends):
+            section.release()
+        self._map.close()
+        self._file.close()
+        self.dishes.close()
+
+
+class DishIndexHandler(BaseHTTPRequestHandler):
+    """
+    `GET /search?name=...&place_id=...&count=...` returning matched photo
+    URLs, as the image matcher expects them
+    """
+
+    index: DishIndex = None
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path != '/search':
+            self.send_json(404, {'error': 'Not found'})
+            return
+        query = parse_qs(url.query)
+        name = query.get('name', [''])[0]
+        place_id = query.get('place_id', [''])[0] or None
+        try:
+            count = max(1, min(100, int(query.get('count', [DEFAULT_LIMIT])[0])))
+        except ValueError:
+            count = DEFAULT_LIMIT
+
+        start = time.perf_counter()
+        image_urls = self.index.image_urls(name, place_id, count=count)
+        matches = self.index.search(name, place_id, limit=count)
+        self.send_json(200, {
+            'imageUrls': image_urls,
+            'matches': [{'dish_name': dish['dish_name'], 'place_id': dish['place_id'],
+                         'photo_url': dish['photo_url'], 'score': dish['score']}
+                        for dish in matches],
+            'took_ms': round((time.perf_counter() - start) * 1000, 3)
+        })
+
+    def send_json(self, status: int, body: Dict):
+        data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Build and query a local fuzzy index of knowledge base dish names")
+    parser.add_argument('--index', default=INDEX_DIR, help="Index directory")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build_parser = subparsers.add_parser(
+        'build', help="Index a knowledge base directory")
+    build_parser.add_argument('--kb', default="knowledge_base",
+                              help="Knowledge base directory")
+
+    query_parser = subparsers.add_parser('query', help="Look up a dish name")
+    query_parser.add_argument('name')
+    query_parser.add_argument('--place-id', default=None)
+    query_parser.add_argument('--limit', type=int, default=DEFAULT_LIMIT)
+
+    serve_parser = subparsers.add_parser(
+        'serve', help="Answer lookups over HTTP")
+    serve_parser.add_argument('--host', default='127.0.0.1')
+    serve_parser.add_argument('--port', type=int, default=8780)
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'build':
+        start = time.monotonic()
+        count = build_index(args.kb, args.index)
+        print(f"Indexed {count} dishes into {args.index}/ "
+              f"in {time.monotonic() - start:.1f}s")
+    elif args.command == 'query':
+        index = DishIndex(args.index)
+        start = time.perf_counter()
+        matches = index.search(args.name, args.place_id, limit=args.limit)
+        took = (time.perf_counter() - start) * 1000
+        for dish in matches:
+            print(f"{dish['score']:.2f}  {dish['dish_name']}  "
+                  f"({dish['restaurant_name']})  {dish['photo_url']}")
+        print(f"{len(matches)} matches in {took:.3f}ms")
+        index.close()
+    elif args.command == 'serve':
+        DishIndexHandler.index = DishIndex(args.index)
+        server = ThreadingHTTPServer((args.host, args.port), DishIndexHandler)
+        print(f"Serving {len(DishIndexHandler.index)} dishes at "
+              f"http://{args.host}:{args.port}/search")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,413 @@
+import argparse
+import asyncio
+import importlib
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, Sequence
+
+from area_sweep import Point, Tile, circle_intersects_polygon, place_in_area, subdivide
+from metrics import add_metrics_arguments, http_client_collector, metrics
+from rate_limiter import add_quota_arguments
+
+# The stage scripts have hyphenated file names, so import them by name
+crawler = importlib.import_module("place-scrawler")
+marker = importlib.import_module("image-marker")
+
+# Stages are connected by bounded queues: a full queue holds the stage
+# feeding it back, so memory stays flat however far the search runs
+# ahead of analysis
+QUEUE_SIZE = 100  # Places or restaurants waiting between two stages
+SEARCH_WORKERS = 8  # Places searches in flight
+RESTAURANT_WORKERS = 8  # Restaurants analyzed at once, sharing the Dify requests below
+# Dify requests in flight across restaurants. Replaces the analysis
+# --workers limit; the --rps limiter paces them
+DIFY_CONCURRENCY = 256
+BATCH_WAIT = 2.0  # Seconds a short Apify batch waits for more places
+
+# End of a stage's output
+DONE = object()
+
+
+class Engine:
+    """
+    Crawl and analysis in one process, as asyncio stages:
+
+        search → places → photo discovery → restaurants → analysis
+
+    Every stage runs the existing blocking functions on a thread pool,
+    a fixed number at a time, so the event loop only moves work between
+    the queues. Dify requests in flight are bounded by
+    `dify_concurrency`, shared by every restaurant being analyzed and
+    paced by the rate limiter, so a few restaurants at once keep
+    hundreds of requests busy across restaurant boundaries.
+
+    `crawl()` runs all stages, `analyze_restaurants()` only the
+    analysis of given records; `search()`, `discover()` and `analyze()`
+    are the stages themselves, for callers wiring queues of their own
+    """
+
+    def __init__(self, analysis: Optional[Dict] = None, quota_file: Optional[str] = None,
+                 search_workers: int = SEARCH_WORKERS,
+                 discovery_workers: int = crawler.MAX_CONCURRENT_RUNS,
+                 restaurant_workers: int = RESTAURANT_WORKERS,
+                 dify_concurrency: int = DIFY_CONCURRENCY,
+                 queue_size: int = QUEUE_SIZE):
+        self.analysis_options = dict(analysis or {})
+        self.analysis_options.setdefault('quota_file', quota_file)
+        self.analysis_options['workers'] = dify_concurrency
+        self.quota_file = quota_file
+        self.search_workers = search_workers
+        self.discovery_workers = discovery_workers
+        self.restaurant_workers = restaurant_workers
+        self.queue_size = queue_size
+        self.executor = ThreadPoolExecutor(
+            max_workers=search_workers + discovery_workers + restaurant_workers)
+
+        self.run = None
+        self.places_metrics = None
+        self.store = None
+        self.output_filename = None
+        self.tiles_queried = 0
+        self.places_found = 0
+        self.crawled = 0
+        self.skipped = 0
+        self.quota_reported = False
+
+    async def call(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(
+            self.executor, function, *args)
+
+    def queue(self) -> asyncio.Queue:
+        return asyncio.Queue(self.queue_size)
+
+    async def search(self, tiles: Sequence[Tile], places: asyncio.Queue,
+                     polygon: Optional[Sequence[Point]] = None,
+                     min_radius: Optional[float] = None):
+        """
+        Query every tile and put each place inside `polygon` not seen
+        before on `places`, then DONE. Like `area_sweep.sweep_area()`, a
+        failed search is tried again and reported, and a tile hitting the
+        result cap is split in four down to `min_radius`; None never splits
+        """
+        pending = asyncio.Queue()
+        seen = set()
+        failed = []
+
+        async def search_tile(tile: Tile):
+            lat, lng, radius = tile
+            for _ in range(crawler.SWEEP_ATTEMPTS):
+                results = await self.call(crawler.get_nearby_restaurants, lat, lng,
+                                          radius, crawler.PLACES_RESULT_CAP)
+                self.tiles_queried += 1
+                if results is not None:
+                    break
+            else:
+                failed.append(tile)
+                return
+            if min_radius is not None and len(results) >= crawler.PLACES_RESULT_CAP \
+                    and radius / math.sqrt(2) >= min_radius:
+                for child in subdivide(tile):
+                    if polygon is None or circle_intersects_polygon(child, polygon):
+                        pending.put_nowait(child)
+            for place in results:
+                if place.get('place_id') and place['place_id'] not in seen:
+                    seen.add(place['place_id'])
+                    if not place_in_area(place, polygon):
+                        continue
+                    self.places_found += 1
+                    await places.put(place)
+
+        async def worker():
+            while True:
+                tile = await pending.get()
+                try:
+                    await search_tile(tile)
+                finally:
+                    pending.task_done()
+
+        # The first tile is searched alone, so the output file, named
+        # after the first place found, is the same on every run
+        if tiles:
+            await search_tile(tiles[0])
+        for tile in tiles[1:]:
+            pending.put_nowait(tile)
+        workers = [asyncio.create_task(worker())
+                   for _ in range(self.search_workers)]
+        try:
+            await pending.join()
+        finally:
+            for task in workers:
+                task.cancel()
+        print(f"Search: {self.tiles_queried} tile queries, {self.places_found} unique places")
+        for lat, lng, radius in failed:
+            print(f"Search: failed {crawler.SWEEP_ATTEMPTS} times for tile "
+                  f"({lat:.6f}, {lng:.6f}, {radius:.0f}m), its places may be missing")
+        await places.put(DONE)
+
+    async def discover(self, places: asyncio.Queue, restaurants: asyncio.Queue, center: Point):
+        """
+        Save every place from `places` with its photos and put the saved
+        records on `restaurants`, then DONE. Places saved by an earlier
+        run are passed on as saved; the rest get their photos in batched
+        actor runs. The output file is named after the first place and
+        `center`, as in place-scrawler.py
+        """
+        batches = asyncio.Queue(self.discovery_workers)
+
+        async def batch_places():
+            batch = []
+            while True:
+                try:
+                    if batch:
+                        place = await asyncio.wait_for(places.get(), BATCH_WAIT)
+                    else:
+                        place = await places.get()
+                except asyncio.TimeoutError:
+                    # The search is slow; send what there is
+                    await batches.put(batch)
+                    batch = []
+                    continue
+                if place is DONE:
+                    break
+
+                if self.store is None:
+                    self.output_filename, self.store = crawler.open_output_store(
+                        center[0], center[1], place)
+                if place['place_id'] in self.store:
+                    self.skipped += 1
+                    await restaurants.put(self.store.get(place['place_id']))
+                    continue
+                batch.append(place)
+                if len(batch) >= crawler.PLACES_PER_RUN:
+                    await batches.put(batch)
+                    batch = []
+            if batch:
+                await batches.put(batch)
+            for _ in range(self.discovery_workers):
+                await batches.put(DONE)
+
+        async def worker():
+            while True:
+                batch = await batches.get()
+                if batch is DONE:
+                    return
+                photos = await self.call(crawler.discover_batch, batch)
+                if photos is None:
+                    # Not saved, so the next run discovers them again
+                    continue
+                for place in batch:
+                    record = crawler.restaurant_record(
+                        place, photos.get(place['place_id'], []))
+                    with metrics.timer('store_write'):
+                        self.store.add(record)
+                    self.crawled += 1
+                    metrics.inc('restaurants_crawled', mode='new')
+                    metrics.inc('photos_discovered', record['photo_count'])
+                    print(f"{place['name']}: {record['photo_count']} photos saved")
+                    await restaurants.put(record)
+
+        await asyncio.gather(batch_places(),
+                             *(worker() for _ in range(self.discovery_workers)))
+        await restaurants.put(DONE)
+
+    async def analyze(self, restaurants: asyncio.Queue):
+        """
+        Analyze restaurant records from `restaurants` until DONE, several
+        at a time. Once the daily Dify budget is used up the rest are
+        only drained, so the stages feeding them can finish
+        """
+        run = self.run
+
+        async def worker():
+            while True:
+                restaurant = await restaurants.get()
+                if restaurant is DONE:
+                    # Let the other workers see it too
+                    await restaurants.put(DONE)
+                    return
+                if run.quota_exhausted:
+                    continue
+                if not run.is_done(restaurant):
+                    run.progress.add_total(len(restaurant.get('photo_urls', [])))
+                try:
+                    await self.call(run.process_restaurant, restaurant)
+                except Exception as e:
+                    print(f"Error processing {restaurant.get('restaurant_name')}: {e}")
+                if run.quota_exhausted and not self.quota_reported:
+                    self.quota_reported = True
+                    print(f"Daily Dify budget used up, leaving the remaining "
+                          f"restaurants for the next run")
+
+        await asyncio.gather(*(worker() for _ in range(self.restaurant_workers)))
+
+    def start_analysis(self):
+        if self.run is None:
+            self.run = marker.AnalysisRun(**self.analysis_options)
+
+    def finish(self, latitude: Optional[float] = None, longitude: Optional[float] = None) -> Dict:
+        """
+        Close the stores and the analysis run, writing both summaries.
+        Returns the run's counters
+        """
+        totals = {'tiles_queried': self.tiles_queried, 'places_found': self.places_found,
+                  'crawled': self.crawled, 'skipped': self.skipped}
+        if self.store is not None:
+            summary_file, total_restaurants, total_photos = crawler.write_summary(
+                self.store, self.output_filename, latitude, longitude)
+            self.store.close()
+            print(f"Crawl: {self.crawled} restaurants saved, {self.skipped} already saved; "
+                  f"{total_restaurants} restaurants, {total_photos} photos in {self.store.path}")
+            print(f"  - Text summary: {summary_file}")
+            totals['output_file'] = self.store.path
+        if self.run is not None:
+            self.run.close()
+            totals.update(self.run.totals())
+        if self.places_metrics is not None:
+            metrics.flush()
+            metrics.remove_collector(self.places_metrics)
+            self.places_metrics = None
+        self.executor.shutdown(wait=True)
+        return totals
+
+    async def crawl(self, tiles: Sequence[Tile], center: Point,
+                    polygon: Optional[Sequence[Point]] = None,
+                    min_radius: Optional[float] = None, analyze: bool = True) -> Dict:
+        """
+        Search `tiles`, discover photos and analyze every restaurant as
+        soon as it is saved. Returns the counters of the run
+        """
+        started = time.monotonic()
+        crawler.setup_limiters(self.quota_file)
+        crawler.places_client.set_pool_size(self.search_workers)
+        self.places_metrics = http_client_collector('places', crawler.places_client)
+        metrics.add_collector(self.places_metrics)
+        if analyze:
+            self.start_analysis()
+        print(f"Searching {len(tiles)} tiles ({self.search_workers} at once), "
+              f"{crawler.PLACES_PER_RUN} places per actor run ({self.discovery_workers} at once)"
+              + (f", {self.restaurant_workers} restaurants analyzed at once" if analyze else ""))
+
+        places = self.queue()
+        restaurants = self.queue()
+        stages = [self.search(tiles, places, polygon, min_radius),
+                  self.discover(places, restaurants, center)]
+        if analyze:
+            stages.append(self.analyze(restaurants))
+        else:
+            stages.append(drain(restaurants))
+        try:
+            await asyncio.gather(*stages)
+        finally:
+            if self.run is not None and self.store is not None:
+                self.run.input_files.append(self.store.path)
+            metrics.observe('engine', time.monotonic() - started)
+            totals = self.finish(*center)
+        return totals
+
+    async def analyze_restaurants(self, restaurants: Iterable[Dict],
+                                  input_files: Sequence[str] = ()) -> Dict:
+        """
+        Analyze restaurant records, e.g. streamed from crawler output
+        files; the bounded queue keeps reading no further ahead than the
+        analysis. Returns the counters of the run
+        """
+        self.start_analysis()
+        self.run.input_files.extend(input_files)
+        queue = self.queue()
+
+        async def feed():
+            for restaurant in restaurants:
+                if self.run.quota_exhausted:
+                    break
+                await queue.put(restaurant)
+            await queue.put(DONE)
+
+        try:
+            await asyncio.gather(feed(), self.analyze(queue))
+        finally:
+            totals = self.finish()
+        return totals
+
+
+async def drain(queue: asyncio.Queue):
+    """
+    Consume a queue until DONE
+    """
+    while await queue.get() is not DONE:
+        pass
+
+
+def engine_options(args: argparse.Namespace) -> Dict:
+    return {
+        'analysis': marker.analysis_options(args),
+        'quota_file': args.quota_file,
+        'search_workers': args.search_workers,
+        'discovery_workers': args.discovery_workers,
+        'restaurant_workers': args.restaurant_workers,
+        'dify_concurrency': args.dify_concurrency,
+        'queue_size': args.queue_size
+    }
+
+
+def iter_input_restaurants(input_files: List[str]):
+    for input_file in input_files:
+        yield from marker.load_restaurants(input_file)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Single-process asyncio crawl → analyze engine")
+    parser.add_argument('--search-workers', type=int, default=SEARCH_WORKERS,
+                        help="Places searches in flight")
+    parser.add_argument('--discovery-workers', type=int, default=crawler.MAX_CONCURRENT_RUNS,
+                        help="Apify actor runs in flight")
+    parser.add_argument('--restaurant-workers', type=int, default=RESTAURANT_WORKERS,
+                        help="Restaurants analyzed at once")
+    parser.add_argument('--dify-concurrency', type=int, default=DIFY_CONCURRENCY,
+                        help="Dify requests in flight across restaurants, "
+                             "paced by --rps (replaces --workers)")
+    parser.add_argument('--queue-size', type=int, default=QUEUE_SIZE,
+                        help="Items buffered between two stages")
+    add_metrics_arguments(parser)
+    add_quota_arguments(parser)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser(
+        'run', help="Crawl an area and analyze restaurants as they are saved")
+    crawler.add_crawl_arguments(run_parser)
+    marker.add_analysis_arguments(run_parser)
+    run_parser.add_argument('--no-analysis', action='store_true',
+                            help="Only search and discover photos")
+
+    analyze_parser = subparsers.add_parser(
+        'analyze', help="Analyze restaurants from crawler output files")
+    analyze_parser.add_argument('inputs', nargs='*',
+                                help=f"Crawler output files (default: all files in {marker.OUTPUT_DIR}/)")
+    analyze_parser.add_argument('--backfill', action='store_true',
+                                help=f"Analyze the photos sampling deferred to "
+                                     f"{marker.DEFERRED_PHOTOS_FILE} instead of crawler output")
+    marker.add_analysis_arguments(analyze_parser)
+
+    args = parser.parse_args(argv)
+    metrics.configure(args.metrics_events, args.prometheus)
+    engine = Engine(**engine_options(args))
+
+    if args.command == 'run':
+        if args.refresh:
+            parser.error("--refresh is not supported here, use place-scrawler.py --refresh")
+        tiles, polygon, center = crawler.search_area(args)
+        min_radius = crawler.SWEEP_MIN_RADIUS if args.bbox or args.polygon else None
+        asyncio.run(engine.crawl(tiles, center, polygon, min_radius,
+                                 analyze=not args.no_analysis))
+    elif args.command == 'analyze':
+        if args.backfill and args.inputs:
+            parser.error("--backfill takes no input files")
+        input_files = marker.backfill_input_files() if args.backfill \
+            else args.inputs or marker.find_input_files()
+        asyncio.run(engine.analyze_restaurants(
+            iter_input_restaurants(input_files), input_files))
+
+
+if __name__ == "__main__":
+    main()
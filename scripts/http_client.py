@@ -0,0 +1,190 @@
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Dict, List, Optional
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Status codes worth retrying: throttling and transient server errors
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class EndpointStats:
+    """
+    Latency and error counters for a single endpoint
+    """
+
+    def __init__(self):
+        self.requests = 0
+        self.retries = 0
+        self.errors = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self.status_counts: Dict[str, int] = {}
+
+    def record(self, latency: float, status: str, error: bool):
+        self.requests += 1
+        self.total_latency += latency
+        self.max_latency = max(self.max_latency, latency)
+        self.status_counts[status] = self.status_counts.get(status, 0) + 1
+        if error:
+            self.errors += 1
+
+    def to_dict(self) -> Dict:
+        return {
+            'requests': self.requests,
+            'retries': self.retries,
+            'errors': self.errors,
+            'avg_latency': self.total_latency / self.requests if self.requests else 0.0,
+            'max_latency': self.max_latency,
+            'status_counts': dict(self.status_counts)
+        }
+
+
+class HttpClient:
+    """
+    Pooled HTTP client shared by the ingestion scripts.
+
+    Keeps connections alive per host, applies explicit timeouts and retries
+    throttled or failed requests with jittered exponential backoff,
+    honouring `Retry-After` when the server sends one.
+    """
+
+    def __init__(self, timeout=(10, 60), max_retries: int = 4,
+                 backoff_base: float = 0.5, backoff_max: float = 30.0,
+                 pool_size: int = 10):
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        self.session = requests.Session()
+        self.set_pool_size(pool_size)
+
+        self._stats: Dict[str, EndpointStats] = {}
+        self._lock = threading.Lock()
+        # Rate limiter paused on 429s, so everyone pacing through it backs
+        # off together instead of retrying into the same throttle. Callers
+        # take the token of a request's first attempt; every retry takes
+        # one more, so retries count against the shared rate and budget
+        self.limiter = None
+
+    def set_pool_size(self, pool_size: int):
+        """
+        Size the per-host connection pool, e.g. to match a worker count
+        """
+        adapter = HTTPAdapter(pool_connections=pool_size,
+                              pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def _endpoint_stats(self, endpoint: str) -> EndpointStats:
+        with self._lock:
+            if endpoint not in self._stats:
+                self._stats[endpoint] = EndpointStats()
+            return self._stats[endpoint]
+
+    def _backoff_delay(self, attempt: int, response: Optional[requests.Response]) -> float:
+        """
+        Delay before the next attempt, preferring the server's Retry-After
+        """
+        if response is not None:
+            retry_after = parse_retry_after(
+                response.headers.get('Retry-After'))
+            if retry_after is not None:
+                return min(retry_after, self.backoff_max) + random.uniform(0, self.backoff_base)
+        # Full jitter keeps parallel workers from retrying in lockstep
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def request(self, method: str, url: str, endpoint: str = None, **kwargs) -> requests.Response:
+        """
+        Send a request, retrying on connection errors and retryable statuses.
+
+        Returns the final response (which may still be an error status) or
+        raises the last `requests.RequestException` once retries run out,
+        or QuotaExceeded when a retry finds the daily budget used up.
+        """
+        endpoint = endpoint or endpoint_name(url)
+        stats = self._endpoint_stats(endpoint)
+        kwargs.setdefault('timeout', self.timeout)
+
+        for attempt in range(self.max_retries + 1):
+            if attempt and self.limiter is not None:
+                self.limiter.acquire()
+            start = time.monotonic()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except requests.RequestException as e:
+                with self._lock:
+                    stats.record(time.monotonic() - start,
+                                 type(e).__name__, True)
+                if attempt == self.max_retries:
+                    raise
+                delay = self._backoff_delay(attempt, None)
+            else:
+                failed = response.status_code >= 400
+                with self._lock:
+                    stats.record(time.monotonic() - start,
+                                 str(response.status_code), failed)
+                if response.status_code not in RETRY_STATUSES or attempt == self.max_retries:
+                    return response
+                delay = self._backoff_delay(attempt, response)
+                response.close()
+                if response.status_code == 429 and self.limiter is not None:
+                    self.limiter.pause(delay)
+
+            with self._lock:
+                stats.retries += 1
+            time.sleep(delay)
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request('POST', url, **kwargs)
+
+    def stats(self) -> Dict[str, Dict]:
+        """
+        Snapshot of per-endpoint counters
+        """
+        with self._lock:
+            return {endpoint: s.to_dict() for endpoint, s in self._stats.items()}
+
+    def format_stats(self) -> List[str]:
+        """
+        Human readable per-endpoint summary lines
+        """
+        lines = []
+        for endpoint, s in sorted(self.stats().items()):
+            lines.append(
+                f"{endpoint}: {s['requests']} requests, {s['retries']} retries, "
+                f"{s['errors']} errors, avg {s['avg_latency']*1000:.0f}ms, "
+                f"max {s['max_latency']*1000:.0f}ms")
+        return lines
+
+
+def endpoint_name(url: str) -> str:
+    """
+    Group requests by host and path, ignoring the query string
+    """
+    parts = urlsplit(url)
+    return f"{parts.netloc}{parts.path}"
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    Parse a Retry-After header given either in seconds or as an HTTP date
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
@@ -1,70 +1,201 @@
+import argparse
+import hashlib
 import json
-import requests
-import time
+import multiprocessing
 import os
 import glob
-from typing import Dict, List, Optional
+import shutil
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from analysis_cache import AnalysisCache
+from checkpoint_store import CheckpointStore
+from http_client import HttpClient
+from image_utils import dhash, thumbnail_url
+import kb_store
+from metrics import Progress, add_metrics_arguments, http_client_collector, metrics
+from mongo_loader import MONGODB_BATCH_SIZE, MongoBulkLoader, build_dish_document, open_collection
+from photo_dedup import dedupe_photos
+from photo_filter import PhotoPreFilter
+from photo_sampling import SAMPLE_ORDERS, SamplingPolicy
+from photo_store import RESIZE_WORKERS, PhotoStore
+from output_writers import MONGODB_COMMANDS_HEADER, JsonlWriter, KnowledgeBaseWriter, MongoCommandWriter
+from rate_limiter import QuotaExceeded, SharedTokenBucket, TokenBucket, add_quota_arguments, make_limiter
+from restaurant_store import RestaurantStore, iter_restaurants, photo_fingerprint
 
 # Configuration
 DIFY_TOKEN = "XXXXXXXXXXXXX"
 DIFY_WORKFLOW_URL = "https://api.dify.ai/v1/workflows/run"
+DIFY_FILES_URL = "https://api.dify.ai/v1/files/upload"
 
-# Automatically load all JSON files from outputs directory
+# Crawler output files (JSON / JSON lines) are read from this directory
 OUTPUT_DIR = "outputs"
-INPUT_FILES = glob.glob(os.path.join(OUTPUT_DIR, "*.json"))
-
-print(f"Found {len(INPUT_FILES)} JSON files in {OUTPUT_DIR} directory:")
-for file in INPUT_FILES:
-    print(f"  - {file}")
 
 # Configuration for knowledge base
 KNOWLEDGE_BASE_DIR = "knowledge_base"
-PROCESSED_PLACES_FILE = "processed_places.json"
+CHECKPOINT_FILE = "processed_places.jsonl"  # Append-only resume journal
+PROCESSED_PLACES_FILE = "processed_places.json"  # Legacy checkpoint, imported on load
+CHECKPOINT_BASE_FILE = None  # Read-only journal to resume from, set in file workers
 BATCH_SIZE = 100  # Save every 100 dishes
+# "segments" writes compact columnar segments (see kb_store.py),
+# "json" the older numbered knowledge_base_batch_NNN.json files
+KB_FORMAT = "segments"
+
+# Output files, appended to as photos are analyzed
+ANALYSIS_RESULTS_FILE = "photo_analysis_results.jsonl"
+MONGODB_COMMANDS_FILE = "mongodb_insert_commands.js"
+SUMMARY_FILE = "analysis_summary.txt"
+# "js" writes MONGODB_COMMANDS_FILE, "mongo" upserts straight into MongoDB
+# (see mongo_loader.py), "both" does both
+OUTPUT_MODE = "js"
+
+# Configuration for concurrent analysis
+ANALYSIS_WORKERS = 8  # Max in-flight Dify requests
+DIFY_REQUESTS_PER_SECOND = 5.0  # Sustained Dify request rate
+DIFY_BURST = 5  # Requests allowed back-to-back before pacing kicks in
+DIFY_TIMEOUT = (10, 120)  # Connect / read timeout in seconds
+DIFY_MAX_RETRIES = 4  # Retries on 429/5xx and connection errors
+# Dify workflow runs per UTC day across every process sharing a quota
+# file (--quota-file, see rate_limiter.py); None is unlimited
+DIFY_DAILY_BUDGET = None
+
+# Input files can be analyzed in parallel worker processes, each writing
+# its own output shard under SHARDS_DIR that is merged into the main
+# outputs when the worker finishes. The Dify rate and in-flight requests
+# are split between the workers, unless a quota file paces them together
+FILE_WORKERS = 1
+SHARDS_DIR = "analysis_shards"
+
+# Batched analysis packs several photos into one workflow run. It needs a
+# Dify workflow app that takes a file-list input and returns one analysis
+# per image, in order. 1 sends a single photo per request
+DIFY_BATCH_SIZE = 1
+DIFY_BATCH_TOKEN = DIFY_TOKEN  # API key of the batched workflow app
+DIFY_BATCH_INPUT = "images"  # File-list input variable of the batched workflow
+DIFY_BATCH_OUTPUT = "results"  # Output variable with the list of analyses
+
+# Configuration for the analysis cache
+ANALYSIS_CACHE_FILE = "analysis_cache.sqlite"
+ANALYSIS_CACHE_TTL_DAYS = 90  # Re-analyze photos older than this
+ANALYSIS_CACHE_MAX_ENTRIES = 500000
+ANALYSIS_CACHE_IMAGE_HASH = False  # Download photos to match them by perceptual hash
+
+# Optional local pre-filter that scores photo thumbnails before Dify:
+# "off", "audit" (score and record only) or "enforce" (skip rejected photos)
+PREFILTER_MODE = "off"
+PREFILTER_MODEL_FILE = "prefilter_model.json"  # Fitted by `photo_filter.py fit`
+
+# Near-duplicate photos of a restaurant are collapsed before analysis:
+# "url" merges size/crop variants of the same URL, "phash" also compares
+# perceptual hashes of downloaded thumbnails, "off" disables it
+PHOTO_DEDUP = "url"
+PHOTO_DEDUP_MAX_DISTANCE = 6  # Max differing hash bits for near-duplicates
+
+# Per-restaurant photo sampling (see photo_sampling.py): once a limit is
+# reached, the restaurant's remaining photos are deferred to
+# DEFERRED_PHOTOS_FILE, which a later `--backfill` run (or `pipeline.py
+# backfill`) analyzes in full. None disables a limit
+SAMPLE_MAX_PHOTOS = None  # Analyze at most this many photos
+SAMPLE_MAX_DISHES = None  # Stop after this many distinct dish names
+SAMPLE_MAX_NON_DISH_RUN = None  # Stop after this many non-dishes in a row
+SAMPLE_ORDER = "crawl"  # "crawl", "spread" or "prefilter"
+DEFERRED_PHOTOS_FILE = os.path.join(OUTPUT_DIR, "deferred_photos.jsonl")
+
+# Optional local photo store (see photo_store.py): "cache" downloads photos
+# and resizes thumbnails alongside analysis, "upload" also sends Dify the
+# uploaded thumbnail instead of the full-size remote URL, "off" disables it
+PHOTO_PREFETCH = "off"
+PHOTO_STORE_DIR = "photo_store"
+PHOTO_STORE_MAX_MB = 2048  # Least recently used photos are evicted beyond this
+
+# Structured metrics: stage timers, counters and events as JSON lines;
+# pass --prometheus to also keep a Prometheus text dump up to date
+METRICS_EVENTS_FILE = "metrics_events.jsonl"
+PROGRESS_INTERVAL = 5.0  # Seconds between progress/ETA lines
+
+# Shared pooled client so workers reuse keep-alive connections to Dify
+dify_client = HttpClient(timeout=DIFY_TIMEOUT, max_retries=DIFY_MAX_RETRIES,
+                         pool_size=ANALYSIS_WORKERS)
+# Client for downloading photo thumbnails from Google
+photo_client = HttpClient(timeout=(10, 30), max_retries=2,
+                          pool_size=ANALYSIS_WORKERS)
 
 
-def load_processed_places() -> List[str]:
+def load_restaurants(input_file: str) -> Iterator[Dict]:
     """
-    Load list of already processed place IDs
+    Stream restaurants from a crawler output file (.jsonl store or legacy .json list)
     """
-    if os.path.exists(PROCESSED_PLACES_FILE):
-        try:
-            with open(PROCESSED_PLACES_FILE, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except:
-            return []
-    return []
+    return iter_restaurants(input_file)
+
 
+# Dify upload ids by (API key, thumbnail hash), so retries and photos
+# sharing a thumbnail are uploaded once per app
+uploaded_files: Dict[Tuple[str, str], str] = {}
 
-def save_processed_place(place_id: str):
+
+def upload_dify_file(data: bytes, token: str) -> Optional[str]:
     """
-    Add a place ID to the processed list and save
+    Upload image bytes to Dify and return the upload file id
     """
-    processed_places = load_processed_places()
-    if place_id not in processed_places:
-        processed_places.append(place_id)
-        with open(PROCESSED_PLACES_FILE, 'w', encoding='utf-8') as f:
-            json.dump(processed_places, f, ensure_ascii=False, indent=2)
+    try:
+        with metrics.timer('dify_upload'):
+            response = dify_client.post(
+                DIFY_FILES_URL, headers={"Authorization": f"Bearer {token}"},
+                files={'file': ('photo.jpg', data, 'image/jpeg')},
+                data={'user': 'image-analyzer'})
+        metrics.inc('dify_uploads', status=response.status_code)
+        if response.status_code in (200, 201):
+            return response.json().get('id')
+        print(
+            f"Error uploading image to Dify: {response.status_code} - {response.text}")
+    except QuotaExceeded:
+        raise
+    except Exception as e:
+        print(f"Exception uploading image to Dify: {e}")
+    return None
 
 
-def save_knowledge_base_batch(dishes: List[Dict], batch_number: int):
+def dify_image_input(image_url: str, photos: Optional[PhotoStore] = None,
+                     token: Optional[str] = None) -> Dict:
     """
-    Save a batch of dishes to knowledge base JSON file
+    Workflow file input for an image: its stored thumbnail uploaded to
+    Dify when a photo store is given, otherwise the remote URL for Dify
+    to fetch. Falls back to the URL if the photo could not be stored
     """
-    if not os.path.exists(KNOWLEDGE_BASE_DIR):
-        os.makedirs(KNOWLEDGE_BASE_DIR)
-
-    filename = f"knowledge_base_batch_{batch_number:03d}.json"
-    filepath = os.path.join(KNOWLEDGE_BASE_DIR, filename)
+    if photos is not None:
+        token = token or DIFY_TOKEN
+        entry = photos.get(image_url)
+        if entry is not None and entry['thumbnail_sha']:
+            key = (token, entry['thumbnail_sha'])
+            if key not in uploaded_files:
+                upload_id = upload_dify_file(
+                    photos.read(entry['thumbnail_sha']), token)
+                if upload_id:
+                    uploaded_files[key] = upload_id
+            if key in uploaded_files:
+                return {
+                    "upload_file_id": uploaded_files[key],
+                    "transfer_method": "local_file",
+                    "type": "image",
+                }
+    return {
+        "url": image_url,
+        "transfer_method": "remote_url",
+        "type": "image",
+    }
 
-    with open(filepath, 'w', encoding='utf-8') as f:
-        json.dump(dishes, f, ensure_ascii=False, indent=2)
 
-    print(
-        f"    Saved knowledge base batch {batch_number} ({len(dishes)} dishes) to {filename}")
+def parse_dish_outputs(outputs: Dict) -> Dict:
+    return {
+        'is_a_dish': outputs.get('is_a_dish', 0),
+        'name': outputs.get('name', ''),
+        'desc': outputs.get('desc', '')
+    }
 
 
-def call_dify_workflow(image_url: str) -> Optional[Dict]:
+def call_dify_workflow(image_url: str, photos: Optional[PhotoStore] = None) -> Optional[Dict]:
     """
     Call Dify workflow to analyze image and return dish information
     """
@@ -76,50 +207,258 @@ def call_dify_workflow(image_url: str) -> Optional[Dict]:
 
         payload = {
             "inputs": {
-                "image": {
-                    "url": image_url,
-                    "transfer_method": "remote_url",
-                    "type": "image",
-                }
+                "image": dify_image_input(image_url, photos)
             },
             "response_mode": "blocking",
             "user": "image-analyzer"
         }
 
         print(f"Analyzing image: {image_url[:80]}...")
-        response = requests.post(
-            DIFY_WORKFLOW_URL, headers=headers, json=payload)
+        with metrics.timer('dify_call'):
+            response = dify_client.post(
+                DIFY_WORKFLOW_URL, headers=headers, json=payload)
+        metrics.inc('dify_calls', mode='single', status=response.status_code)
 
         if response.status_code == 200:
             result = response.json()
             outputs = result.get('data', {}).get('outputs', {})
 
-            return {
-                'is_a_dish': outputs.get('is_a_dish', 0),
-                'name': outputs.get('name', ''),
-                'desc': outputs.get('desc', '')
-            }
+            return parse_dish_outputs(outputs)
         else:
             print(
                 f"Error calling Dify workflow: {response.status_code} - {response.text}")
             return None
 
+    except QuotaExceeded:
+        raise
     except Exception as e:
         print(f"Exception calling Dify workflow: {e}")
         return None
 
 
+def call_dify_workflow_batch(image_urls: List[str],
+                             photos: Optional[PhotoStore] = None) -> List[Optional[Dict]]:
+    """
+    Analyze several images in one workflow run. Returns one entry per
+    image, None where the workflow gave no usable result for it
+    """
+    results: List[Optional[Dict]] = [None] * len(image_urls)
+    try:
+        headers = {
+            "Authorization": f"Bearer {DIFY_BATCH_TOKEN}",
+            "Content-Type": "application/json"
+        }
+
+        payload = {
+            "inputs": {
+                DIFY_BATCH_INPUT: [dify_image_input(url, photos, DIFY_BATCH_TOKEN)
+                                   for url in image_urls]
+            },
+            "response_mode": "blocking",
+            "user": "image-analyzer"
+        }
+
+        print(f"Analyzing batch of {len(image_urls)} images...")
+        with metrics.timer('dify_batch_call'):
+            response = dify_client.post(
+                DIFY_WORKFLOW_URL, headers=headers, json=payload)
+        metrics.inc('dify_calls', mode='batch', status=response.status_code)
+
+        if response.status_code != 200:
+            print(
+                f"Error calling Dify batch workflow: {response.status_code} - {response.text}")
+            return results
+
+        outputs = response.json().get('data', {}).get('outputs', {})
+        analyses = outputs.get(DIFY_BATCH_OUTPUT, [])
+        # LLM nodes hand lists back as JSON text
+        if isinstance(analyses, str):
+            analyses = json.loads(analyses)
+        if not isinstance(analyses, list) or len(analyses) != len(image_urls):
+            print(f"Dify batch workflow returned {len(analyses) if isinstance(analyses, list) else 'no'} "
+                  f"results for {len(image_urls)} images")
+            return results
+
+        for i, analysis in enumerate(analyses):
+            if isinstance(analysis, dict):
+                results[i] = parse_dish_outputs(analysis)
+        return results
+
+    except QuotaExceeded:
+        raise
+    except Exception as e:
+        print(f"Exception calling Dify batch workflow: {e}")
+        return results
+
+
+def fetch_thumbnail(image_url: str) -> Optional[bytes]:
+    """
+    Download a small rendition of the image
+    """
+    try:
+        with metrics.timer('thumbnail_fetch'):
+            response = photo_client.get(thumbnail_url(image_url))
+        if response.status_code == 200:
+            return response.content
+        print(f"Error downloading thumbnail: {response.status_code}")
+    except Exception as e:
+        print(f"Exception downloading thumbnail: {e}")
+    return None
+
+
+def image_hash_of(data: Optional[bytes]) -> Optional[str]:
+    """
+    Hex perceptual hash of image bytes
+    """
+    value = dhash(data) if data else None
+    return f"{value:016x}" if value is not None else None
+
+
+def photo_hash(image_url: str) -> Optional[int]:
+    """
+    Perceptual hash of a photo's thumbnail, used for near-duplicate detection
+    """
+    data = fetch_thumbnail(image_url)
+    return dhash(data) if data else None
+
+
+def screen_photo(image_url: str, cache: Optional[AnalysisCache] = None,
+                 prefilter: Optional[PhotoPreFilter] = None,
+                 photos: Optional[PhotoStore] = None
+                 ) -> Tuple[Optional[Dict], Optional[str], Optional[Dict]]:
+    """
+    Local checks before Dify. Returns the final analysis if no Dify call
+    is needed (cache hit or enforced pre-filter rejection), along with
+    the image hash and pre-filter decision to record with the Dify result.
+    Thumbnails come from the photo store when one is given
+    """
+    thumbnails = []
+
+    def thumbnail():
+        # Downloaded at most once, shared by hashing and the pre-filter
+        if not thumbnails:
+            thumbnails.append(photos.thumbnail(image_url) if photos is not None
+                              else fetch_thumbnail(image_url))
+        return thumbnails[0]
+
+    image_hash = None
+    if cache is not None:
+        hashes = []
+
+        def lookup_hash():
+            hashes.append(image_hash_of(thumbnail()))
+            return hashes[0]
+
+        with metrics.timer('cache_lookup'):
+            analysis = cache.get(
+                image_url, lookup_hash if ANALYSIS_CACHE_IMAGE_HASH else None)
+        if analysis is not None:
+            return analysis, None, None
+        image_hash = hashes[0] if hashes else None
+
+    decision = None
+    if prefilter is not None:
+        # Time the thumbnail download separately from scoring
+        data = thumbnail()
+        with metrics.timer('prefilter'):
+            decision = prefilter.evaluate(data)
+        if decision['rejected'] and prefilter.enforce:
+            decision = dict(decision, enforced=True)
+            return {'is_a_dish': 0, 'name': '', 'desc': '', 'prefilter': decision}, None, decision
+
+    return None, image_hash, decision
+
+
+def record_analysis(image_url: str, analysis: Optional[Dict],
+                    cache: Optional[AnalysisCache], image_hash: Optional[str],
+                    decision: Optional[Dict]) -> Optional[Dict]:
+    """
+    Cache a fresh Dify analysis and attach the pre-filter decision
+    """
+    if analysis is not None and cache is not None:
+        cache.put(image_url, analysis, image_hash)
+    if analysis is not None and decision is not None:
+        analysis = dict(analysis, prefilter=decision)
+    return analysis
+
+
+def analyze_photo(image_url: str, limiter: TokenBucket,
+                  cache: Optional[AnalysisCache] = None,
+                  prefilter: Optional[PhotoPreFilter] = None,
+                  photos: Optional[PhotoStore] = None,
+                  upload_photos: bool = False) -> Optional[Dict]:
+    """
+    Return the cached analysis of an image, or wait for a rate limit token
+    and analyze it with Dify. With a pre-filter, its decision is attached
+    under 'prefilter' and, when enforced, rejected photos skip Dify. With
+    `upload_photos`, Dify gets the stored thumbnail instead of the URL
+    """
+    analysis, image_hash, decision = screen_photo(
+        image_url, cache, prefilter, photos)
+    if analysis is not None:
+        return analysis
+
+    with metrics.timer('rate_limit_wait'):
+        limiter.acquire()
+    analysis = call_dify_workflow(
+        image_url, photos if upload_photos else None)
+    return record_analysis(image_url, analysis, cache, image_hash, decision)
+
+
+def analyze_photo_batch(image_urls: List[str], limiter: TokenBucket,
+                        cache: Optional[AnalysisCache] = None,
+                        prefilter: Optional[PhotoPreFilter] = None,
+                        photos: Optional[PhotoStore] = None,
+                        upload_photos: bool = False) -> Dict[str, Optional[Dict]]:
+    """
+    Like `analyze_photo()` for several images, sending every photo that
+    needs Dify in one batched workflow run. Photos the batch fails on
+    are retried one at a time
+    """
+    results = {}
+    pending = []
+    for image_url in image_urls:
+        analysis, image_hash, decision = screen_photo(
+            image_url, cache, prefilter, photos)
+        if analysis is not None:
+            results[image_url] = analysis
+        else:
+            pending.append((image_url, image_hash, decision))
+
+    upload_store = photos if upload_photos else None
+    batch_results = [None] * len(pending)
+    if len(pending) > 1:
+        with metrics.timer('rate_limit_wait'):
+            limiter.acquire()
+        batch_results = call_dify_workflow_batch(
+            [image_url for image_url, _, _ in pending], upload_store)
+
+    for (image_url, image_hash, decision), analysis in zip(pending, batch_results):
+        if analysis is None:
+            with metrics.timer('rate_limit_wait'):
+                limiter.acquire()
+            analysis = call_dify_workflow(image_url, upload_store)
+        results[image_url] = record_analysis(image_url, analysis,
+                                             cache, image_hash, decision)
+    return results
+
+
 def generate_mongodb_insert(restaurant_name: str, place_id: str, photo_url: str,
                             dish_name: str, description: str) -> str:
     """
     Generate MongoDB insert command for a dish
     """
+    # JSON string literals are valid JavaScript, so quotes, backslashes and
+    # newlines in the values are escaped correctly
+    def quote(value: str) -> str:
+        return json.dumps(value, ensure_ascii=False)
+
     insert_command = f'''db.dishes.insertOne({{
-    "dish_name": "{dish_name.replace('"', '\\"')}",
-    "description": "{description.replace('"', '\\"')}",
-    "photo_url": "{photo_url}",
-    "place_id": "{place_id}",
-    "restaurant_name": "{restaurant_name.replace('"', '\\"')}",
+    "dish_name": {quote(dish_name)},
+    "description": {quote(description)},
+    "photo_url": {quote(photo_url)},
+    "place_id": {quote(place_id)},
+    "restaurant_name": {quote(restaurant_name)},
     "created_at": new Date(),
     "verified": false
 }});'''
@@ -127,211 +466,1055 @@ def generate_mongodb_insert(restaurant_name: str, place_id: str, photo_url: str,
     return insert_command
 
 
-def process_restaurant_photos():
+class AnalysisRun:
     """
-    Main function to process restaurant photos and generate MongoDB insert commands
+    State of one analysis run: checkpoint, cache, output sinks, the
+    rate-limited worker pool and the counters for the summary report.
+
+    `process_restaurant()` can be called for restaurants from input files
+    or from the pipeline work queue, and from several threads at once
+    (see engine.py); `close()` flushes everything and writes the summary.
     """
-    if not INPUT_FILES:
-        print(f"No JSON files found in {OUTPUT_DIR} directory!")
-        return
 
-    # Load processed places for resume functionality
-    processed_places = load_processed_places()
-    print(f"Loaded {len(processed_places)} already processed places")
+    def __init__(self, workers: int = ANALYSIS_WORKERS,
+                 requests_per_second: float = DIFY_REQUESTS_PER_SECOND,
+                 output_mode: str = OUTPUT_MODE, batch_size: int = BATCH_SIZE,
+                 prefilter_mode: str = PREFILTER_MODE, dedup_mode: str = PHOTO_DEDUP,
+                 dify_batch_size: int = DIFY_BATCH_SIZE, kb_format: str = KB_FORMAT,
+                 prefetch_mode: str = PHOTO_PREFETCH, quota_file: Optional[str] = None,
+                 resize_workers: int = RESIZE_WORKERS,
+                 sample_max_photos: Optional[int] = SAMPLE_MAX_PHOTOS,
+                 sample_max_dishes: Optional[int] = SAMPLE_MAX_DISHES,
+                 sample_max_non_dish_run: Optional[int] = SAMPLE_MAX_NON_DISH_RUN,
+                 sample_order: str = SAMPLE_ORDER):
+        metrics.configure(METRICS_EVENTS_FILE)
+        self.workers = workers
+        self.requests_per_second = requests_per_second
+        self.dify_batch_size = dify_batch_size
+        self.input_files: List[str] = []
 
-    # Prepare output files
-    mongodb_commands = []
-    analysis_results = []
-    knowledge_base_dishes = []
-    current_batch = 1
-    total_kb_dishes = 0
+        # Load processed places and photos for resume functionality
+        self.checkpoint = CheckpointStore(
+            CHECKPOINT_FILE, legacy_path=PROCESSED_PLACES_FILE,
+            base_path=CHECKPOINT_BASE_FILE)
+        print(f"Loaded {len(self.checkpoint.places)} already processed places")
 
-    total_photos = 0
-    total_dishes = 0
-    total_non_dishes = 0
-    total_restaurants = 0
-    skipped_restaurants = 0
+        # Analyses shared across runs and overlapping input files
+        self.cache = AnalysisCache(ANALYSIS_CACHE_FILE,
+                                   ttl_seconds=ANALYSIS_CACHE_TTL_DAYS * 86400,
+                                   max_entries=ANALYSIS_CACHE_MAX_ENTRIES)
 
-    print(f"Processing {len(INPUT_FILES)} input files...")
+        # Output sinks are written photo by photo so a crash loses nothing
+        # already analyzed; only aggregate counters are kept in memory
+        self.results_writer = JsonlWriter(ANALYSIS_RESULTS_FILE)
+        self.mongodb_writer = None
+        if output_mode in ("js", "both"):
+            self.mongodb_writer = MongoCommandWriter(MONGODB_COMMANDS_FILE)
+        self.mongodb_loader = None
+        if output_mode in ("mongo", "both"):
+            self.mongodb_loader = MongoBulkLoader(
+                open_collection(), batch_size=MONGODB_BATCH_SIZE)
+        # Dish photos are checkpointed as pending until their upsert is
+        # written, so a crash or a failed bulk write only resends the upsert
+        self.mongodb_unflushed: Dict[Tuple[str, str], Dict] = {}
+        self.mongodb_failed: Dict[str, int] = {}
+        self.kb_writer = KnowledgeBaseWriter(
+            KNOWLEDGE_BASE_DIR, batch_size, kb_format)
+        self.restaurant_dish_counts = {}
+
+        self.dedup_mode = dedup_mode
+        self.prefilter = None
+        if prefilter_mode != "off":
+            self.prefilter = PhotoPreFilter(PREFILTER_MODEL_FILE,
+                                            enforce=prefilter_mode == "enforce")
+            print(f"Photo pre-filter enabled ({prefilter_mode} mode)")
+
+        # Deferred photos are analyzed in full when their file is processed
+        self.sampling = SamplingPolicy(sample_max_photos, sample_max_dishes,
+                                       sample_max_non_dish_run, sample_order)
+        self.backfill_sampling = SamplingPolicy()
+        self.scorer = self.prefilter
+        if sample_order == "prefilter" and self.scorer is None:
+            self.scorer = PhotoPreFilter(PREFILTER_MODEL_FILE)
+        self.deferred_store = RestaurantStore(DEFERRED_PHOTOS_FILE)
+        if self.sampling.limited:
+            print(f"Photo sampling enabled ({sample_order} order), "
+                  f"deferring skipped photos to {DEFERRED_PHOTOS_FILE}")
+
+        # Photos are downloaded and resized ahead of analysis, on pools of
+        # their own, and shared with the pre-filter and perceptual hashing
+        self.photo_store = None
+        self.upload_photos = prefetch_mode == "upload"
+        if prefetch_mode != "off":
+            self.photo_store = PhotoStore(PHOTO_STORE_DIR, PHOTO_STORE_MAX_MB << 20,
+                                          download_workers=workers,
+                                          resize_workers=resize_workers, client=photo_client)
+            print(f"Photo store enabled ({prefetch_mode} mode) in {PHOTO_STORE_DIR}/")
+
+        self.total_photos = 0
+        self.total_dishes = 0
+        self.total_non_dishes = 0
+        self.total_failed = 0
+        self.total_resumed = 0
+        self.total_prefiltered = 0
+        self.total_duplicates = 0
+        self.total_deferred = 0
+        self.total_restaurants = 0
+        self.skipped_restaurants = 0
+        # Set once the shared daily Dify budget runs out
+        self.quota_exhausted = False
+        # Held while a restaurant updates outputs and counters, and
+        # released while it waits for analyses, so restaurants processed
+        # at once keep each other's requests in flight
+        self.lock = threading.Lock()
+
+        # Requests are paced by a shared token bucket and run on a bounded
+        # pool; results are still consumed in photo order per restaurant
+        dify_client.set_pool_size(workers)
+        photo_client.set_pool_size(workers)
+        self.limiter = make_limiter('dify', requests_per_second, DIFY_BURST,
+                                    DIFY_DAILY_BUDGET, quota_file)
+        dify_client.limiter = self.limiter
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+
+        self.progress = Progress('photos', interval=PROGRESS_INTERVAL,
+                                 metrics=metrics)
+        self.http_metrics = [http_client_collector('dify', dify_client),
+                             http_client_collector('photo', photo_client)]
+        for collector in self.http_metrics:
+            metrics.add_collector(collector)
+        metrics.add_collector(self.cache_metrics)
+        if self.photo_store is not None:
+            metrics.add_collector(self.photo_store_metrics)
+        metrics.event('analysis_start', workers=workers,
+                      requests_per_second=requests_per_second,
+                      dify_batch_size=dify_batch_size, output_mode=output_mode)
 
-    for file_index, input_file in enumerate(INPUT_FILES, 1):
-        print(f"\n{'='*60}")
         print(
-            f"Processing file {file_index}/{len(INPUT_FILES)}: {os.path.basename(input_file)}")
-        print(f"{'='*60}")
+            f"Analyzing with {workers} workers at {requests_per_second} requests/s"
+            + (f", {dify_batch_size} photos per request" if dify_batch_size > 1 else ""))
+
+    def cache_metrics(self) -> Dict[str, float]:
+        stats = self.cache.stats()
+        return {f"analysis_cache_{key}": stats[key]
+                for key in ('hits', 'hash_hits', 'misses', 'entries')}
+
+    def photo_store_metrics(self) -> Dict[str, float]:
+        return {f"photo_store_{key}": value
+                for key, value in self.photo_store.stats().items()}
+
+    def stored_photo_hash(self, photo_url: str) -> Optional[int]:
+        """
+        Like `photo_hash()`, from the photo store's thumbnail
+        """
+        data = self.photo_store.thumbnail(photo_url)
+        return dhash(data) if data else None
+
+    def prefilter_scores(self, photo_urls: List[str]) -> Dict[str, float]:
+        """
+        Pre-filter scores of photos, for the "prefilter" sampling order
+        """
+        def score(photo_url):
+            data = self.photo_store.thumbnail(photo_url) if self.photo_store is not None \
+                else fetch_thumbnail(photo_url)
+            return self.scorer.evaluate(data)['score'] or 0.0
+
+        return dict(zip(photo_urls, self.executor.map(score, photo_urls)))
+
+    def submit_photos(self, photo_urls: List[str], start: int, end: int,
+                      futures: Dict, final: bool = False) -> int:
+        """
+        Submit `photo_urls[start:end]` for analysis, in groups sharing one
+        workflow run when batching is enabled. A short group is only sent
+        at the end of the list or when `end` is `final`. Returns where the
+        next submission starts
+        """
+        photo_args = (self.cache, self.prefilter,
+                      self.photo_store, self.upload_photos)
+        end = min(end, len(photo_urls))
+        if self.dify_batch_size > 1:
+            while start < end:
+                group = photo_urls[start:min(start + self.dify_batch_size, end)]
+                if len(group) < self.dify_batch_size and end < len(photo_urls) \
+                        and not final:
+                    break
+                future = self.executor.submit(
+                    analyze_photo_batch, group, self.limiter, *photo_args)
+                futures.update((photo_url, future) for photo_url in group)
+                start += len(group)
+            return start
+        for photo_url in photo_urls[start:end]:
+            futures[photo_url] = self.executor.submit(
+                analyze_photo, photo_url, self.limiter, *photo_args)
+        return max(start, end)
 
+    def defer_photos(self, restaurant: Dict, photo_urls: List[str]):
+        """
+        Add photos sampling skipped to the restaurant's deferred record,
+        unless an earlier one has been analyzed since
+        """
+        previous = self.deferred_store.get(restaurant['place_id'])
+        if previous is not None and not self.checkpoint.is_place_done(
+                restaurant['place_id'], previous['photo_fingerprint']):
+            photo_urls = list(dict.fromkeys(previous['photo_urls'] + photo_urls))
+        os.makedirs(os.path.dirname(DEFERRED_PHOTOS_FILE), exist_ok=True)
+        self.deferred_store.add({
+            'restaurant_name': restaurant['restaurant_name'],
+            'place_id': restaurant['place_id'],
+            'rating': restaurant.get('rating'),
+            'vicinity': restaurant.get('vicinity'),
+            'photo_urls': photo_urls,
+            'photo_count': len(photo_urls),
+            'photo_fingerprint': photo_fingerprint(photo_urls),
+            'incremental': True,
+            'deferred': True
+        })
+
+    def queue_upsert(self, restaurant_name: str, place_id: str, photo_url: str,
+                     analysis: Dict):
+        """
+        Queue a dish's MongoDB upsert; its photo is checkpointed once the
+        upsert is written
+        """
+        self.mongodb_unflushed[(place_id, photo_url)] = analysis
+        failed = self.mongodb_loader.add(build_dish_document(
+            restaurant_name, place_id, photo_url, analysis['name'], analysis.get('desc', '')))
+        if failed is not None:
+            self.settle_upserts(failed)
+
+    def flush_upserts(self):
+        if self.mongodb_loader is not None:
+            with metrics.timer('mongo_flush'):
+                self.settle_upserts(self.mongodb_loader.flush())
+
+    def settle_upserts(self, failed_keys: List[Dict]):
+        """
+        Checkpoint the photos of flushed upserts. Photos whose write
+        failed stay pending and count as failed for their place
+        """
+        failed = {(key['place_id'], key['photo_url']) for key in failed_keys}
+        for (place_id, photo_url), analysis in self.mongodb_unflushed.items():
+            if (place_id, photo_url) in failed:
+                self.mongodb_failed[place_id] = self.mongodb_failed.get(place_id, 0) + 1
+            else:
+                self.checkpoint.mark_photo(place_id, photo_url, analysis)
+        self.mongodb_unflushed = {}
+
+    def record_photo(self, place_id: str, photo_url: str, outcome: str):
+        metrics.inc('photos', outcome=outcome)
+        metrics.event('photo', place_id=place_id,
+                      photo_url=photo_url, outcome=outcome)
+        self.progress.advance()
+
+    def is_done(self, restaurant: Dict) -> bool:
+        """
+        Whether a restaurant needs no more analysis. An incremental record
+        from a re-crawl is done once its own photo list fingerprint is
+        """
+        fingerprint = restaurant.get('photo_fingerprint') \
+            if restaurant.get('incremental') else None
+        return self.checkpoint.is_place_done(restaurant['place_id'], fingerprint)
+
+    def wait_for(self, future):
+        """
+        Result of an analysis, letting other restaurants record theirs meanwhile
+        """
+        self.lock.release()
         try:
-            # Load restaurant data
-            with open(input_file, 'r', encoding='utf-8') as f:
-                restaurants_data = json.load(f)
+            return future.result()
+        finally:
+            self.lock.acquire()
+
+    def plan_photos(self, restaurant: Dict, sampling: SamplingPolicy):
+        """
+        Photo URLs of a restaurant, the distinct ones, duplicates mapped
+        to the photo they repeat, and the analysis order. Hashing and
+        scoring only read shared state, so this runs outside the lock
+        """
+        place_id = restaurant['place_id']
+        # Exact repeats of a URL are only ever handled once
+        photo_urls = list(dict.fromkeys(restaurant['photo_urls']))
 
+        # Collapse near-duplicates so each distinct shot is analyzed once
+        unique_urls, duplicates = photo_urls, {}
+        if self.dedup_mode != "off":
+            image_hash = photo_hash if self.photo_store is None else self.stored_photo_hash
+            unique_urls, duplicates = dedupe_photos(
+                photo_urls,
+                image_hash if self.dedup_mode == "phash" else None,
+                max_distance=PHOTO_DEDUP_MAX_DISTANCE, executor=self.executor)
+
+        # Photos not analyzed in an earlier run, in sampling order
+        pending = {photo_url for photo_url in unique_urls
+                   if self.checkpoint.photo_result(place_id, photo_url) is None}
+        photo_order = sampling.order_photos(
+            photo_urls, lambda urls: self.prefilter_scores(
+                [photo_url for photo_url in urls if photo_url in pending]))
+        return photo_urls, unique_urls, duplicates, photo_order
+
+    def process_restaurant(self, restaurant: Dict) -> bool:
+        """
+        Analyze every photo of a restaurant that is not checkpointed yet.
+        Returns True once the place is fully processed. Only checkpoint
+        and output updates hold the lock, so restaurants processed at
+        once overlap their hashing, scoring and Dify requests
+        """
+        sampling = self.backfill_sampling if restaurant.get('deferred') else self.sampling
+        plan = None if self.is_done(restaurant) else self.plan_photos(restaurant, sampling)
+        with self.lock:
+            return self._process_restaurant(restaurant, sampling, plan)
+
+    def _process_restaurant(self, restaurant: Dict, sampling: SamplingPolicy, plan) -> bool:
+        started = time.monotonic()
+        restaurant_name = restaurant['restaurant_name']
+        place_id = restaurant['place_id']
+        self.total_restaurants += 1
+
+        # Check if this place has already been processed
+        if self.is_done(restaurant):
+            print(f"\nSkipping {restaurant_name} (already processed)")
+            self.skipped_restaurants += 1
+            return True
+
+        photo_urls, unique_urls, duplicates, photo_order = \
+            plan or self.plan_photos(restaurant, sampling)
+        print(
+            f"\nProcessing {restaurant_name} ({len(photo_urls)} photos)...")
+
+        restaurant_dishes_found = 0
+        restaurant_failed = 0
+        # Dishes whose upsert from an earlier run is still unflushed, with
+        # no MongoDB loader in this run to flush it
+        upserts_waiting = 0
+        if duplicates:
+            print(f"  Collapsed {len(duplicates)} duplicate photos")
+
+        pending = {photo_url for photo_url in unique_urls
+                   if self.checkpoint.photo_result(place_id, photo_url) is None}
+        pending_order = [photo_url for photo_url in photo_order if photo_url in pending]
+
+        # Without sampling limits every photo is submitted up front;
+        # otherwise only enough to keep the workers busy, so the rest can
+        # be deferred once a limit is reached
+        lookahead = self.workers * self.dify_batch_size if sampling.limited \
+            else len(pending_order)
+        if self.photo_store is not None:
+            self.photo_store.prefetch(pending_order[:lookahead])
+        futures = {}
+        submitted = 0
+        consumed = 0
+        sample = sampling.start()
+        stop_reason = None
+        deferred = []
+
+        for i, photo_url in enumerate(photo_order, 1):
+            if photo_url in pending:
+                if stop_reason is None:
+                    stop_reason = sample.stop_reason()
+                    if stop_reason is not None:
+                        print(f"  Sampling stopped ({stop_reason}), deferring the rest")
+                        for queued in pending_order[consumed:]:
+                            if queued in futures:
+                                futures[queued].cancel()
+                if stop_reason is None:
+                    # Never more in flight than the photo limit has room for
+                    room = sample.room()
+                    capped = room is not None and room < lookahead
+                    submitted = self.submit_photos(
+                        pending_order, submitted,
+                        consumed + (room if capped else lookahead), futures, final=capped)
+                consumed += 1
+                if photo_url not in futures or futures[photo_url].cancelled():
+                    deferred.append(photo_url)
+                    self.total_deferred += 1
+                    self.record_photo(place_id, photo_url, 'deferred')
+                    continue
+
+            self.total_photos += 1
+            print(f"  Photo {i}/{len(photo_urls)}")
+
+            resumed = self.checkpoint.photo_result(place_id, photo_url)
+            if resumed is not None:
+                # Outputs were already written before the checkpoint,
+                # except an upsert that was not flushed
+                if resumed.get('mongodb_pending') and self.mongodb_loader is not None:
+                    resumed = dict(resumed)
+                    del resumed['mongodb_pending']
+                    self.queue_upsert(restaurant_name, place_id, photo_url, resumed)
+                elif resumed.get('mongodb_pending'):
+                    upserts_waiting += 1
+                self.total_resumed += 1
+                sample.record(resumed)
+                print(f"    Already analyzed in a previous run")
+                self.record_photo(place_id, photo_url, 'resumed')
+                continue
+
+            if photo_url in duplicates:
+                self.total_duplicates += 1
+                print(f"    - Duplicate of {duplicates[photo_url][:80]}, skipping")
+                self.results_writer.write({
+                    'restaurant_name': restaurant_name,
+                    'place_id': place_id,
+                    'photo_url': photo_url,
+                    'duplicate_of': duplicates[photo_url]
+                })
+                self.checkpoint.mark_photo(
+                    place_id, photo_url, {'duplicate_of': duplicates[photo_url]})
+                self.record_photo(place_id, photo_url, 'duplicate')
+                continue
+
+            # Wait for the Dify analysis of this image
+            with metrics.timer('result_wait'):
+                try:
+                    analysis = self.wait_for(futures[photo_url])
+                except QuotaExceeded as e:
+                    # Left unanalyzed for a run after the budget resets
+                    if not self.quota_exhausted:
+                        print(f"    {e}, stopping analysis")
+                    self.quota_exhausted = True
+                    analysis = None
+            if analysis is not None and self.dify_batch_size > 1:
+                analysis = analysis[photo_url]
+            sample.record(analysis)
+
+            if analysis is None:
+                print(f"    Failed to analyze image after retries")
+                self.total_failed += 1
+                restaurant_failed += 1
+                self.record_photo(place_id, photo_url, 'failed')
+                continue
+
+            write_started = time.monotonic()
+
+            # Store analysis result, keeping the pre-filter decision
+            # alongside so its precision can be audited
+            prefilter_decision = analysis.pop('prefilter', None)
+            analysis_result = {
+                'restaurant_name': restaurant_name,
+                'place_id': place_id,
+                'photo_url': photo_url,
+                'analysis': analysis
+            }
+            if prefilter_decision is not None:
+                analysis_result['prefilter'] = prefilter_decision
+            self.results_writer.write(analysis_result)
+
+            # Check if it's identified as a dish (is_a_dish == 1)
+            if analysis.get('is_a_dish') == 1 and analysis.get('name'):
+                dish_name = analysis['name']
+                description = analysis.get('desc', '')
+
+                # Generate MongoDB command and/or queue the upsert
+                if self.mongodb_writer is not None:
+                    mongodb_command = generate_mongodb_insert(
+                        restaurant_name, place_id, photo_url, dish_name, description
+                    )
+                    self.mongodb_writer.write(mongodb_command)
+
+                # Add to knowledge base
+                knowledge_base_entry = {
+                    'restaurant_name': restaurant_name,
+                    'place_id': place_id,
+                    'photo_url': photo_url,
+                    'dish_name': dish_name,
+                    'description': description
+                }
+                self.kb_writer.add(knowledge_base_entry)
+
+                self.total_dishes += 1
+                restaurant_dishes_found += 1
+                self.restaurant_dish_counts[restaurant_name] = self.restaurant_dish_counts.get(
+                    restaurant_name, 0) + 1
+
+                print(f"    ✓ Dish identified: {dish_name}")
+                outcome = 'dish'
+
+            else:
+                self.total_non_dishes += 1
+                outcome = 'non_dish'
+                if prefilter_decision is not None and prefilter_decision['rejected'] \
+                        and self.prefilter.enforce:
+                    self.total_prefiltered += 1
+                    outcome = 'prefiltered'
+                    print(
+                        f"    - Rejected by pre-filter (score {prefilter_decision['score']}), skipping")
+                elif analysis.get('is_a_dish') == 0:
+                    print(f"    - Not a dish (is_a_dish=0), skipping")
+                elif not analysis.get('name'):
+                    print(f"    - No dish name provided, skipping")
+                else:
+                    print(
+                        f"    - Invalid is_a_dish value: {analysis.get('is_a_dish')}, skipping")
+
+            # Checkpoint only after the outputs above are written
+            if self.mongodb_loader is not None and outcome == 'dish':
+                self.checkpoint.mark_photo(
+                    place_id, photo_url, dict(analysis, mongodb_pending=True))
+                self.queue_upsert(restaurant_name, place_id, photo_url, analysis)
+            else:
+                self.checkpoint.mark_photo(place_id, photo_url, analysis)
+            metrics.observe('write', time.monotonic() - write_started)
+            self.record_photo(place_id, photo_url, outcome)
+
+        self.flush_upserts()
+        upserts_failed = self.mongodb_failed.pop(place_id, 0)
+        if upserts_failed:
+            print(f"  ! {upserts_failed} dishes were not written to MongoDB")
+            restaurant_failed += upserts_failed
+        if upserts_waiting:
+            # The place stays unfinished, so the markers are kept for a
+            # run that can flush them
+            print(f"  ! {upserts_waiting} dishes still await a MongoDB upsert from an "
+                  f"earlier run; rerun with --output-mode mongo or both to write them")
+            restaurant_failed += upserts_waiting
+
+        metrics.observe('restaurant', time.monotonic() - started)
+        metrics.event('restaurant', place_id=place_id, restaurant_name=restaurant_name,
+                      photos=len(photo_urls), dishes=restaurant_dishes_found,
+                      failed=restaurant_failed, elapsed_s=round(time.monotonic() - started, 3))
+        metrics.write_prometheus()
+
+        print(
+            f"  ✓ Completed {restaurant_name} - Found {restaurant_dishes_found} dishes")
+        if deferred:
+            self.defer_photos(restaurant, deferred)
+            print(f"  {len(deferred)} photos deferred to {DEFERRED_PHOTOS_FILE}")
+
+        # Mark this place as processed once every photo succeeded;
+        # otherwise only the failed photos are retried next run
+        if restaurant_failed:
             print(
-                f"Found {len(restaurants_data)} restaurants in {os.path.basename(input_file)}")
+                f"  ! {restaurant_name} - {restaurant_failed} photos failed, will retry on next run")
+            return False
+        self.checkpoint.mark_place(
+            place_id, restaurant.get('photo_fingerprint'))
+        return True
 
-            for restaurant in restaurants_data:
-                restaurant_name = restaurant['restaurant_name']
-                place_id = restaurant['place_id']
-                photo_urls = restaurant['photo_urls']
+    def process_file(self, input_file: str):
+        """
+        Process every restaurant of a crawler output file
+        """
+        self.input_files.append(input_file)
+        try:
+            # Restaurants are streamed twice, first to count what is left
+            # to do, so progress has totals without holding the file
+            total_restaurants = 0
+            pending_photos = 0
+            for restaurant in load_restaurants(input_file):
                 total_restaurants += 1
+                if not self.is_done(restaurant):
+                    pending_photos += len(restaurant.get('photo_urls', []))
 
-                # Check if this place has already been processed
-                if place_id in processed_places:
-                    print(f"\nSkipping {restaurant_name} (already processed)")
-                    skipped_restaurants += 1
-                    continue
+            print(
+                f"Found {total_restaurants} restaurants in {os.path.basename(input_file)}")
+            self.progress.add_total(pending_photos)
+            file_progress = Progress('restaurants', total=total_restaurants,
+                                     interval=PROGRESS_INTERVAL,
+                                     label=os.path.basename(input_file))
 
-                print(
-                    f"\nProcessing {restaurant_name} ({len(photo_urls)} photos)...")
-
-                restaurant_dishes_found = 0
-
-                for i, photo_url in enumerate(photo_urls, 1):
-                    total_photos += 1
-                    print(f"  Photo {i}/{len(photo_urls)}")
-
-                    # Call Dify workflow to analyze the image
-                    analysis = call_dify_workflow(photo_url)
-
-                    if analysis is None:
-                        print(f"    Failed to analyze image")
-                        continue
-
-                    # Store analysis result
-                    analysis_result = {
-                        'restaurant_name': restaurant_name,
-                        'place_id': place_id,
-                        'photo_url': photo_url,
-                        'analysis': analysis
-                    }
-                    analysis_results.append(analysis_result)
-
-                    # Check if it's identified as a dish (is_a_dish == 1)
-                    if analysis.get('is_a_dish') == 1 and analysis.get('name'):
-                        dish_name = analysis['name']
-                        description = analysis.get('desc', '')
-
-                        # Generate MongoDB command
-                        mongodb_command = generate_mongodb_insert(
-                            restaurant_name, place_id, photo_url, dish_name, description
-                        )
-                        mongodb_commands.append(mongodb_command)
-
-                        # Add to knowledge base
-                        knowledge_base_entry = {
-                            'restaurant_name': restaurant_name,
-                            'place_id': place_id,
-                            'photo_url': photo_url,
-                            'dish_name': dish_name,
-                            'description': description
-                        }
-                        knowledge_base_dishes.append(knowledge_base_entry)
-
-                        total_dishes += 1
-                        total_kb_dishes += 1
-                        restaurant_dishes_found += 1
-
-                        print(f"    ✓ Dish identified: {dish_name}")
-
-                        # Save knowledge base batch when reaching batch size
-                        if len(knowledge_base_dishes) >= BATCH_SIZE:
-                            save_knowledge_base_batch(
-                                knowledge_base_dishes, current_batch)
-                            knowledge_base_dishes = []  # Clear for next batch
-                            current_batch += 1
-
-                    else:
-                        total_non_dishes += 1
-                        if analysis.get('is_a_dish') == 0:
-                            print(f"    - Not a dish (is_a_dish=0), skipping")
-                        elif not analysis.get('name'):
-                            print(f"    - No dish name provided, skipping")
-                        else:
-                            print(
-                                f"    - Invalid is_a_dish value: {analysis.get('is_a_dish')}, skipping")
-
-                    # Add delay to avoid rate limiting
-                    time.sleep(0.8)
-
-                # Mark this place as processed after completing all photos
-                save_processed_place(place_id)
-                print(
-                    f"  ✓ Completed {restaurant_name} - Found {restaurant_dishes_found} dishes")
+            for restaurant in load_restaurants(input_file):
+                if self.quota_exhausted:
+                    break
+                self.process_restaurant(restaurant)
+                file_progress.advance()
+            file_progress.report()
 
         except FileNotFoundError:
             print(f"Error: Input file '{input_file}' not found")
-            continue
         except json.JSONDecodeError:
             print(f"Error: Invalid JSON in input file '{input_file}'")
-            continue
         except Exception as e:
             print(f"Error processing file '{input_file}': {e}")
-            continue
 
-    # Save remaining knowledge base dishes if any
-    if knowledge_base_dishes:
-        save_knowledge_base_batch(knowledge_base_dishes, current_batch)
+    def totals(self) -> Dict:
+        """
+        Counters of the run, as file workers report them back
+        """
+        return {
+            'input_files': list(self.input_files),
+            'restaurants': self.total_restaurants,
+            'skipped_restaurants': self.skipped_restaurants,
+            'photos': self.total_photos,
+            'dishes': self.total_dishes,
+            'non_dishes': self.total_non_dishes,
+            'failed': self.total_failed,
+            'resumed': self.total_resumed,
+            'prefiltered': self.total_prefiltered,
+            'duplicates': self.total_duplicates,
+            'deferred': self.total_deferred,
+            'kb_dishes': self.kb_writer.total_dishes,
+            'restaurant_dish_counts': dict(self.restaurant_dish_counts)
+        }
+
+    def close(self):
+        """
+        Flush all outputs and write the summary report
+        """
+        self.executor.shutdown(wait=True)
+        dify_client.limiter = None
+        if isinstance(self.limiter, SharedTokenBucket):
+            self.limiter.close()
+        self.flush_upserts()
+        self.checkpoint.close()
+        self.cache.evict()
+        cache_stats = self.cache.stats()
+        # Collectors read the cache, so flush metrics before closing it
+        self.progress.report()
+        metrics.flush()
+        # Later flushes in this process (e.g. a crawl) must not read them,
+        # and a later run registers its own
+        metrics.remove_collector(self.cache_metrics)
+        for collector in self.http_metrics:
+            metrics.remove_collector(collector)
+        self.cache.close()
+        photo_store_stats = None
+        if self.photo_store is not None:
+            metrics.remove_collector(self.photo_store_metrics)
+            photo_store_stats = self.photo_store.stats()
+            self.photo_store.close()
+
+        self.deferred_store.close()
+
+        # Save remaining knowledge base dishes if any
+        self.kb_writer.close()
+        if self.mongodb_writer is not None:
+            self.mongodb_writer.close()
+        if self.mongodb_loader is not None:
+            self.mongodb_loader.close()
+        self.results_writer.close()
+
+        dish_rate = self.total_dishes / self.total_photos * \
+            100 if self.total_photos else 0.0
+
+        # Generate summary report
+        with open(SUMMARY_FILE, 'w', encoding='utf-8') as f:
+            f.write("Photo Analysis Summary\n")
+            f.write("=" * 50 + "\n\n")
+            f.write(f"Total input files processed: {len(self.input_files)}\n")
+            f.write("Input files:\n")
+            for file in self.input_files:
+                f.write(f"  - {os.path.basename(file)}\n")
+            f.write(f"\nTotal restaurants found: {self.total_restaurants}\n")
+            f.write(
+                f"Restaurants skipped (already processed): {self.skipped_restaurants}\n")
+            f.write(f"Total photos analyzed: {self.total_photos}\n")
+            f.write(f"Total dishes identified: {self.total_dishes}\n")
+            f.write(f"Total non-dishes: {self.total_non_dishes}\n")
+            f.write(f"Photos failed after retries: {self.total_failed}\n")
+            f.write(
+                f"Photos already analyzed in a previous run: {self.total_resumed}\n")
+            f.write(
+                f"Photos rejected by pre-filter: {self.total_prefiltered}\n")
+            f.write(
+                f"Duplicate photos collapsed: {self.total_duplicates}\n")
+            f.write(
+                f"Photos deferred by sampling: {self.total_deferred}\n")
+            f.write(f"Dish identification rate: {dish_rate:.1f}%\n")
+            f.write(
+                f"Knowledge base batches created: {self.kb_writer.batches_written}\n")
+            f.write(
+                f"Total knowledge base entries: {self.kb_writer.total_dishes}\n\n")
+
+            f.write("Analysis cache:\n")
+            f.write("-" * 30 + "\n")
+            f.write(f"Hits: {cache_stats['hits']} "
+                    f"(by image hash: {cache_stats['hash_hits']})\n")
+            f.write(f"Misses: {cache_stats['misses']}\n")
+            f.write(f"Hit rate: {cache_stats['hit_rate']*100:.1f}%\n")
+            f.write(f"Entries: {cache_stats['entries']} "
+                    f"(evicted: {cache_stats['evicted']})\n\n")
+
+            if photo_store_stats is not None:
+                f.write("Photo store:\n")
+                f.write("-" * 30 + "\n")
+                f.write(f"Downloaded: {photo_store_stats['downloaded']} "
+                        f"(already stored: {photo_store_stats['hits']}, "
+                        f"failed: {photo_store_stats['failed']})\n")
+                f.write(f"Stored: {photo_store_stats['photos']} photos, "
+                        f"{photo_store_stats['bytes'] >> 20} MB "
+                        f"(evicted blobs: {photo_store_stats['evicted']})\n\n")
 
-    # Save MongoDB commands to file
-    with open('mongodb_insert_commands.js', 'w', encoding='utf-8') as f:
-        f.write("// MongoDB insert commands for dishes\n")
-        f.write("// Generated from restaurant photo analysis\n\n")
-        f.write("use restaurant_db;\n\n")
+            f.write("HTTP endpoints:\n")
+            f.write("-" * 30 + "\n")
+            for line in dify_client.format_stats():
+                f.write(f"{line}\n")
+            f.write("\n")
 
-        for command in mongodb_commands:
-            f.write(command + "\n\n")
+            f.write("Dishes by restaurant:\n")
+            f.write("-" * 30 + "\n")
+
+            for restaurant_name, count in self.restaurant_dish_counts.items():
+                f.write(f"{restaurant_name}: {count} dishes\n")
+
+        print(f"\n" + "=" * 60)
+        print(f"Processing complete!")
+        print(
+            f"Total restaurants processed: {self.total_restaurants - self.skipped_restaurants}")
+        print(f"Total restaurants skipped: {self.skipped_restaurants}")
+        print(f"Total photos analyzed: {self.total_photos}")
+        print(f"Total dishes identified: {self.total_dishes}")
+        print(f"Total non-dishes skipped: {self.total_non_dishes}")
+        print(f"Photos failed after retries: {self.total_failed}")
+        print(
+            f"Photos already analyzed in a previous run: {self.total_resumed}")
+        print(f"Photos rejected by pre-filter: {self.total_prefiltered}")
+        print(f"Duplicate photos collapsed: {self.total_duplicates}")
+        print(f"Photos deferred by sampling: {self.total_deferred}")
+        print(
+            f"Analysis cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses")
+        for line in dify_client.format_stats():
+            print(f"  {line}")
+        print(
+            f"Knowledge base batches created: {self.kb_writer.batches_written}")
+        print(f"Files generated:")
+        if self.mongodb_writer is not None:
+            print(f"  - {MONGODB_COMMANDS_FILE} (MongoDB commands)")
+        if self.mongodb_loader is not None:
+            print(f"  - MongoDB: {self.mongodb_loader.upserted} inserted, "
+                  f"{self.mongodb_loader.modified} updated, {self.mongodb_loader.errors} errors")
+        print(f"  - {ANALYSIS_RESULTS_FILE} (Detailed results, JSON lines)")
+        print(f"  - {SUMMARY_FILE} (Summary report)")
+        print(f"  - {KNOWLEDGE_BASE_DIR}/ (Knowledge base batches)")
+        print(f"  - {CHECKPOINT_FILE} (Resume checkpoint)")
+        if self.total_deferred:
+            print(f"  - {DEFERRED_PHOTOS_FILE} (Deferred photos, analyze later with --backfill)")
+        print(f"  - {ANALYSIS_CACHE_FILE} (Analysis cache)")
+        if photo_store_stats is not None:
+            print(f"  - {PHOTO_STORE_DIR}/ (Photos and thumbnails)")
+        print(f"  - {metrics.events_path} (Metrics events, JSON lines)")
+        if metrics.prometheus_path:
+            print(f"  - {metrics.prometheus_path} (Prometheus metrics)")
+
+
+def find_input_files(output_dir: str = OUTPUT_DIR) -> List[str]:
+    """
+    All crawler output files (JSON / JSON lines) in the outputs directory.
+    The deferred photo queue lives there too but is only analyzed when
+    backfilling, so sampling limits keep cutting calls
+    """
+    deferred = os.path.abspath(DEFERRED_PHOTOS_FILE)
+    return sorted(path for path in glob.glob(os.path.join(output_dir, "*.json")) +
+                  glob.glob(os.path.join(output_dir, "*.jsonl"))
+                  if os.path.abspath(path) != deferred)
+
+
+def backfill_input_files() -> List[str]:
+    """
+    The deferred photo queue as an input file list, empty when nothing
+    was deferred
+    """
+    return [DEFERRED_PHOTOS_FILE] if os.path.exists(DEFERRED_PHOTOS_FILE) else []
 
-    # Save detailed analysis results
-    with open('photo_analysis_results.json', 'w', encoding='utf-8') as f:
-        json.dump(analysis_results, f, ensure_ascii=False, indent=2)
 
-    # Generate summary report
-    with open('analysis_summary.txt', 'w', encoding='utf-8') as f:
+def shard_directory(input_file: str) -> str:
+    """
+    Output shard of one input file; stable across runs, so a worker that
+    died resumes from its own checkpoint
+    """
+    stem = os.path.splitext(os.path.basename(input_file))[0]
+    key = hashlib.sha1(os.path.abspath(input_file).encode('utf-8')).hexdigest()[:8]
+    return os.path.abspath(os.path.join(SHARDS_DIR, f"{stem}_{key}"))
+
+
+def shared_paths() -> Dict[str, str]:
+    """
+    Absolute paths of the state file workers share with the main run
+    """
+    return {
+        'ANALYSIS_CACHE_FILE': os.path.abspath(ANALYSIS_CACHE_FILE),
+        'PHOTO_STORE_DIR': os.path.abspath(PHOTO_STORE_DIR),
+        'PREFILTER_MODEL_FILE': os.path.abspath(PREFILTER_MODEL_FILE),
+        'CHECKPOINT_BASE_FILE': os.path.abspath(CHECKPOINT_FILE)
+    }
+
+
+def analyze_file_shard(input_file: str, shard_dir: str, paths: Dict[str, str],
+                       options: Dict) -> Dict:
+    """
+    File worker: analyze one input file with outputs written to its shard.
+    The analysis cache and photo store stay shared, and the main
+    checkpoint is read so finished places are skipped. Workers are
+    reused across files, so every path comes in absolute
+    """
+    globals().update(paths)
+    os.makedirs(shard_dir, exist_ok=True)
+    os.chdir(shard_dir)
+    run = AnalysisRun(**options)
+    run.process_file(input_file)
+    run.close()
+    return run.totals()
+
+
+def append_file(source: str, target: str, skip_prefix: str = ""):
+    """
+    Append a shard file to a main output, then delete it. The target's
+    size is recorded before appending, so a merge interrupted by a crash
+    and run again adds the file exactly once
+    """
+    if not os.path.exists(source):
+        return
+    with open(source, 'rb') as src:
+        data = src.read()
+    prefix = skip_prefix.encode('utf-8')
+    if prefix and data.startswith(prefix):
+        data = data[len(prefix):]
+
+    marker = source + ".merging"
+    size = os.path.getsize(target) if os.path.exists(target) else 0
+    if os.path.exists(marker):
+        with open(marker, 'r', encoding='utf-8') as f:
+            offset = int(f.read())
+    else:
+        offset = size
+        with open(marker, 'w', encoding='utf-8') as f:
+            f.write(str(offset))
+            f.flush()
+            os.fsync(f.fileno())
+    if data and target == MONGODB_COMMANDS_FILE and offset == 0:
+        data = MONGODB_COMMANDS_HEADER.encode('utf-8') + data
+
+    # Skip what an interrupted merge already wrote
+    if size > offset:
+        with open(target, 'rb') as f:
+            f.seek(offset)
+            written = f.read(len(data))
+        if data.startswith(written):
+            data = data[len(written):]
+    if data:
+        with open(target, 'ab') as dst:
+            dst.write(data)
+            dst.flush()
+            os.fsync(dst.fileno())
+    os.remove(source)
+    os.remove(marker)
+
+
+def merge_shard(shard_dir: str):
+    """
+    Fold a finished shard into the main outputs and remove it. Each
+    part is deleted once merged, so merging again after a crash skips
+    it. The checkpoint goes last, so places are only marked done once
+    their results are in place
+    """
+    append_file(os.path.join(shard_dir, ANALYSIS_RESULTS_FILE), ANALYSIS_RESULTS_FILE)
+    append_file(os.path.join(shard_dir, MONGODB_COMMANDS_FILE), MONGODB_COMMANDS_FILE,
+                skip_prefix=MONGODB_COMMANDS_HEADER)
+    append_file(os.path.join(shard_dir, METRICS_EVENTS_FILE),
+                metrics.events_path or METRICS_EVENTS_FILE)
+    # Later lines of the store supersede earlier ones of the same place
+    os.makedirs(os.path.dirname(DEFERRED_PHOTOS_FILE), exist_ok=True)
+    append_file(os.path.join(shard_dir, DEFERRED_PHOTOS_FILE), DEFERRED_PHOTOS_FILE)
+    kb_store.move_into(os.path.join(shard_dir, KNOWLEDGE_BASE_DIR), KNOWLEDGE_BASE_DIR)
+    append_file(os.path.join(shard_dir, CHECKPOINT_FILE), CHECKPOINT_FILE)
+    shutil.rmtree(shard_dir)
+
+
+def write_sharded_summary(reports: List[Dict]):
+    """
+    Summary report of a run split across file workers
+    """
+    keys = ['restaurants', 'skipped_restaurants', 'photos', 'dishes', 'non_dishes',
+            'failed', 'resumed', 'prefiltered', 'duplicates', 'deferred', 'kb_dishes']
+    totals = {key: sum(report[key] for report in reports) for key in keys}
+    dish_rate = totals['dishes'] / totals['photos'] * 100 if totals['photos'] else 0.0
+
+    with open(SUMMARY_FILE, 'w', encoding='utf-8') as f:
         f.write("Photo Analysis Summary\n")
         f.write("=" * 50 + "\n\n")
-        f.write(f"Total input files processed: {len(INPUT_FILES)}\n")
+        f.write(f"Total input files processed: {len(reports)}\n")
         f.write("Input files:\n")
-        for file in INPUT_FILES:
-            f.write(f"  - {os.path.basename(file)}\n")
-        f.write(f"\nTotal restaurants found: {total_restaurants}\n")
+        for report in reports:
+            for file in report['input_files']:
+                f.write(f"  - {os.path.basename(file)}: {report['photos']} photos, "
+                        f"{report['dishes']} dishes\n")
+        f.write(f"\nTotal restaurants found: {totals['restaurants']}\n")
         f.write(
-            f"Restaurants skipped (already processed): {skipped_restaurants}\n")
-        f.write(f"Total photos analyzed: {total_photos}\n")
-        f.write(f"Total dishes identified: {total_dishes}\n")
-        f.write(f"Total non-dishes: {total_non_dishes}\n")
-        f.write(
-            f"Dish identification rate: {(total_dishes/total_photos*100):.1f}%\n")
-        f.write(f"Knowledge base batches created: {current_batch}\n")
-        f.write(f"Total knowledge base entries: {total_kb_dishes}\n\n")
+            f"Restaurants skipped (already processed): {totals['skipped_restaurants']}\n")
+        f.write(f"Total photos analyzed: {totals['photos']}\n")
+        f.write(f"Total dishes identified: {totals['dishes']}\n")
+        f.write(f"Total non-dishes: {totals['non_dishes']}\n")
+        f.write(f"Photos failed after retries: {totals['failed']}\n")
+        f.write(f"Photos already analyzed in a previous run: {totals['resumed']}\n")
+        f.write(f"Photos rejected by pre-filter: {totals['prefiltered']}\n")
+        f.write(f"Duplicate photos collapsed: {totals['duplicates']}\n")
+        f.write(f"Photos deferred by sampling: {totals['deferred']}\n")
+        f.write(f"Dish identification rate: {dish_rate:.1f}%\n")
+        f.write(f"Total knowledge base entries: {totals['kb_dishes']}\n\n")
 
         f.write("Dishes by restaurant:\n")
         f.write("-" * 30 + "\n")
+        for report in reports:
+            for restaurant_name, count in report['restaurant_dish_counts'].items():
+                f.write(f"{restaurant_name}: {count} dishes\n")
 
-        restaurant_dish_counts = {}
-        for result in analysis_results:
-            if result['analysis'].get('is_a_dish') == 1:
-                restaurant_name = result['restaurant_name']
-                restaurant_dish_counts[restaurant_name] = restaurant_dish_counts.get(
-                    restaurant_name, 0) + 1
+    print(f"\n" + "=" * 60)
+    print(f"Processing complete for {len(reports)} input files!")
+    print(f"Total restaurants processed: "
+          f"{totals['restaurants'] - totals['skipped_restaurants']}")
+    print(f"Total restaurants skipped: {totals['skipped_restaurants']}")
+    print(f"Total photos analyzed: {totals['photos']}")
+    print(f"Total dishes identified: {totals['dishes']}")
+    print(f"Photos failed after retries: {totals['failed']}")
+    print(f"  - {SUMMARY_FILE} (Summary report)")
 
-        for restaurant_name, count in restaurant_dish_counts.items():
-            f.write(f"{restaurant_name}: {count} dishes\n")
 
-    print(f"\n" + "=" * 60)
-    print(f"Processing complete!")
-    print(
-        f"Total restaurants processed: {total_restaurants - skipped_restaurants}")
-    print(f"Total restaurants skipped: {skipped_restaurants}")
-    print(f"Total photos analyzed: {total_photos}")
-    print(f"Total dishes identified: {total_dishes}")
-    print(f"Total non-dishes skipped: {total_non_dishes}")
-    print(f"Knowledge base batches created: {current_batch}")
-    print(f"Files generated:")
-    print(f"  - mongodb_insert_commands.js (MongoDB commands)")
-    print(f"  - photo_analysis_results.json (Detailed results)")
-    print(f"  - analysis_summary.txt (Summary report)")
-    print(f"  - {KNOWLEDGE_BASE_DIR}/ (Knowledge base batches)")
-    print(f"  - {PROCESSED_PLACES_FILE} (Resume checkpoint)")
+def process_files_sharded(input_files: List[str], file_workers: int, **options):
+    """
+    Analyze input files in parallel worker processes and merge each
+    shard as soon as its worker finishes
+    """
+    metrics.configure(METRICS_EVENTS_FILE)
+    options = dict(options)
+    if options.get('quota_file'):
+        options['quota_file'] = os.path.abspath(options['quota_file'])
+    else:
+        options['requests_per_second'] = options.get(
+            'requests_per_second', DIFY_REQUESTS_PER_SECOND) / file_workers
+    options['workers'] = max(1, options.get('workers', ANALYSIS_WORKERS) // file_workers)
+    # Each worker has its own photo store, so they split the resize processes
+    options['resize_workers'] = max(1, RESIZE_WORKERS // file_workers)
+    print(f"Processing {len(input_files)} input files in {file_workers} worker processes "
+          f"({options['workers']} requests in flight, "
+          f"{options['requests_per_second']:.2f}/s each)...")
+
+    # Workers are spawned rather than forked so they do not inherit
+    # connection pools or open output files
+    context = multiprocessing.get_context('spawn')
+    reports = []
+    with ProcessPoolExecutor(max_workers=file_workers, mp_context=context) as executor:
+        futures = {executor.submit(analyze_file_shard, os.path.abspath(input_file),
+                                   shard_directory(input_file), shared_paths(),
+                                   options): input_file
+                   for input_file in input_files}
+        for future in as_completed(futures):
+            input_file = futures[future]
+            try:
+                report = future.result()
+            except Exception as e:
+                # The shard is kept and resumes from its own checkpoint
+                print(f"Error: worker for '{input_file}' failed: {e}")
+                continue
+            merge_shard(shard_directory(input_file))
+            reports.append(report)
+            print(f"Merged {os.path.basename(input_file)}: {report['photos']} photos, "
+                  f"{report['dishes']} dishes")
+
+    # Shards each leave a compacted knowledge base; merge their tails
+    kb_store.compact(KNOWLEDGE_BASE_DIR)
+    write_sharded_summary(reports)
+
+
+def process_restaurant_photos(input_files: Optional[List[str]] = None,
+                              file_workers: int = FILE_WORKERS, **options):
+    """
+    Main function to process restaurant photos and generate MongoDB insert commands
+    """
+    if input_files is None:
+        input_files = find_input_files()
+        print(f"Found {len(input_files)} JSON files in {OUTPUT_DIR} directory:")
+        for file in input_files:
+            print(f"  - {file}")
+
+    if not input_files:
+        print(f"No JSON files found in {OUTPUT_DIR} directory!")
+        return
+
+    if file_workers > 1 and len(input_files) > 1:
+        process_files_sharded(input_files, min(file_workers, len(input_files)), **options)
+        return
+
+    run = AnalysisRun(**options)
+    print(f"Processing {len(input_files)} input files...")
+
+    for file_index, input_file in enumerate(input_files, 1):
+        if run.quota_exhausted:
+            print(f"Daily Dify budget used up, {len(input_files) - file_index + 1} "
+                  f"input files left for the next run")
+            break
+        print(f"\n{'='*60}")
+        print(
+            f"Processing file {file_index}/{len(input_files)}: {os.path.basename(input_file)}")
+        print(f"{'='*60}")
+        run.process_file(input_file)
+
+    run.close()
+
+
+def add_analysis_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument('--workers', type=int, default=ANALYSIS_WORKERS,
+                        help="Max in-flight Dify requests")
+    parser.add_argument('--dify-batch', type=int, default=DIFY_BATCH_SIZE,
+                        help="Photos per Dify workflow run (needs the batched workflow)")
+    parser.add_argument('--rps', type=float, default=DIFY_REQUESTS_PER_SECOND,
+                        help="Sustained Dify requests per second")
+    parser.add_argument('--output-mode', choices=["js", "mongo", "both"], default=OUTPUT_MODE,
+                        help="Write MongoDB commands to a .js file, upsert directly, or both")
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                        help="Dishes per knowledge base batch file")
+    parser.add_argument('--kb-format', choices=["segments", "json"], default=KB_FORMAT,
+                        help="Knowledge base output: compact segments or JSON batch files")
+    parser.add_argument('--dedup', choices=["off", "url", "phash"], default=PHOTO_DEDUP,
+                        help="Collapse duplicate photos by URL or perceptual hash")
+    parser.add_argument('--prefilter', choices=["off", "audit", "enforce"], default=PREFILTER_MODE,
+                        help="Score thumbnails locally before calling Dify")
+    parser.add_argument('--prefetch', choices=["off", "cache", "upload"], default=PHOTO_PREFETCH,
+                        help="Store photos and thumbnails locally, optionally uploading thumbnails to Dify")
+    parser.add_argument('--sample-photos', type=int, default=SAMPLE_MAX_PHOTOS,
+                        help="Analyze at most this many photos per restaurant, deferring the rest")
+    parser.add_argument('--sample-dishes', type=int, default=SAMPLE_MAX_DISHES,
+                        help="Defer a restaurant's remaining photos after this many distinct dishes")
+    parser.add_argument('--sample-non-dish-run', type=int, default=SAMPLE_MAX_NON_DISH_RUN,
+                        help="Defer a restaurant's remaining photos after this many non-dishes in a row")
+    parser.add_argument('--sample-order', choices=SAMPLE_ORDERS, default=SAMPLE_ORDER,
+                        help="Order photos are sampled in")
+
+
+def analysis_options(args: argparse.Namespace) -> Dict:
+    return {
+        'workers': args.workers,
+        'requests_per_second': args.rps,
+        'output_mode': args.output_mode,
+        'batch_size': args.batch_size,
+        'prefilter_mode': args.prefilter,
+        'dedup_mode': args.dedup,
+        'dify_batch_size': args.dify_batch,
+        'kb_format': args.kb_format,
+        'prefetch_mode': args.prefetch,
+        'quota_file': args.quota_file,
+        'sample_max_photos': args.sample_photos,
+        'sample_max_dishes': args.sample_dishes,
+        'sample_max_non_dish_run': args.sample_non_dish_run,
+        'sample_order': args.sample_order
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Analyze crawled restaurant photos with Dify")
+    parser.add_argument('inputs', nargs='*',
+                        help=f"Crawler output files (default: all files in {OUTPUT_DIR}/)")
+    parser.add_argument('--backfill', action='store_true',
+                        help=f"Analyze the photos sampling deferred to {DEFERRED_PHOTOS_FILE} "
+                             f"instead of crawler output")
+    parser.add_argument('--file-workers', type=int, default=FILE_WORKERS,
+                        help="Analyze input files in this many worker processes")
+    add_analysis_arguments(parser)
+    add_metrics_arguments(parser)
+    add_quota_arguments(parser)
+    args = parser.parse_args(argv)
+    if args.backfill and args.inputs:
+        parser.error("--backfill takes no input files")
+    metrics.configure(args.metrics_events, args.prometheus)
+
+    input_files = args.inputs or None
+    if args.backfill:
+        input_files = backfill_input_files()
+        if not input_files:
+            print(f"No deferred photos in {DEFERRED_PHOTOS_FILE}")
+            return
+    process_restaurant_photos(input_files, file_workers=args.file_workers,
+                              **analysis_options(args))
 
 
 if __name__ == "__main__":
-    process_restaurant_photos()
+    main()
@@ -0,0 +1,96 @@
+import io
+import re
+from typing import Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow is only needed for perceptual hashing
+    Image = None
+
+# Google photo hosts serve the same image from lh3..lh6 with a trailing
+# "=w408-h306-k-no" style size/crop suffix
+GOOGLE_PHOTO_HOST = re.compile(r'^lh\d\.googleusercontent\.com$')
+GOOGLE_SIZE_SUFFIX = re.compile(r'=[a-z0-9-]+$', re.IGNORECASE)
+
+# Query parameters that only change the rendition or carry credentials
+IGNORED_QUERY_PARAMS = {'key', 'maxwidth', 'maxheight', 'maxwidthpx',
+                        'maxheightpx', 'w', 'h', 'sz'}
+
+
+def normalize_photo_url(url: str) -> str:
+    """
+    Canonical form of a photo URL, used as a cache and dedup key.
+
+    Lowercases scheme and host, drops fragments, credentials and size
+    parameters, and sorts the remaining query string.
+    """
+    parts = urlsplit(url.strip())
+    host = parts.netloc.lower()
+    path = parts.path
+
+    if GOOGLE_PHOTO_HOST.match(host):
+        host = 'lh3.googleusercontent.com'
+        path = GOOGLE_SIZE_SUFFIX.sub('', path)
+
+    query = sorted((k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+                   if k.lower() not in IGNORED_QUERY_PARAMS)
+    return urlunsplit((parts.scheme.lower(), host, path, urlencode(query), ''))
+
+
+def thumbnail_url(url: str, size: int = 256) -> str:
+    """
+    URL of a small rendition of a Google photo; other URLs are unchanged
+    """
+    parts = urlsplit(url)
+    if not GOOGLE_PHOTO_HOST.match(parts.netloc.lower()):
+        return url
+    path = GOOGLE_SIZE_SUFFIX.sub('', parts.path) + f"=w{size}-h{size}-k-no"
+    return urlunsplit((parts.scheme, parts.netloc, path, parts.query, ''))
+
+
+def dhash(data: bytes, hash_size: int = 8) -> Optional[int]:
+    """
+    Difference hash of image bytes, or None if it cannot be computed
+    """
+    if Image is None:
+        return None
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            image = image.convert('L').resize(
+                (hash_size + 1, hash_size), Image.LANCZOS)
+            pixels = list(image.getdata())
+    except Exception:
+        return None
+
+    value = 0
+    for row in range(hash_size):
+        for col in range(hash_size):
+            left = pixels[row * (hash_size + 1) + col]
+            right = pixels[row * (hash_size + 1) + col + 1]
+            value = (value << 1) | (1 if left > right else 0)
+    return value
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count('1')
+
+
+def make_thumbnail(data: bytes, size: int = 512, quality: int = 85) -> Optional[bytes]:
+    """
+    JPEG rendition of image bytes fitting in `size` x `size`, or None if
+    the image cannot be decoded. Runs in worker processes, so it only
+    takes and returns bytes
+    """
+    if Image is None:
+        return None
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            image.draft('RGB', (size, size))  # Lets JPEG decode at reduced scale
+            image = image.convert('RGB')
+            image.thumbnail((size, size), Image.LANCZOS)
+            output = io.BytesIO()
+            image.save(output, 'JPEG', quality=quality, optimize=True)
+            return output.getvalue()
+    except Exception:
+        return None
@@ -0,0 +1,337 @@
+import argparse
+import glob
+import hashlib
+import json
+import mmap
+import os
+import re
+import struct
+import sys
+import time
+from array import array
+from typing import Dict, Iterator, List, Optional, Sequence
+
+# Knowledge base columns, in segment order
+COLUMNS = ('restaurant_name', 'place_id', 'photo_url', 'dish_name', 'description')
+# Canonical dishes (see dish_dedup.py) also list every photo and name
+# variant of the dish, one per line
+CANONICAL_COLUMNS = COLUMNS + ('photo_urls', 'aliases', 'photo_count')
+
+SEGMENT_MAGIC = b"SFKB"
+SEGMENT_VERSION = 1
+SEGMENT_SUFFIX = ".kbseg"
+# magic, version, column count, row count, creation time in ns
+HEADER = struct.Struct('<4sHHQQ')
+COLUMN_HEADER = struct.Struct('<HQ')  # name length, data length
+
+# Incremental compaction merges the trailing segments smaller than this
+COMPACT_SEGMENT_ROWS = 50000
+
+LEGACY_BATCH_PATTERN = "knowledge_base_batch_*.json"
+
+
+def segment_paths(directory: str) -> List[str]:
+    """
+    Segments of a knowledge base directory, oldest first. Names start
+    with the creation time, so name order is write order
+    """
+    return sorted(glob.glob(os.path.join(directory, f"segment_*{SEGMENT_SUFFIX}")))
+
+
+def legacy_batch_paths(directory: str) -> List[str]:
+    return sorted(glob.glob(os.path.join(directory, LEGACY_BATCH_PATTERN)))
+
+
+def dish_photo_urls(dish: Dict) -> List[str]:
+    """
+    Photos of a dish row: the whole photo list of a canonical dish, or
+    the row's single photo
+    """
+    if dish.get('photo_urls'):
+        return dish['photo_urls'].split('\n')
+    return [dish['photo_url']] if dish.get('photo_url') else []
+
+
+def write_segment(directory: str, dishes: List[Dict], created_ns: Optional[int] = None,
+                  columns: Sequence[str] = COLUMNS) -> str:
+    """
+    Write dishes as one immutable columnar segment and return its path.
+
+    Each column is stored as (rows + 1) little-endian offsets followed by
+    the UTF-8 values back to back. The file is written under a temporary
+    name, synced and renamed to `segment_<created>_<content hash>`, so
+    names never collide and a reader never sees a partial segment
+    """
+    created_ns = created_ns or time.time_ns()
+    parts = [HEADER.pack(SEGMENT_MAGIC, SEGMENT_VERSION,
+                         len(columns), len(dishes), created_ns)]
+    for column in columns:
+        values = [str(dish.get(column) or '').encode('utf-8')
+                  for dish in dishes]
+        offsets = array('Q', [0])
+        for value in values:
+            offsets.append(offsets[-1] + len(value))
+        if sys.byteorder == 'big':
+            offsets.byteswap()
+        name = column.encode('utf-8')
+        data = b"".join(values)
+        parts.append(COLUMN_HEADER.pack(len(name), len(data)))
+        parts.append(name)
+        parts.append(offsets.tobytes())
+        parts.append(data)
+
+    content = b"".join(parts)
+    digest = hashlib.sha1(content).hexdigest()[:12]
+    path = os.path.join(
+        directory, f"segment_{created_ns:020d}_{digest}{SEGMENT_SUFFIX}")
+    temp_path = path + ".tmp"
+    with open(temp_path, 'wb') as f:
+        f.write(content)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+    return path
+
+
+class Segment:
+    """
+    Read-only, memory-mapped view of one knowledge base segment.
+
+    Only the per-column offsets are read eagerly; values are decoded from
+    the mapping on access, so opening a segment costs about the same
+    regardless of description lengths
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, 'rb')
+        size = os.fstat(self._file.fileno()).st_size
+        self._map = mmap.mmap(self._file.fileno(), size, access=mmap.ACCESS_READ) \
+            if size else b""
+
+        magic, version, column_count, self.rows, self.created_ns = \
+            HEADER.unpack_from(self._map, 0)
+        if magic != SEGMENT_MAGIC or version != SEGMENT_VERSION:
+            raise ValueError(f"Not a knowledge base segment: {path}")
+
+        self._columns = {}
+        position = HEADER.size
+        for _ in range(column_count):
+            name_length, data_length = COLUMN_HEADER.unpack_from(
+                self._map, position)
+            position += COLUMN_HEADER.size
+            name = self._map[position:position + name_length].decode('utf-8')
+            position += name_length
+            offsets = array('Q')
+            offsets.frombytes(
+                self._map[position:position + 8 * (self.rows + 1)])
+            if sys.byteorder == 'big':
+                offsets.byteswap()
+            position += 8 * (self.rows + 1)
+            self._columns[name] = (offsets, position)
+            position += data_length
+
+    def __len__(self) -> int:
+        return self.rows
+
+    @property
+    def columns(self) -> List[str]:
+        return list(self._columns)
+
+    def value(self, column: str, row: int) -> str:
+        offsets, start = self._columns[column]
+        return self._map[start + offsets[row]:start + offsets[row + 1]].decode('utf-8')
+
+    def column(self, column: str) -> Iterator[str]:
+        """
+        Stream one column without decoding the others
+        """
+        offsets, start = self._columns[column]
+        for row in range(self.rows):
+            yield self._map[start + offsets[row]:start + offsets[row + 1]].decode('utf-8')
+
+    def row(self, row: int) -> Dict:
+        return {column: self.value(column, row) for column in self._columns}
+
+    def __iter__(self) -> Iterator[Dict]:
+        columns = [self.column(column) for column in self._columns]
+        for values in zip(*columns):
+            yield dict(zip(self._columns, values))
+
+    def close(self):
+        if isinstance(self._map, mmap.mmap):
+            self._map.close()
+        self._file.close()
+
+
+class KnowledgeBase:
+    """
+    All dishes of a knowledge base directory: legacy JSON batches first,
+    then segments in write order. Iteration streams every stored row;
+    `load()` keeps the latest row per (place_id, photo_url)
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.segments = [Segment(path) for path in segment_paths(directory)]
+        self.legacy_batches = legacy_batch_paths(directory)
+
+    def __len__(self) -> int:
+        return sum(len(segment) for segment in self.segments)
+
+    def __iter__(self) -> Iterator[Dict]:
+        for path in self.legacy_batches:
+            with open(path, 'r', encoding='utf-8') as f:
+                yield from json.load(f)
+        for segment in self.segments:
+            yield from segment
+
+    def column(self, column: str) -> Iterator[str]:
+        """
+        Stream one column of the segments, e.g. dish names for a matcher
+        """
+        for segment in self.segments:
+            yield from segment.column(column)
+
+    def load(self) -> List[Dict]:
+        dishes = {}
+        for dish in self:
+            dishes[(dish.get('place_id'), dish.get('photo_url'))] = dish
+        return list(dishes.values())
+
+    def close(self):
+        for segment in self.segments:
+            segment.close()
+
+
+def compact(directory: str, full: bool = False,
+            max_rows: int = COMPACT_SEGMENT_ROWS) -> Optional[str]:
+    """
+    Merge segments into one, dropping rows superseded by later writes.
+
+    By default only the trailing run of segments smaller than `max_rows`
+    is merged; new segments are always appended at the end, so this
+    keeps merge cost proportional to recent writes. `full` merges every
+    segment and folds in legacy JSON batches, which are deleted once the
+    merged segment is on disk. Returns the merged segment path, or None
+    if there was nothing to merge
+    """
+    paths = segment_paths(directory)
+    legacy = legacy_batch_paths(directory) if full else []
+    if not full:
+        tail = []
+        for path in reversed(paths):
+            segment = Segment(path)
+            rows = len(segment)
+            segment.close()
+            if rows >= max_rows:
+                break
+            tail.insert(0, path)
+        paths = tail
+    if len(paths) + len(legacy) < 2:
+        return None
+
+    dishes = {}
+    created_ns = 0
+    columns = list(COLUMNS)
+    for path in legacy:
+        with open(path, 'r', encoding='utf-8') as f:
+            for dish in json.load(f):
+                dishes[(dish.get('place_id'), dish.get('photo_url'))] = dish
+    for path in paths:
+        segment = Segment(path)
+        created_ns = max(created_ns, segment.created_ns)
+        columns += [column for column in segment.columns if column not in columns]
+        for dish in segment:
+            dishes[(dish['place_id'], dish['photo_url'])] = dish
+        segment.close()
+
+    # Keep the newest input's creation time so the merged segment sorts
+    # before anything written after it
+    merged = write_segment(directory, list(dishes.values()),
+                           created_ns or None, columns)
+    for path in paths + legacy:
+        if path != merged:
+            os.remove(path)
+    return merged
+
+
+def move_into(source_dir: str, target_dir: str) -> int:
+    """
+    Move the segments and JSON batches of one knowledge base directory
+    into another, e.g. from a worker's shard, and return how many files
+    moved. Segment names are unique, so they move as they are; JSON
+    batches are renumbered after the target's highest batch
+    """
+    os.makedirs(target_dir, exist_ok=True)
+    moved = 0
+    for path in segment_paths(source_dir):
+        os.replace(path, os.path.join(target_dir, os.path.basename(path)))
+        moved += 1
+
+    numbers = [int(re.search(r'_(\d+)\.json$', path).group(1))
+               for path in legacy_batch_paths(target_dir)
+               if re.search(r'_(\d+)\.json$', path)]
+    number = max(numbers, default=0)
+    for path in legacy_batch_paths(source_dir):
+        number += 1
+        os.replace(path, os.path.join(
+            target_dir, f"knowledge_base_batch_{number:03d}.json"))
+        moved += 1
+    return moved
+
+
+def export_json(directory: str, output_path: str) -> int:
+    """
+    Write the deduplicated knowledge base as one JSON list, e.g. for
+    uploading to a Dify knowledge base
+    """
+    kb = KnowledgeBase(directory)
+    dishes = kb.load()
+    kb.close()
+    with open(output_path, 'w', encoding='utf-8') as f:
+        json.dump(dishes, f, ensure_ascii=False, indent=2)
+    return len(dishes)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Inspect, compact or export a knowledge base directory")
+    parser.add_argument('--dir', default="knowledge_base",
+                        help="Knowledge base directory")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('stats', help="Show segments and row counts")
+    compact_parser = subparsers.add_parser(
+        'compact', help="Merge small trailing segments")
+    compact_parser.add_argument('--full', action='store_true',
+                                help="Merge everything, including legacy JSON batches")
+    export_parser = subparsers.add_parser(
+        'export-json', help="Write the deduplicated dishes as a JSON list")
+    export_parser.add_argument('output', help="Output JSON file")
+    args = parser.parse_args(argv)
+
+    if args.command == 'stats':
+        start = time.monotonic()
+        kb = KnowledgeBase(args.dir)
+        for segment in kb.segments:
+            print(f"{os.path.basename(segment.path)}: {len(segment)} rows, "
+                  f"{os.path.getsize(segment.path)} bytes")
+        for path in kb.legacy_batches:
+            print(f"{os.path.basename(path)}: legacy JSON batch")
+        dishes = kb.load()
+        kb.close()
+        print(f"{len(dishes)} dishes loaded in "
+              f"{(time.monotonic() - start) * 1000:.0f}ms")
+    elif args.command == 'compact':
+        merged = compact(args.dir, full=args.full)
+        if merged:
+            print(f"Merged into {os.path.basename(merged)}")
+        else:
+            print("Nothing to compact")
+    elif args.command == 'export-json':
+        count = export_json(args.dir, args.output)
+        print(f"Exported {count} dishes to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,313 @@
+import argparse
+import atexit
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Tuple
+
+from output_writers import JsonlWriter
+
+METRIC_PREFIX = "snapfood"
+# Stage duration histogram buckets, in seconds
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class StageTimer:
+    """
+    Count, total and bucketed durations of one ingestion stage
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * (len(STAGE_BUCKETS) + 1)
+
+    def observe(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.buckets[bisect.bisect_left(STAGE_BUCKETS, seconds)] += 1
+
+    def to_dict(self) -> Dict:
+        return {
+            'count': self.count,
+            'total_s': round(self.total, 6),
+            'avg_s': round(self.total / self.count, 6) if self.count else 0.0,
+            'max_s': round(self.max, 6)
+        }
+
+
+class Metrics:
+    """
+    Process-wide counters, stage timers and event log for the ingestion
+    scripts.
+
+    Stage timers answer "where does wall-clock time go"; counters track
+    calls and outcomes. Events go to a JSON lines file as they happen,
+    and `flush()` appends a summary event and writes a Prometheus text
+    dump. Collectors are callables polled at flush time, so components
+    that already keep counters (HTTP clients, the analysis cache) don't
+    need to count twice
+    """
+
+    def __init__(self):
+        self.counters: Dict[Tuple[str, Labels], float] = {}
+        self.stages: Dict[str, StageTimer] = {}
+        self.collectors: List[Callable[[], Dict[str, float]]] = []
+        self.started = time.time()
+        self.prometheus_path: Optional[str] = None
+        self._events: Optional[JsonlWriter] = None
+        self._lock = threading.Lock()
+
+    def configure(self, events_path: Optional[str] = None,
+                  prometheus_path: Optional[str] = None):
+        """
+        Choose the output files. A script embedded in another (as in the
+        pipeline) keeps the files its host already opened
+        """
+        with self._lock:
+            if events_path and self._events is None:
+                self._events = JsonlWriter(events_path)
+            if prometheus_path and self.prometheus_path is None:
+                self.prometheus_path = prometheus_path
+
+    @property
+    def events_path(self) -> Optional[str]:
+        return self._events.path if self._events is not None else None
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, stage: str, seconds: float):
+        with self._lock:
+            if stage not in self.stages:
+                self.stages[stage] = StageTimer()
+            self.stages[stage].observe(seconds)
+
+    @contextmanager
+    def timer(self, stage: str):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.monotonic() - start)
+
+    def add_collector(self, collector: Callable[[], Dict[str, float]]):
+        """
+        Register a callable returning current gauge values by metric name
+        """
+        with self._lock:
+            self.collectors.append(collector)
+
+    def remove_collector(self, collector: Callable[[], Dict[str, float]]):
+        """
+        Unregister a collector, e.g. before closing what it reads
+        """
+        with self._lock:
+            if collector in self.collectors:
+                self.collectors.remove(collector)
+
+    def event(self, kind: str, **fields):
+        """
+        Append one structured event, if an events file is configured
+        """
+        record = {'ts': round(time.time(), 3), 'event': kind}
+        record.update(fields)
+        with self._lock:
+            if self._events is not None:
+                self._events.write(record)
+
+    def collect(self) -> Dict[str, float]:
+        values = {}
+        for collector in list(self.collectors):
+            values.update(collector())
+        return values
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            counters = {}
+            for (name, labels), value in sorted(self.counters.items()):
+                label_text = ",".join(f"{k}={v}" for k, v in labels)
+                counters[f"{name}{{{label_text}}}" if labels else name] = value
+            stages = {stage: timer.to_dict()
+                      for stage, timer in sorted(self.stages.items())}
+        return {
+            'uptime_s': round(time.time() - self.started, 3),
+            'counters': counters,
+            'stages': stages,
+            'gauges': self.collect()
+        }
+
+    def prometheus_text(self) -> str:
+        """
+        Current metrics in the Prometheus text exposition format
+        """
+        lines = []
+        with self._lock:
+            counters = sorted(self.counters.items())
+            stages = sorted((stage, timer.count, timer.total, list(timer.buckets))
+                            for stage, timer in self.stages.items())
+
+        seen = set()
+        for (name, labels), value in counters:
+            metric = f"{METRIC_PREFIX}_{name}_total"
+            if metric not in seen:
+                seen.add(metric)
+                lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric}{format_labels(labels)} {value}")
+
+        if stages:
+            metric = f"{METRIC_PREFIX}_stage_seconds"
+            lines.append(
+                f"# HELP {metric} Wall-clock time spent per ingestion stage")
+            lines.append(f"# TYPE {metric} histogram")
+            for stage, count, total, buckets in stages:
+                cumulative = 0
+                for bound, bucket in zip(STAGE_BUCKETS + (float('inf'),), buckets):
+                    cumulative += bucket
+                    le = "+Inf" if bound == float('inf') else repr(bound)
+                    lines.append(
+                        f"{metric}_bucket{format_labels((('stage', stage), ('le', le)))} {cumulative}")
+                lines.append(
+                    f"{metric}_sum{format_labels((('stage', stage),))} {total}")
+                lines.append(
+                    f"{metric}_count{format_labels((('stage', stage),))} {count}")
+
+        for name, value in sorted(self.collect().items()):
+            metric = f"{METRIC_PREFIX}_{name}"
+            lines.append(f"# TYPE {metric} gauge")
+            lines.append(f"{metric} {value}")
+
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self):
+        """
+        Rewrite the Prometheus dump, if configured. The file is replaced
+        atomically so a textfile collector never reads a partial dump
+        """
+        if not self.prometheus_path:
+            return
+        temp_path = self.prometheus_path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write(self.prometheus_text())
+        os.replace(temp_path, self.prometheus_path)
+
+    def flush(self):
+        """
+        Log a summary event and rewrite the Prometheus dump
+        """
+        self.event('summary', **self.snapshot())
+        self.write_prometheus()
+
+    def close(self):
+        with self._lock:
+            if self._events is not None:
+                self._events.close()
+                self._events = None
+
+
+def add_metrics_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument('--metrics-events', default=None,
+                        help="JSON lines file for structured metrics events")
+    parser.add_argument('--prometheus', default=None,
+                        help="Write a Prometheus text dump of the metrics to this file")
+
+
+def format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for _, value in labels)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + "}"
+
+
+def http_client_collector(name: str, client) -> Callable[[], Dict[str, float]]:
+    """
+    Gauges for an `HttpClient`'s per-endpoint requests, retries and errors
+    """
+    def collect():
+        totals = {'requests': 0, 'retries': 0, 'errors': 0}
+        for stats in client.stats().values():
+            for key in totals:
+                totals[key] += stats[key]
+        return {f"{name}_http_{key}": value for key, value in totals.items()}
+    return collect
+
+
+class Progress:
+    """
+    Live progress line with throughput and ETA, printed at most every
+    `interval` seconds. `total` may grow as more work is discovered, or
+    stay None when it is unknown
+    """
+
+    def __init__(self, unit: str, total: Optional[int] = None, interval: float = 5.0,
+                 metrics: Optional[Metrics] = None, label: str = "Progress"):
+        self.unit = unit
+        self.label = label
+        self.total = total
+        self.interval = interval
+        self.metrics = metrics
+        self.done = 0
+        self.started = time.monotonic()
+        self._last_print = 0.0
+
+    def add_total(self, count: int):
+        self.total = (self.total or 0) + count
+
+    def advance(self, count: int = 1):
+        self.done += count
+        now = time.monotonic()
+        if now - self._last_print >= self.interval:
+            self._last_print = now
+            self.report()
+
+    def rate(self) -> float:
+        elapsed = time.monotonic() - self.started
+        return self.done / elapsed if elapsed > 0 else 0.0
+
+    def eta(self) -> Optional[float]:
+        rate = self.rate()
+        if self.total is None or rate <= 0:
+            return None
+        return max(0, self.total - self.done) / rate
+
+    def line(self) -> str:
+        text = f"{self.label}: {self.done}"
+        if self.total:
+            text += f"/{self.total} {self.unit} ({self.done / self.total * 100:.0f}%)"
+        else:
+            text += f" {self.unit}"
+        text += f", {self.rate():.1f} {self.unit}/s"
+        eta = self.eta()
+        if eta is not None:
+            text += f", ETA {format_duration(eta)}"
+        return text
+
+    def report(self):
+        print(f"  [{self.line()}]")
+        if self.metrics is not None:
+            self.metrics.event('progress', label=self.label, unit=self.unit,
+                               done=self.done, total=self.total,
+                               rate=round(self.rate(), 3), eta_s=self.eta())
+
+
+def format_duration(seconds: float) -> str:
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return f"{hours}h{minutes:02d}m"
+    return f"{minutes}m{seconds:02d}s"
+
+
+# Shared by the scripts so a pipeline run reports into a single registry
+metrics = Metrics()
+atexit.register(metrics.close)
@@ -0,0 +1,533 @@
+import argparse
+import gzip
+import hashlib
+import io
+import itertools
+import json
+import math
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs, urlsplit
+
+from area_sweep import _to_meters, offset_point
+from restaurant_store import RestaurantStore
+
+try:
+    from PIL import Image
+except ImportError:  # The mock photo host needs Pillow to render images
+    Image = None
+
+# Replayed restaurants without coordinates are scattered this far around
+# the crawler's default search center, in meters
+CORPUS_CENTER = (48.862824, 2.322437)
+CORPUS_SPREAD = 2000
+
+# Dish names handed out by the mock Dify workflow
+MOCK_DISHES = ["Margherita Pizza", "Pad Thai", "Ramen", "Caesar Salad",
+               "Beef Burger", "Croque Monsieur", "Tiramisu", "Bibimbap"]
+
+
+class MockBehavior:
+    """
+    Latency and failure knobs shared by the mock servers.
+
+    `latency` is the base response time in seconds and `per_item_latency`
+    is added for each image in a batched request. A fraction
+    `error_rate` of requests answer 500 and `throttle_rate` answer 429
+    with a `Retry-After` header.
+    """
+
+    def __init__(self, latency: float = 0.05, per_item_latency: float = 0.0,
+                 error_rate: float = 0.0, throttle_rate: float = 0.0,
+                 retry_after: float = 0.1):
+        self.latency = latency
+        self.per_item_latency = per_item_latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+
+    def failure(self) -> Optional[int]:
+        """
+        Status code of an injected failure for this request, if any
+        """
+        roll = random.random()
+        if roll < self.throttle_rate:
+            return 429
+        if roll < self.throttle_rate + self.error_rate:
+            return 500
+        return None
+
+
+def _unit(value: str, salt: str) -> float:
+    """
+    Deterministic pseudo-random number in [0, 1) derived from a string
+    """
+    digest = hashlib.sha1(f"{salt}:{value}".encode('utf-8')).hexdigest()
+    return int(digest[:12], 16) / float(1 << 48)
+
+
+class MockCorpus:
+    """
+    Restaurants served by the mock Places and Apify APIs.
+
+    Replays crawler output files (.json lists or .jsonl stores) or a
+    generated set of restaurants. Each restaurant gets a stable location,
+    so nearby searches and area sweeps see a consistent map
+    """
+
+    def __init__(self, restaurants: List[Dict], center=CORPUS_CENTER,
+                 spread: float = CORPUS_SPREAD):
+        self.restaurants: Dict[str, Dict] = {}
+        self.locations: Dict[str, tuple] = {}
+        for restaurant in restaurants:
+            place_id = restaurant['place_id']
+            self.restaurants[place_id] = restaurant
+            # Uniform over a disc around the center
+            distance = spread * math.sqrt(_unit(place_id, 'distance'))
+            angle = 2 * math.pi * _unit(place_id, 'angle')
+            self.locations[place_id] = offset_point(
+                center[0], center[1], distance * math.cos(angle), distance * math.sin(angle))
+
+    @classmethod
+    def from_files(cls, paths: List[str], **kwargs) -> 'MockCorpus':
+        restaurants = []
+        for path in paths:
+            if path.endswith('.jsonl'):
+                store = RestaurantStore(path)
+                restaurants.extend(store)
+                store.close()
+            else:
+                with open(path, 'r', encoding='utf-8') as f:
+                    restaurants.extend(json.load(f))
+        return cls(restaurants, **kwargs)
+
+    @classmethod
+    def synthetic(cls, restaurants: int, photos_per_restaurant: int, **kwargs) -> 'MockCorpus':
+        return cls([{
+            'restaurant_name': f"Mock Restaurant {i}",
+            'place_id': f"mock-place-{i:06d}",
+            'rating': round(3 + 2 * _unit(str(i), 'rating'), 1),
+            'vicinity': f"{i} Rue de la Paix, 75002 Paris, France",
+            'photo_urls': [f"https://lh3.googleusercontent.com/p/mock-{i:06d}-{j:03d}=w400"
+                           for j in range(photos_per_restaurant)]
+        } for i in range(restaurants)], **kwargs)
+
+    def nearby(self, lat: float, lng: float, radius: float, limit: int) -> List[Dict]:
+        """
+        Restaurants within `radius` meters, nearest first
+        """
+        found = []
+        for place_id, location in self.locations.items():
+            east, north = _to_meters((lat, lng), location)
+            distance = math.hypot(east, north)
+            if distance <= radius:
+                found.append((distance, place_id))
+        found.sort()
+        return [self.restaurants[place_id] for _, place_id in found[:limit]]
+
+    def photos(self, place_id: str) -> List[str]:
+        restaurant = self.restaurants.get(place_id)
+        return list(restaurant.get('photo_urls', [])) if restaurant else []
+
+    def photo_count(self) -> int:
+        return sum(len(r.get('photo_urls', [])) for r in self.restaurants.values())
+
+
+def mock_analysis(image_url: str) -> Dict:
+    """
+    Deterministic dish analysis for an image URL, so runs are repeatable
+    """
+    digest = int(hashlib.sha1(image_url.encode('utf-8')).hexdigest()[:8], 16)
+    if digest % 3 == 0:
+        return {'is_a_dish': 0, 'name': '', 'desc': ''}
+    name = MOCK_DISHES[digest % len(MOCK_DISHES)]
+    return {'is_a_dish': 1, 'name': name, 'desc': f"Mock description of {name}"}
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    """
+    Request handler base: JSON bodies in and out, with injected failures
+    """
+
+    behavior = MockBehavior()
+    protocol_version = "HTTP/1.1"  # Keep-alive, like the real APIs
+
+    def log_message(self, format, *args):
+        pass
+
+    def read_json(self) -> Dict:
+        length = int(self.headers.get('Content-Length', 0))
+        data = self.rfile.read(length)
+        # The Apify client compresses request bodies
+        if self.headers.get('Content-Encoding') == 'gzip':
+            data = gzip.decompress(data)
+        return json.loads(data or b'{}')
+
+    def send_json(self, status: int, body, headers: Dict[str, str] = None):
+        data = json.dumps(body).encode('utf-8')
+        with self.server.lock:
+            self.server.status_counts[status] = self.server.status_counts.get(
+                status, 0) + 1
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def fail_if_injected(self) -> bool:
+        """
+        Answer with an injected error, returning True if one was sent
+        """
+        status = self.behavior.failure()
+        if status == 429:
+            self.send_error_json(429, 'too_many_requests', 'Rate limited',
+                                 {'Retry-After': str(self.behavior.retry_after)})
+        elif status is not None:
+            self.send_error_json(status, 'internal_error', 'Injected failure')
+        return status is not None
+
+    def send_error_json(self, status: int, code: str, message: str,
+                        headers: Dict[str, str] = None):
+        """
+        Error response in the API's own error shape
+        """
+        self.send_json(status, {'code': code, 'message': message}, headers)
+
+
+class MockDifyHandler(MockHandler):
+    """
+    Stand-in for Dify's `POST /v1/workflows/run` in blocking mode.
+
+    A single `image` input returns `is_a_dish`/`name`/`desc` outputs like
+    the production workflow; an `images` list returns a `results` array
+    in the same order, as the batched workflow does. Images can be given
+    by URL or as files uploaded with `POST /v1/files/upload`.
+    """
+
+    def do_POST(self):
+        path = self.path.split('?')[0]
+        if path == '/v1/files/upload':
+            self.upload_file()
+            return
+        if path != '/v1/workflows/run':
+            self.send_error_json(404, 'not_found', self.path)
+            return
+        body = self.read_json()
+        inputs = body.get('inputs', {})
+        images = inputs.get('images')
+        count = len(images) if isinstance(images, list) else 1
+        time.sleep(self.behavior.latency +
+                   self.behavior.per_item_latency * count)
+        if self.fail_if_injected():
+            return
+
+        if isinstance(images, list):
+            outputs = {'results': [mock_analysis(image_key(image))
+                                   for image in images]}
+        elif 'image' in inputs:
+            outputs = mock_analysis(image_key(inputs['image']))
+        else:
+            self.send_error_json(400, 'invalid_param', 'image is required')
+            return
+
+        run_id = hashlib.sha1(
+            json.dumps(inputs, sort_keys=True).encode('utf-8')).hexdigest()
+        self.send_json(200, {
+            'workflow_run_id': run_id,
+            'task_id': run_id,
+            'data': {
+                'id': run_id,
+                'workflow_id': 'mock-workflow',
+                'status': 'succeeded',
+                'outputs': outputs,
+                'error': None,
+                'elapsed_time': self.behavior.latency,
+                'total_tokens': 0,
+                'total_steps': 1,
+                'created_at': int(time.time()),
+                'finished_at': int(time.time())
+            }
+        })
+
+
+    def upload_file(self):
+        """
+        Accept a multipart upload; the id is derived from the body so
+        repeated uploads of one file get the same id
+        """
+        data = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        time.sleep(self.behavior.latency)
+        if self.fail_if_injected():
+            return
+        digest = hashlib.sha1(data).hexdigest()
+        self.send_json(201, {
+            'id': f"{digest[:8]}-{digest[8:12]}-{digest[12:16]}-{digest[16:20]}-{digest[20:32]}",
+            'name': 'photo.jpg',
+            'size': len(data),
+            'extension': 'jpg',
+            'mime_type': 'image/jpeg',
+            'created_by': 'image-analyzer',
+            'created_at': int(time.time())
+        })
+
+
+def image_key(image: Dict) -> str:
+    return image.get('url') or image.get('upload_file_id', '')
+
+
+class MockPhotoHandler(MockHandler):
+    """
+    Photo host answering any `GET` path with a JPEG whose colours are
+    derived from the path, at roughly the size Google serves full photos
+    """
+
+    width, height = 1600, 1200
+
+    def do_GET(self):
+        time.sleep(self.behavior.latency)
+        if self.fail_if_injected():
+            return
+        if Image is None:
+            self.send_error_json(501, 'not_implemented', 'Pillow is not installed')
+            return
+        digest = hashlib.sha1(self.path.encode('utf-8')).digest()
+        image = Image.new('RGB', (self.width, self.height), tuple(digest[:3]))
+        # A few blocks so thumbnails and perceptual hashes differ per photo
+        for i in range(4):
+            box = (digest[3 + i] * self.width // 256, digest[7 + i] * self.height // 256)
+            image.paste(tuple(digest[11 + i:14 + i]),
+                        box + (box[0] + self.width // 4, box[1] + self.height // 4))
+        output = io.BytesIO()
+        image.save(output, 'JPEG', quality=90)
+        data = output.getvalue()
+        with self.server.lock:
+            self.server.status_counts[200] = self.server.status_counts.get(200, 0) + 1
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/jpeg')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class MockPlacesHandler(MockHandler):
+    """
+    Stand-in for Google Places `POST /v1/places:searchNearby`, answering
+    from the corpus
+    """
+
+    corpus = MockCorpus([])
+
+    def send_error_json(self, status, code, message, headers=None):
+        self.send_json(status, {'error': {'code': status, 'message': message,
+                                          'status': code.upper()}}, headers)
+
+    def do_POST(self):
+        if self.path.split('?')[0] != '/v1/places:searchNearby':
+            self.send_error_json(404, 'not_found', self.path)
+            return
+        body = self.read_json()
+        time.sleep(self.behavior.latency)
+        if self.fail_if_injected():
+            return
+
+        circle = body.get('locationRestriction', {}).get('circle', {})
+        center = circle.get('center', {})
+        restaurants = self.corpus.nearby(center.get('latitude', 0.0), center.get('longitude', 0.0),
+                                         circle.get('radius', 0.0), body.get('maxResultCount', 20))
+        places = []
+        for restaurant in restaurants:
+            latitude, longitude = self.corpus.locations[restaurant['place_id']]
+            places.append({
+                'id': restaurant['place_id'],
+                'displayName': {'text': restaurant.get('restaurant_name', ''), 'languageCode': 'en'},
+                'rating': restaurant.get('rating'),
+                'formattedAddress': restaurant.get('vicinity', ''),
+                'types': ['restaurant', 'food', 'point_of_interest', 'establishment'],
+                'location': {'latitude': latitude, 'longitude': longitude}
+            })
+        self.send_json(200, {'places': places} if places else {})
+
+
+class MockApifyHandler(MockHandler):
+    """
+    Stand-in for the parts of the Apify API used by `ActorClient.call()`
+    and `DatasetClient.iterate_items()`.
+
+    Actor runs finish as soon as they are started (after the configured
+    latency); their dataset holds one item per requested placeId with the
+    corpus photo URLs, like the Google Maps scraper actor. Actor and run
+    objects carry every field the API returns, since newer clients
+    validate them
+    """
+
+    corpus = MockCorpus([])
+    # apify-client 1.x calls /v2/acts/..., newer clients /v2/actors/...
+    actor_routes = ('acts', 'actors')
+    runs: Dict[str, Dict] = {}
+    datasets: Dict[str, List[Dict]] = {}
+    run_ids = itertools.count(1)
+
+    def send_error_json(self, status, code, message, headers=None):
+        self.send_json(
+            status, {'error': {'type': code, 'message': message}}, headers)
+
+    def do_POST(self):
+        parts = urlsplit(self.path).path.strip('/').split('/')
+        if len(parts) != 4 or parts[0] != 'v2' or parts[1] not in self.actor_routes \
+                or parts[3] != 'runs':
+            self.send_error_json(404, 'record-not-found', self.path)
+            return
+        run_input = self.read_json()
+        place_ids = run_input.get('placeIds', [])
+        time.sleep(self.behavior.latency +
+                   self.behavior.per_item_latency * len(place_ids))
+        if self.fail_if_injected():
+            return
+
+        number = next(self.run_ids)
+        run_id, dataset_id = f"mockrun{number:08d}", f"mockdataset{number:08d}"
+        now = time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime())
+        self.datasets[dataset_id] = [
+            {'placeId': place_id, 'imageUrls': self.corpus.photos(place_id)}
+            for place_id in place_ids]
+        self.runs[run_id] = {
+            'id': run_id, 'actId': parts[2], 'userId': 'mockuser',
+            'status': 'SUCCEEDED', 'statusMessage': 'Finished',
+            'isStatusMessageTerminal': True, 'startedAt': now, 'finishedAt': now,
+            'buildId': 'mockbuild', 'buildNumber': '0.0.1', 'exitCode': 0,
+            'meta': {'origin': 'API', 'userAgent': self.headers.get('User-Agent', '')},
+            'stats': {'inputBodyLen': int(self.headers.get('Content-Length') or 0),
+                      'restartCount': 0, 'resurrectCount': 0, 'computeUnits': 0,
+                      'durationMillis': int(self.behavior.latency * 1000),
+                      'runTimeSecs': self.behavior.latency},
+            'options': {'build': 'latest', 'timeoutSecs': 3600,
+                        'memoryMbytes': 1024, 'diskMbytes': 2048},
+            'usageTotalUsd': 0,
+            'defaultDatasetId': dataset_id, 'defaultKeyValueStoreId': dataset_id,
+            'defaultRequestQueueId': dataset_id
+        }
+        self.send_json(201, {'data': self.runs[run_id]})
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        parts = url.path.strip('/').split('/')
+        query = parse_qs(url.query)
+        if len(parts) == 3 and parts[0] == 'v2' and parts[1] in self.actor_routes:
+            self.send_json(200, {'data': {
+                'id': parts[2], 'userId': 'mockuser', 'name': 'mock-actor',
+                'username': 'mock', 'isPublic': False,
+                'createdAt': '2024-01-01T00:00:00.000Z', 'modifiedAt': '2024-01-01T00:00:00.000Z',
+                'stats': {'totalBuilds': 1, 'totalRuns': len(self.runs)},
+                'versions': [],
+                'defaultRunOptions': {'build': 'latest', 'timeoutSecs': 3600,
+                                      'memoryMbytes': 1024}
+            }})
+        elif len(parts) == 3 and parts[:2] == ['v2', 'actor-runs'] and parts[2] in self.runs:
+            self.send_json(200, {'data': self.runs[parts[2]]})
+        elif len(parts) == 4 and parts[:2] == ['v2', 'actor-runs'] and parts[3] == 'log':
+            self.send_json(200, '')
+        elif len(parts) == 4 and parts[:2] == ['v2', 'datasets'] and parts[3] == 'items' \
+                and parts[2] in self.datasets:
+            items = self.datasets[parts[2]]
+            offset = int(query.get('offset', ['0'])[0])
+            limit = int(query.get('limit', [str(len(items))])[0])
+            page = items[offset:offset + limit]
+            self.send_json(200, page, {
+                'X-Apify-Pagination-Total': str(len(items)),
+                'X-Apify-Pagination-Offset': str(offset),
+                'X-Apify-Pagination-Count': str(len(page)),
+                'X-Apify-Pagination-Limit': str(limit),
+                'X-Apify-Pagination-Desc': 'false'
+            })
+        else:
+            self.send_error_json(404, 'record-not-found', self.path)
+
+
+def start_server(handler_class, behavior: MockBehavior, port: int = 0,
+                 host: str = '127.0.0.1', **attributes) -> ThreadingHTTPServer:
+    """
+    Serve a mock handler on a background thread, with `attributes` (e.g.
+    the corpus) set on its handler class. Port 0 picks a free port; read
+    it back from `server.server_address`. Responses are counted by status
+    in `server.status_counts`
+    """
+    attributes['behavior'] = behavior
+    if issubclass(handler_class, MockApifyHandler):
+        # Runs are per server, not shared through the base class
+        attributes.update(runs={}, datasets={}, run_ids=itertools.count(1))
+    handler = type(handler_class.__name__, (handler_class,), attributes)
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.status_counts = {}
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def add_mock_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help="Base response time in seconds")
+    parser.add_argument('--per-item-latency', type=float, default=0.0,
+                        help="Extra seconds per image or place in a batched request")
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help="Fraction of requests answered with 500")
+    parser.add_argument('--throttle-rate', type=float, default=0.0,
+                        help="Fraction of requests answered with 429")
+    parser.add_argument('--corpus', nargs='*', default=None,
+                        help="Crawler output files to replay (default: generated restaurants)")
+    parser.add_argument('--restaurants', type=int, default=200,
+                        help="Generated restaurants when no corpus is given")
+    parser.add_argument('--photos', type=int, default=20,
+                        help="Photos per generated restaurant")
+
+
+def mock_behavior(args: argparse.Namespace) -> MockBehavior:
+    return MockBehavior(args.latency, args.per_item_latency,
+                        args.error_rate, args.throttle_rate)
+
+
+def mock_corpus(args: argparse.Namespace) -> MockCorpus:
+    if args.corpus:
+        return MockCorpus.from_files(args.corpus)
+    return MockCorpus.synthetic(args.restaurants, args.photos)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Run local mocks of the Dify, Google Places and Apify APIs")
+    parser.add_argument('--dify-port', type=int, default=8765)
+    parser.add_argument('--places-port', type=int, default=8766)
+    parser.add_argument('--apify-port', type=int, default=8767)
+    add_mock_arguments(parser)
+    args = parser.parse_args(argv)
+
+    behavior = mock_behavior(args)
+    corpus = mock_corpus(args)
+    servers = [
+        start_server(MockDifyHandler, behavior, args.dify_port),
+        start_server(MockPlacesHandler, behavior,
+                     args.places_port, corpus=corpus),
+        start_server(MockApifyHandler, behavior,
+                     args.apify_port, corpus=corpus)
+    ]
+    print(f"Serving {len(corpus.restaurants)} restaurants, "
+          f"{corpus.photo_count()} photos")
+    print(
+        f"Mock Dify workflow at http://127.0.0.1:{args.dify_port}/v1/workflows/run")
+    print(f"Mock Google Places at http://127.0.0.1:{args.places_port}/v1")
+    print(f"Mock Apify API at http://127.0.0.1:{args.apify_port}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        for server in servers:
+            server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+import json
+import os
+import sys
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+try:
+    from pymongo import ASCENDING, MongoClient, UpdateOne
+    from pymongo.errors import BulkWriteError, PyMongoError
+except ImportError:  # pymongo is only needed for the direct MongoDB output mode
+    MongoClient = None
+
+MONGODB_URI = os.environ.get("MONGODB_URI", "mongodb://localhost:27017")
+MONGODB_DATABASE = "restaurant_db"
+MONGODB_COLLECTION = "dishes"
+MONGODB_BATCH_SIZE = 500
+
+
+def open_collection(uri: str = MONGODB_URI, database: str = MONGODB_DATABASE,
+                    collection: str = MONGODB_COLLECTION):
+    """
+    Connect to the dishes collection and ensure the upsert key is indexed
+    """
+    if MongoClient is None:
+        raise ImportError(
+            "pymongo is required for MongoDB output (pip install pymongo)")
+    dishes = MongoClient(uri)[database][collection]
+    dishes.create_index([('place_id', ASCENDING), ('photo_url', ASCENDING)],
+                        unique=True)
+    return dishes
+
+
+def build_dish_document(restaurant_name: str, place_id: str, photo_url: str,
+                        dish_name: str, description: str) -> Dict:
+    return {
+        'dish_name': dish_name,
+        'description': description,
+        'photo_url': photo_url,
+        'place_id': place_id,
+        'restaurant_name': restaurant_name
+    }
+
+
+class MongoBulkLoader:
+    """
+    Batches dish documents into unordered bulkWrite upserts.
+
+    Documents are keyed on (place_id, photo_url), so loading the same
+    results twice updates rather than duplicates them. `collection` can be
+    any pymongo-compatible collection, including a mongomock one.
+    """
+
+    def __init__(self, collection, batch_size: int = MONGODB_BATCH_SIZE):
+        self.collection = collection
+        self.batch_size = batch_size
+        self.upserted = 0
+        self.modified = 0
+        self.errors = 0
+        self._operations = []
+        self._keys = []
+
+    def add(self, document: Dict) -> Optional[List[Dict]]:
+        """
+        Queue an upsert, flushing once a batch is full. Returns the keys
+        that failed when it flushed, or None when it did not
+        """
+        key = {'place_id': document['place_id'],
+               'photo_url': document['photo_url']}
+        self._keys.append(key)
+        self._operations.append(UpdateOne(
+            key,
+            {'$set': document,
+             '$setOnInsert': {'created_at': datetime.now(timezone.utc),
+                              'verified': False}},
+            upsert=True))
+        if len(self._operations) >= self.batch_size:
+            return self.flush()
+        return None
+
+    def flush(self) -> List[Dict]:
+        """
+        Send pending upserts in a single unordered bulkWrite. Returns the
+        (place_id, photo_url) keys of the documents that were not written
+        """
+        if not self._operations:
+            return []
+        operations, self._operations = self._operations, []
+        keys, self._keys = self._keys, []
+        try:
+            result = self.collection.bulk_write(operations, ordered=False)
+            details = result.bulk_api_result
+            failed = []
+        except BulkWriteError as e:
+            details = e.details
+            failed = [keys[error['index']] for error in details.get('writeErrors', [])]
+            print(f"    MongoDB bulk write had {len(failed)} errors")
+        except PyMongoError as e:
+            # Nothing is known to be written, e.g. the server is unreachable
+            details = {}
+            failed = keys
+            print(f"    MongoDB bulk write failed: {e}")
+        self.errors += len(failed)
+        self.upserted += details.get('nUpserted', 0)
+        self.modified += details.get('nModified', 0)
+        return failed
+
+    def close(self):
+        self.flush()
+
+
+def load_analysis_results(path: str, loader: MongoBulkLoader) -> int:
+    """
+    Upsert every dish found in a photo_analysis_results.jsonl file.
+
+    Safe to re-run after a crash since the upserts are idempotent.
+    """
+    loaded = 0
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except ValueError:
+                continue
+            analysis = result.get('analysis') or {}
+            if analysis.get('is_a_dish') == 1 and analysis.get('name'):
+                loader.add(build_dish_document(
+                    result['restaurant_name'], result['place_id'],
+                    result['photo_url'], analysis['name'], analysis.get('desc', '')))
+                loaded += 1
+    loader.flush()
+    return loaded
+
+
+def main(path: Optional[str] = None):
+    path = path or "photo_analysis_results.jsonl"
+    loader = MongoBulkLoader(open_collection())
+    loaded = load_analysis_results(path, loader)
+    print(f"Loaded {loaded} dishes from {path}: {loader.upserted} inserted, "
+          f"{loader.modified} updated, {loader.errors} errors")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1] if len(sys.argv) > 1 else None)
@@ -0,0 +1,218 @@
+import glob
+import json
+import os
+import re
+from typing import Dict, List, Set, Tuple
+
+from kb_store import Segment, compact, segment_paths, write_segment
+
+
+def truncate_torn_line(path: str):
+    """
+    Drop a trailing partial line left by an interrupted append, so the
+    next record does not get glued onto it
+    """
+    if not os.path.exists(path):
+        return
+    with open(path, 'rb+') as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        if size == 0:
+            return
+        f.seek(size - 1)
+        if f.read(1) == b"\n":
+            return
+        # Walk back to the end of the last complete line
+        position = size
+        while position > 0:
+            step = min(4096, position)
+            f.seek(position - step)
+            chunk = f.read(step)
+            newline = chunk.rfind(b"\n")
+            if newline != -1:
+                f.truncate(position - step + newline + 1)
+                return
+            position -= step
+        f.truncate(0)
+
+
+class JsonlWriter:
+    """
+    Append-only JSON lines sink, flushed after every record
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.count = 0
+        truncate_torn_line(path)
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def write(self, record: Dict):
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._file.flush()
+        self.count += 1
+
+    def close(self):
+        self._file.close()
+
+
+MONGODB_COMMANDS_HEADER = ("// MongoDB insert commands for dishes\n"
+                           "// Generated from restaurant photo analysis\n\n"
+                           "use restaurant_db;\n\n")
+
+
+class MongoCommandWriter:
+    """
+    Streams MongoDB shell commands to a .js file as they are generated
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.count = 0
+        is_new = not os.path.exists(path) or os.path.getsize(path) == 0
+        self._file = open(path, 'a', encoding='utf-8')
+        if is_new:
+            self._file.write(MONGODB_COMMANDS_HEADER)
+            self._file.flush()
+
+    def write(self, command: str):
+        self._file.write(command + "\n\n")
+        self._file.flush()
+        self.count += 1
+
+    def close(self):
+        self._file.close()
+
+
+class KnowledgeBaseWriter:
+    """
+    Writes knowledge base dishes in batches, either as compact columnar
+    segments (see kb_store.py) or as numbered JSON batch files.
+
+    Dishes of the batch being filled are also appended to a pending
+    journal, so a crash never loses more than a torn line. Replayed
+    dishes already in the newest batch on disk are dropped: a crash
+    between writing a batch and truncating the journal leaves them in
+    both. Segment names are derived from their creation time and
+    content; JSON numbering continues after the highest batch already on
+    disk. Either way earlier runs are never overwritten.
+    """
+
+    PENDING_FILE = "pending_batch.jsonl"
+
+    def __init__(self, directory: str, batch_size: int, kb_format: str = "segments"):
+        self.directory = directory
+        self.batch_size = batch_size
+        self.kb_format = kb_format
+        self.batches_written = 0
+        self.total_dishes = 0
+
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+        self.batch_number = self._last_batch_number() + 1
+        self._pending_path = os.path.join(directory, self.PENDING_FILE)
+        truncate_torn_line(self._pending_path)
+        self._dishes = self._load_pending()
+        self._pending = open(self._pending_path, 'a', encoding='utf-8')
+
+    def _last_batch_number(self) -> int:
+        numbers = [0]
+        for path in glob.glob(os.path.join(self.directory, "knowledge_base_batch_*.json")):
+            match = re.search(r'_(\d+)\.json$', path)
+            if match:
+                numbers.append(int(match.group(1)))
+        return max(numbers)
+
+    def _last_batch_keys(self) -> Set[Tuple[str, str]]:
+        """
+        (place_id, photo_url) of every dish in the newest segment or
+        numbered batch file
+        """
+        if self.kb_format == "segments":
+            paths = segment_paths(self.directory)
+            if not paths:
+                return set()
+            segment = Segment(paths[-1])
+            keys = set(zip(segment.column('place_id'), segment.column('photo_url')))
+            segment.close()
+            return keys
+
+        path = os.path.join(
+            self.directory, f"knowledge_base_batch_{self.batch_number - 1:03d}.json")
+        if not os.path.exists(path):
+            return set()
+        with open(path, 'r', encoding='utf-8') as f:
+            return {(dish.get('place_id') or '', dish.get('photo_url') or '')
+                    for dish in json.load(f)}
+
+    def _load_pending(self) -> List[Dict]:
+        dishes = []
+        if os.path.exists(self._pending_path):
+            with open(self._pending_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        dishes.append(json.loads(line))
+                    except ValueError:
+                        continue
+        if dishes:
+            written = self._last_batch_keys()
+            replayed = [dish for dish in dishes
+                        if (dish.get('place_id') or '', dish.get('photo_url') or '') not in written]
+            if len(replayed) < len(dishes):
+                print(f"Dropped {len(dishes) - len(replayed)} pending knowledge base dishes "
+                      f"already saved in the last batch")
+                # Rewritten so a later batch doesn't hide them from the next replay
+                temp_path = self._pending_path + ".tmp"
+                with open(temp_path, 'w', encoding='utf-8') as f:
+                    for dish in replayed:
+                        f.write(json.dumps(dish, ensure_ascii=False) + "\n")
+                os.replace(temp_path, self._pending_path)
+            dishes = replayed
+        if dishes:
+            print(f"Restored {len(dishes)} pending knowledge base dishes")
+        return dishes
+
+    def add(self, dish: Dict):
+        self._dishes.append(dish)
+        self._pending.write(json.dumps(dish, ensure_ascii=False) + "\n")
+        self._pending.flush()
+        self.total_dishes += 1
+
+        # Save knowledge base batch when reaching batch size
+        if len(self._dishes) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Write the pending dishes as a new segment or numbered batch file
+        """
+        if not self._dishes:
+            return
+
+        if self.kb_format == "segments":
+            filename = os.path.basename(
+                write_segment(self.directory, self._dishes))
+        else:
+            filename = f"knowledge_base_batch_{self.batch_number:03d}.json"
+            filepath = os.path.join(self.directory, filename)
+            with open(filepath, 'w', encoding='utf-8') as f:
+                json.dump(self._dishes, f, ensure_ascii=False, indent=2)
+
+        print(
+            f"    Saved knowledge base batch {self.batch_number} ({len(self._dishes)} dishes) to {filename}")
+
+        self._dishes = []
+        self._pending.truncate(0)
+        self.batch_number += 1
+        self.batches_written += 1
+
+    def close(self):
+        self.flush()
+        self._pending.close()
+        # Fold this run's small segments into one
+        if self.kb_format == "segments":
+            merged = compact(self.directory)
+            if merged:
+                print(
+                    f"Compacted knowledge base segments into {os.path.basename(merged)}")
@@ -0,0 +1,100 @@
+from concurrent.futures import Executor
+from typing import Callable, Dict, List, Optional, Tuple
+
+from image_utils import hamming_distance, normalize_photo_url
+
+# Max differing bits between 64-bit difference hashes of the same shot
+DEFAULT_MAX_DISTANCE = 6
+
+
+class BKTree:
+    """
+    Burkhard-Keller tree over integer hashes under Hamming distance.
+
+    Lookups only descend into children whose edge distance can still
+    be within range, so near-duplicate search avoids comparing against
+    every stored hash.
+    """
+
+    def __init__(self):
+        self._root = None
+        self.size = 0
+
+    def add(self, value: int, item):
+        node = [value, item, {}]
+        self.size += 1
+        if self._root is None:
+            self._root = node
+            return
+        current = self._root
+        while True:
+            distance = hamming_distance(value, current[0])
+            child = current[2].get(distance)
+            if child is None:
+                current[2][distance] = node
+                return
+            current = child
+
+    def search(self, value: int, max_distance: int) -> List[Tuple[int, object]]:
+        """
+        All (distance, item) pairs within `max_distance`, nearest first
+        """
+        if self._root is None:
+            return []
+        matches = []
+        stack = [self._root]
+        while stack:
+            node = stack.pop()
+            distance = hamming_distance(value, node[0])
+            if distance <= max_distance:
+                matches.append((distance, node[1]))
+            for edge, child in node[2].items():
+                if distance - max_distance <= edge <= distance + max_distance:
+                    stack.append(child)
+        return sorted(matches, key=lambda match: match[0])
+
+
+def dedupe_photos(photo_urls: List[str],
+                  image_hash: Optional[Callable[[str], Optional[int]]] = None,
+                  max_distance: int = DEFAULT_MAX_DISTANCE,
+                  executor: Optional[Executor] = None) -> Tuple[List[str], Dict[str, str]]:
+    """
+    Collapse duplicate photos of one restaurant, keeping first occurrences.
+
+    URLs that normalize to the same image (size/crop variants) are always
+    merged. With `image_hash`, photos whose perceptual hashes are within
+    `max_distance` bits are merged too; hashes are computed on `executor`
+    when given. Returns the unique URLs and a duplicate -> kept URL map.
+    """
+    unique = []
+    duplicates = {}
+    by_key = {}
+    for photo_url in photo_urls:
+        key = normalize_photo_url(photo_url)
+        if key in by_key:
+            if photo_url != by_key[key]:
+                duplicates[photo_url] = by_key[key]
+            continue
+        by_key[key] = photo_url
+        unique.append(photo_url)
+
+    if image_hash is None or len(unique) < 2:
+        return unique, duplicates
+
+    if executor is not None:
+        hashes = list(executor.map(image_hash, unique))
+    else:
+        hashes = [image_hash(photo_url) for photo_url in unique]
+
+    tree = BKTree()
+    kept = []
+    for photo_url, value in zip(unique, hashes):
+        if value is not None:
+            matches = tree.search(value, max_distance)
+            if matches:
+                duplicates[photo_url] = matches[0][1]
+                continue
+            tree.add(value, photo_url)
+        kept.append(photo_url)
+
+    return kept, duplicates
@@ -0,0 +1,276 @@
+import argparse
+import io
+import json
+import math
+import os
+from typing import Dict, List, Optional, Tuple
+
+try:
+    from PIL import Image, ImageFilter, ImageStat
+except ImportError:  # Pillow is only needed when the pre-filter is enabled
+    Image = None
+
+# Logistic weights over the features below. Hand-tuned starting point:
+# dishes tend to be saturated, warm and centred, while menus, storefronts
+# and people show up as text-like contrast, hard edges and skin tones.
+# Only used to score photos in audit mode; enforcing needs a weights file
+# fitted on the audit results (`python photo_filter.py fit`)
+DEFAULT_MODEL = {
+    'bias': -0.5,
+    'threshold': 0.25,
+    'weights': {
+        'saturation': 2.0,
+        'colorfulness': 1.5,
+        'warm_fraction': 2.0,
+        'center_ratio': 0.8,
+        'text_fraction': -3.0,
+        'skin_fraction': -2.5,
+        'edge_density': -1.5
+    }
+}
+
+FEATURE_SIZE = 64  # Thumbnails are downscaled to this square before scoring
+
+AUDIT_RESULTS_FILE = "photo_analysis_results.jsonl"  # image-marker.py output
+MODEL_FILE = "prefilter_model.json"
+FIT_MIN_RECALL = 0.98  # Share of Dify-confirmed dishes the threshold must keep
+FIT_L2 = 1e-3  # Ridge penalty keeping the weights finite on separable data
+FIT_MAX_ITERATIONS = 50
+
+
+def extract_features(data: bytes) -> Optional[Dict[str, float]]:
+    """
+    Cheap colour/texture features of an image, or None if it can't be read
+    """
+    if Image is None:
+        return None
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            rgb = image.convert('RGB').resize((FEATURE_SIZE, FEATURE_SIZE))
+    except Exception:
+        return None
+
+    hsv = rgb.convert('HSV')
+    pixels = list(rgb.getdata())
+    hsv_pixels = list(hsv.getdata())
+    count = len(pixels)
+
+    # Hasler & Suesstrunk colourfulness
+    rg = [r - g for r, g, b in pixels]
+    yb = [0.5 * (r + g) - b for r, g, b in pixels]
+    mean_rg, mean_yb = sum(rg) / count, sum(yb) / count
+    std_rg = math.sqrt(sum((v - mean_rg) ** 2 for v in rg) / count)
+    std_yb = math.sqrt(sum((v - mean_yb) ** 2 for v in yb) / count)
+    colorfulness = math.hypot(std_rg, std_yb) + \
+        0.3 * math.hypot(mean_rg, mean_yb)
+
+    saturation = ImageStat.Stat(hsv).mean[1] / 255
+    margin = FEATURE_SIZE // 4
+    center = hsv.crop((margin, margin, FEATURE_SIZE - margin,
+                       FEATURE_SIZE - margin))
+    center_saturation = ImageStat.Stat(center).mean[1] / 255
+
+    gray = rgb.convert('L')
+    edges = gray.filter(ImageFilter.FIND_EDGES)
+    gray_pixels = list(gray.getdata())
+
+    warm = sum(1 for h, s, v in hsv_pixels
+               if (h < 32 or h > 235) and s > 64 and v > 64)
+    text_like = sum(1 for v in gray_pixels if v > 220 or v < 35)
+    skin = sum(1 for r, g, b in pixels
+               if r > 95 and g > 40 and b > 20 and r > g and r > b
+               and abs(r - g) > 15 and max(r, g, b) - min(r, g, b) > 15)
+
+    return {
+        'saturation': saturation,
+        'colorfulness': colorfulness / 100,
+        'warm_fraction': warm / count,
+        'center_ratio': center_saturation / saturation if saturation else 1.0,
+        'text_fraction': text_like / count,
+        'skin_fraction': skin / count,
+        'edge_density': ImageStat.Stat(edges).mean[0] / 255
+    }
+
+
+def model_score(model: Dict, features: Dict[str, float]) -> float:
+    z = model['bias'] + sum(weight * features.get(name, 0.0)
+                            for name, weight in model['weights'].items())
+    return 1 / (1 + math.exp(-z))
+
+
+class PhotoPreFilter:
+    """
+    Local CPU-only scorer that flags likely non-dish photos before they
+    are sent to Dify.
+
+    The score is a logistic model over `extract_features()`; photos
+    scoring below the threshold are rejected. With `enforce=False` the
+    decision is only recorded (audit mode), so its precision can be
+    checked against Dify's answers before any calls are skipped.
+    """
+
+    def __init__(self, model_path: str = None, enforce: bool = False):
+        self.model = DEFAULT_MODEL
+        if model_path and os.path.exists(model_path):
+            with open(model_path, 'r', encoding='utf-8') as f:
+                self.model = json.load(f)
+        elif enforce:
+            print(f"Warning: no fitted pre-filter model at {model_path}, recording "
+                  f"decisions only. Fit one with `python photo_filter.py fit`")
+            enforce = False
+        self.enforce = enforce
+
+        if Image is None:
+            print("Warning: Pillow is not installed, photo pre-filter disabled")
+
+    def score(self, features: Dict[str, float]) -> float:
+        return model_score(self.model, features)
+
+    def evaluate(self, data: Optional[bytes]) -> Dict:
+        """
+        Decision for one thumbnail. Fails open when it can't be scored
+        """
+        features = extract_features(data) if data else None
+        if features is None:
+            return {'score': None, 'rejected': False, 'reason': 'unscored'}
+
+        score = self.score(features)
+        rejected = score < self.model['threshold']
+        return {
+            'score': round(score, 4),
+            'rejected': rejected,
+            'reason': 'below threshold' if rejected else 'passed',
+            'features': {name: round(value, 4) for name, value in features.items()}
+        }
+
+
+def load_audit_samples(path: str) -> Tuple[List[Dict[str, float]], List[int]]:
+    """
+    Pre-filter features and Dify's dish/non-dish answer of every scored
+    photo in an analysis results file. Photos the pre-filter skipped were
+    never sent to Dify, so they carry no answer and are left out
+    """
+    samples, labels = [], []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            result = json.loads(line)
+            decision = result.get('prefilter') or {}
+            if not decision.get('features') or decision.get('enforced'):
+                continue
+            samples.append(decision['features'])
+            labels.append(1 if result.get('analysis', {}).get('is_a_dish') == 1 else 0)
+    return samples, labels
+
+
+def _solve(matrix: List[List[float]], vector: List[float]) -> List[float]:
+    """
+    Solve a small positive definite system by Gaussian elimination
+    """
+    size = len(vector)
+    rows = [matrix[i][:] + [vector[i]] for i in range(size)]
+    for column in range(size):
+        pivot = max(range(column, size), key=lambda i: abs(rows[i][column]))
+        rows[column], rows[pivot] = rows[pivot], rows[column]
+        for i in range(column + 1, size):
+            factor = rows[i][column] / rows[column][column]
+            for j in range(column, size + 1):
+                rows[i][j] -= factor * rows[column][j]
+    solution = [0.0] * size
+    for i in reversed(range(size)):
+        solution[i] = (rows[i][size] - sum(rows[i][j] * solution[j]
+                                           for j in range(i + 1, size))) / rows[i][i]
+    return solution
+
+
+def fit_model(samples: List[Dict[str, float]], labels: List[int],
+              min_recall: float = FIT_MIN_RECALL) -> Dict:
+    """
+    Fit the logistic weights to Dify's answers by Newton's method, then
+    pick the highest threshold that still keeps `min_recall` of the
+    dishes. Returns a model in DEFAULT_MODEL's format, with fit stats
+    """
+    dishes = sum(labels)
+    if not dishes or dishes == len(labels):
+        raise ValueError("Fitting needs both dishes and non-dishes among the scored photos")
+
+    names = list(DEFAULT_MODEL['weights'])
+    rows = [[1.0] + [sample.get(name, 0.0) for name in names] for sample in samples]
+    size = len(names) + 1
+    coefficients = [0.0] * size
+    for _ in range(FIT_MAX_ITERATIONS):
+        gradient = [0.0] + [FIT_L2 * c for c in coefficients[1:]]
+        hessian = [[FIT_L2 if i == j and i else 0.0 for j in range(size)]
+                   for i in range(size)]
+        for x, y in zip(rows, labels):
+            z = sum(c * v for c, v in zip(coefficients, x))
+            p = 1 / (1 + math.exp(-max(-30.0, min(30.0, z))))
+            weight = max(p * (1 - p), 1e-9)
+            for i in range(size):
+                gradient[i] += (p - y) * x[i]
+                scaled = weight * x[i]
+                for j in range(i + 1):
+                    hessian[i][j] += scaled * x[j]
+        for i in range(size):
+            for j in range(i + 1, size):
+                hessian[i][j] = hessian[j][i]
+        step = _solve(hessian, gradient)
+        coefficients = [c - s for c, s in zip(coefficients, step)]
+        if max(abs(s) for s in step) < 1e-6:
+            break
+
+    model = {'bias': coefficients[0], 'threshold': 0.0,
+             'weights': dict(zip(names, coefficients[1:]))}
+    scores = [model_score(model, sample) for sample in samples]
+    dish_scores = sorted(score for score, label in zip(scores, labels) if label)
+    model['threshold'] = dish_scores[int((1 - min_recall) * len(dish_scores))]
+
+    rejected = [label for score, label in zip(scores, labels)
+                if score < model['threshold']]
+    model['fit'] = {
+        'samples': len(labels),
+        'dishes': dishes,
+        'recall': round(1 - sum(rejected) / dishes, 4),
+        'skipped_non_dishes': round(
+            (len(rejected) - sum(rejected)) / (len(labels) - dishes), 4)
+    }
+    return model
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Fit the photo pre-filter to Dify's answers from an audit run")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    fit_parser = subparsers.add_parser(
+        'fit', help="Fit logistic weights and a threshold to audit results")
+    fit_parser.add_argument('--results', default=AUDIT_RESULTS_FILE,
+                            help="Analysis results of a --prefilter audit run")
+    fit_parser.add_argument('--output', default=MODEL_FILE,
+                            help="Weights file read by image-marker.py")
+    fit_parser.add_argument('--min-recall', type=float, default=FIT_MIN_RECALL,
+                            help="Share of dishes the threshold must keep")
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'fit':
+        samples, labels = load_audit_samples(args.results)
+        if not samples:
+            parser.exit(1, f"No pre-filter scores in {args.results}; "
+                           f"run the analysis with --prefilter audit first\n")
+        try:
+            model = fit_model(samples, labels, args.min_recall)
+        except ValueError as e:
+            parser.exit(1, f"{e}\n")
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(model, f, indent=2)
+        stats = model['fit']
+        print(f"Fitted on {stats['samples']} photos ({stats['dishes']} dishes): "
+              f"threshold {model['threshold']:.4f} keeps {stats['recall']:.1%} of dishes "
+              f"and skips {stats['skipped_non_dishes']:.1%} of non-dishes")
+        print(f"Wrote {args.output}; enforce it with --prefilter enforce")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+from typing import Callable, Dict, List, Optional, Sequence, Set
+
+from dish_index import normalize_text
+
+# "crawl" keeps the crawler's order, "spread" samples evenly across the
+# list, "prefilter" takes the photos the pre-filter scores highest first
+SAMPLE_ORDERS = ("crawl", "spread", "prefilter")
+
+
+def spread_order(items: Sequence) -> List:
+    """
+    Items reordered so that every prefix is spread evenly over the list:
+    the first item, then the middle, the quarter points and so on.
+    Photo lists come grouped (menu shots, interiors, one visit's uploads),
+    so a spread prefix covers more of them than the head of the list
+    """
+    order = []
+    seen = set()
+    denominator = 1
+    while len(order) < len(items):
+        for numerator in range(denominator):
+            if denominator > 1 and numerator % 2 == 0:
+                continue
+            position = numerator * len(items) // denominator
+            if position not in seen:
+                seen.add(position)
+                order.append(items[position])
+        denominator *= 2
+    return order
+
+
+class SamplingPolicy:
+    """
+    Which photos of a restaurant to analyze now and which to defer.
+
+    Photos are taken in `order`; analysis stops once `max_photos` photos
+    are analyzed, `max_dishes` distinct dish names are found or
+    `max_non_dish_run` non-dishes come in a row, whichever is first.
+    None disables a limit, and without limits every photo is analyzed
+    """
+
+    def __init__(self, max_photos: Optional[int] = None, max_dishes: Optional[int] = None,
+                 max_non_dish_run: Optional[int] = None, order: str = "crawl"):
+        if order not in SAMPLE_ORDERS:
+            raise ValueError(f"Unknown sample order: {order}")
+        self.max_photos = max_photos
+        self.max_dishes = max_dishes
+        self.max_non_dish_run = max_non_dish_run
+        self.order = order
+
+    @property
+    def limited(self) -> bool:
+        return any(limit is not None for limit in
+                   (self.max_photos, self.max_dishes, self.max_non_dish_run))
+
+    def order_photos(self, photo_urls: List[str],
+                     scores: Optional[Callable[[List[str]], Dict[str, float]]] = None) -> List[str]:
+        """
+        Photos in the order they should be analyzed. `scores` maps photo
+        URLs to pre-filter scores for the "prefilter" order; photos it
+        leaves out go first
+        """
+        if self.order == "spread":
+            return spread_order(photo_urls)
+        if self.order == "prefilter" and scores is not None:
+            photo_scores = scores(photo_urls)
+            return sorted(photo_urls, key=lambda url: -photo_scores.get(url, float('inf')))
+        return list(photo_urls)
+
+    def start(self) -> 'SampleState':
+        return SampleState(self)
+
+
+class SampleState:
+    """
+    Running counts of one restaurant's analyzed photos
+    """
+
+    def __init__(self, policy: SamplingPolicy):
+        self.policy = policy
+        self.analyzed = 0
+        self.dish_names: Set[str] = set()
+        self.non_dish_run = 0
+
+    def record(self, analysis: Optional[Dict]):
+        """
+        Count one analyzed photo; failed photos (None) don't count
+        """
+        if analysis is None:
+            return
+        self.analyzed += 1
+        if analysis.get('is_a_dish') == 1 and analysis.get('name'):
+            self.dish_names.add(normalize_text(analysis['name']))
+            self.non_dish_run = 0
+        else:
+            self.non_dish_run += 1
+
+    def room(self) -> Optional[int]:
+        """
+        How many more photos the photo limit allows, or None without one
+        """
+        if self.policy.max_photos is None:
+            return None
+        return max(0, self.policy.max_photos - self.analyzed)
+
+    def stop_reason(self) -> Optional[str]:
+        """
+        Why the remaining photos should be deferred, or None to go on
+        """
+        policy = self.policy
+        if policy.max_photos is not None and self.analyzed >= policy.max_photos:
+            return f"{self.analyzed} photos analyzed"
+        if policy.max_dishes is not None and len(self.dish_names) >= policy.max_dishes:
+            return f"{len(self.dish_names)} distinct dishes found"
+        if policy.max_non_dish_run is not None and self.non_dish_run >= policy.max_non_dish_run:
+            return f"{self.non_dish_run} non-dishes in a row"
+        return None
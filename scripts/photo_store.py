@@ -0,0 +1,394 @@
+import argparse
+import hashlib
+import multiprocessing
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterable, Optional
+from urllib.parse import parse_qs, urlsplit
+
+from http_client import HttpClient
+from image_utils import make_thumbnail, normalize_photo_url
+from metrics import metrics
+from restaurant_store import iter_restaurants
+
+PHOTO_STORE_DIR = "photo_store"
+INDEX_FILE = "index.sqlite"
+MAX_STORE_MB = 2048  # Originals and thumbnails, least recently used evicted first
+THUMBNAIL_SIZE = 512  # Longest thumbnail side in pixels
+DOWNLOAD_WORKERS = 8  # Concurrent photo downloads
+RESIZE_WORKERS = os.cpu_count() or 2  # Processes resizing thumbnails, shared by file workers
+
+
+class PhotoStore:
+    """
+    Content-addressed local cache of downloaded photos and their thumbnails.
+
+    Blobs are stored once per SHA-256 under `objects/`, whatever URLs
+    they were fetched from; an SQLite index maps normalized photo URLs to
+    the original and thumbnail blobs. Downloads run on a thread pool over
+    pooled connections and resizing on a process pool, started on the
+    first download, so `prefetch()` can run ahead of analysis. Once the
+    blobs exceed `max_bytes`, the least recently used ones are deleted.
+    """
+
+    def __init__(self, directory: str = PHOTO_STORE_DIR, max_bytes: int = MAX_STORE_MB << 20,
+                 thumbnail_size: int = THUMBNAIL_SIZE, download_workers: int = DOWNLOAD_WORKERS,
+                 resize_workers: int = RESIZE_WORKERS, client: Optional[HttpClient] = None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.thumbnail_size = thumbnail_size
+        self.downloaded = 0
+        self.hits = 0
+        self.failed = 0
+        self.evicted = 0
+
+        os.makedirs(os.path.join(directory, "objects"), exist_ok=True)
+        self.client = client or HttpClient(timeout=(10, 30), max_retries=2,
+                                           pool_size=download_workers)
+        self._downloads = ThreadPoolExecutor(max_workers=download_workers)
+        self.resize_workers = resize_workers
+        self._resizer: Optional[ProcessPoolExecutor] = None
+        self._inflight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+        self._db = sqlite3.connect(os.path.join(directory, INDEX_FILE),
+                                   check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS blobs (
+                sha TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                content_type TEXT NOT NULL,
+                last_used REAL NOT NULL
+            )""")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS photos (
+                url_key TEXT PRIMARY KEY,
+                sha TEXT NOT NULL,
+                thumbnail_sha TEXT
+            )""")
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS blobs_last_used ON blobs (last_used)")
+        self._db.commit()
+        self.total_bytes = self._db.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+
+    def blob_path(self, sha: str) -> str:
+        return os.path.join(self.directory, "objects", sha[:2], sha)
+
+    def _write_blob(self, data: bytes, content_type: str) -> str:
+        sha = hashlib.sha256(data).hexdigest()
+        path = self.blob_path(sha)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(temp_path, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        with self._lock:
+            added = self._db.execute(
+                "INSERT OR IGNORE INTO blobs VALUES (?, ?, ?, ?)",
+                (sha, len(data), content_type, time.time())).rowcount
+            self.total_bytes += len(data) if added else 0
+            self._db.commit()
+        return sha
+
+    def lookup(self, photo_url: str) -> Optional[Dict]:
+        """
+        Stored blobs of a photo without downloading it, or None
+        """
+        return self._lookup(normalize_photo_url(photo_url))
+
+    def _lookup(self, url_key: str) -> Optional[Dict]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT sha, thumbnail_sha FROM photos WHERE url_key = ?", (url_key,)).fetchone()
+            if row is None:
+                return None
+            shas = [sha for sha in row if sha]
+            # Blobs may have been evicted since the photo was indexed
+            found = self._db.execute(
+                f"SELECT COUNT(*) FROM blobs WHERE sha IN ({','.join('?' * len(shas))})",
+                shas).fetchone()[0]
+            if found != len(shas):
+                return None
+            self._db.execute(
+                f"UPDATE blobs SET last_used = ? WHERE sha IN ({','.join('?' * len(shas))})",
+                [time.time()] + shas)
+            self._db.commit()
+        return {'sha': row[0], 'thumbnail_sha': row[1]}
+
+    def _fetch(self, photo_url: str, url_key: str) -> Optional[Dict]:
+        entry = self._lookup(url_key)
+        if entry is not None:
+            with self._lock:
+                self.hits += 1
+            return entry
+
+        try:
+            with metrics.timer('photo_download'):
+                response = self.client.get(photo_url)
+        except Exception as e:
+            print(f"Exception downloading photo: {e}")
+            response = None
+        if response is None or response.status_code != 200:
+            if response is not None:
+                print(f"Error downloading photo: {response.status_code}")
+            with self._lock:
+                self.failed += 1
+            return None
+
+        data = response.content
+        sha = self._write_blob(data, response.headers.get(
+            'Content-Type', 'image/jpeg'))
+        with metrics.timer('thumbnail_resize'):
+            thumbnail = self._resize_pool().submit(
+                make_thumbnail, data, self.thumbnail_size).result()
+        thumbnail_sha = self._write_blob(
+            thumbnail, 'image/jpeg') if thumbnail else None
+
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO photos VALUES (?, ?, ?)",
+                             (url_key, sha, thumbnail_sha))
+            self._db.commit()
+            self.downloaded += 1
+        metrics.inc('photo_store_bytes', len(data) + len(thumbnail or b''))
+        if self.total_bytes > self.max_bytes:
+            self.evict()
+        return {'sha': sha, 'thumbnail_sha': thumbnail_sha}
+
+    def _resize_pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._resizer is None:
+                # Spawned rather than forked: the pool starts from a
+                # download thread, and a fork would copy locks held by
+                # the other threads
+                self._resizer = ProcessPoolExecutor(
+                    max_workers=self.resize_workers,
+                    mp_context=multiprocessing.get_context('spawn'))
+            return self._resizer
+
+    def _submit(self, photo_url: str) -> Future:
+        url_key = normalize_photo_url(photo_url)
+        with self._lock:
+            future = self._inflight.get(url_key)
+            if future is not None:
+                return future
+            future = self._downloads.submit(self._fetch, photo_url, url_key)
+            self._inflight[url_key] = future
+        # Outside the lock: the callback runs right away if already done
+        future.add_done_callback(lambda _: self._forget(url_key, future))
+        return future
+
+    def _forget(self, url_key: str, future: Future):
+        with self._lock:
+            if self._inflight.get(url_key) is future:
+                del self._inflight[url_key]
+
+    def prefetch(self, photo_urls: Iterable[str]):
+        """
+        Start downloading and resizing photos in the background
+        """
+        for photo_url in photo_urls:
+            self._submit(photo_url)
+
+    def wait(self):
+        """
+        Block until every prefetch started so far has finished
+        """
+        while True:
+            with self._lock:
+                futures = list(self._inflight.values())
+            if not futures:
+                return
+            wait(futures)
+
+    def get(self, photo_url: str) -> Optional[Dict]:
+        """
+        Blob hashes of a photo and its thumbnail, waiting for a prefetch in
+        progress or downloading it now. None if the download failed
+        """
+        return self._submit(photo_url).result()
+
+    def read(self, sha: Optional[str]) -> Optional[bytes]:
+        if not sha:
+            return None
+        try:
+            with open(self.blob_path(sha), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def thumbnail(self, photo_url: str) -> Optional[bytes]:
+        entry = self.get(photo_url)
+        return self.read(entry['thumbnail_sha']) if entry else None
+
+    def content_type(self, sha: str) -> Optional[str]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT content_type FROM blobs WHERE sha = ?", (sha,)).fetchone()
+        return row[0] if row else None
+
+    def evict(self):
+        """
+        Delete least recently used blobs until the store fits in
+        `max_bytes`, keeping a margin so eviction does not run per photo
+        """
+        target = int(self.max_bytes * 0.9)
+        with self._lock:
+            victims = []
+            total = self.total_bytes
+            for sha, size in self._db.execute("SELECT sha, size FROM blobs ORDER BY last_used"):
+                if total <= target:
+                    break
+                victims.append(sha)
+                total -= size
+            for start in range(0, len(victims), 500):
+                chunk = victims[start:start + 500]
+                marks = ','.join('?' * len(chunk))
+                self._db.execute(
+                    f"DELETE FROM blobs WHERE sha IN ({marks})", chunk)
+                self._db.execute(
+                    f"DELETE FROM photos WHERE sha IN ({marks}) OR thumbnail_sha IN ({marks})",
+                    chunk + chunk)
+            self._db.commit()
+            self.total_bytes = total
+            self.evicted += len(victims)
+        for sha in victims:
+            try:
+                os.remove(self.blob_path(sha))
+            except FileNotFoundError:
+                pass
+
+    def stats(self) -> Dict:
+        with self._lock:
+            photos = self._db.execute(
+                "SELECT COUNT(*) FROM photos").fetchone()[0]
+            blobs = self._db.execute(
+                "SELECT COUNT(*) FROM blobs").fetchone()[0]
+        return {
+            'photos': photos,
+            'blobs': blobs,
+            'bytes': self.total_bytes,
+            'downloaded': self.downloaded,
+            'hits': self.hits,
+            'failed': self.failed,
+            'evicted': self.evicted
+        }
+
+    def close(self):
+        self._downloads.shutdown(wait=True)
+        if self._resizer is not None:
+            self._resizer.shutdown(wait=True)
+        with self._lock:
+            self._db.close()
+
+
+class PhotoStoreHandler(BaseHTTPRequestHandler):
+    """
+    `GET /objects/<sha>` serving stored blobs with immutable caching, and
+    `GET /thumbnail?url=...` redirecting to a cached photo's thumbnail
+    """
+
+    store: PhotoStore = None
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path == '/thumbnail':
+            photo_url = parse_qs(url.query).get('url', [''])[0]
+            entry = self.store.lookup(photo_url) if photo_url else None
+            if entry is None or not entry['thumbnail_sha']:
+                self.send_empty(404)
+                return
+            self.send_empty(302, {'Location': f"/objects/{entry['thumbnail_sha']}",
+                                  'Cache-Control': 'no-cache'})
+            return
+
+        sha = url.path[len('/objects/'):] if url.path.startswith('/objects/') else ''
+        data = self.store.read(sha) if len(sha) == 64 and sha.isalnum() else None
+        if data is None:
+            self.send_empty(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', self.store.content_type(sha) or 'image/jpeg')
+        self.send_header('Content-Length', str(len(data)))
+        # Content-addressed, so the bytes behind a name never change
+        self.send_header('Cache-Control', 'public, max-age=31536000, immutable')
+        self.send_header('ETag', f'"{sha}"')
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_empty(self, status: int, headers: Dict[str, str] = None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Prefetch, inspect and serve the local photo store")
+    parser.add_argument('--dir', default=PHOTO_STORE_DIR,
+                        help="Photo store directory")
+    parser.add_argument('--max-mb', type=int, default=MAX_STORE_MB,
+                        help="Size budget before least recently used photos are evicted")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    prefetch_parser = subparsers.add_parser(
+        'prefetch', help="Download the photos of crawler output files")
+    prefetch_parser.add_argument('inputs', nargs='+',
+                                 help="Crawler output files (.json / .jsonl)")
+    prefetch_parser.add_argument('--workers', type=int, default=DOWNLOAD_WORKERS)
+
+    subparsers.add_parser('stats', help="Show photo and blob counts")
+
+    serve_parser = subparsers.add_parser(
+        'serve', help="Serve thumbnails and photos over HTTP")
+    serve_parser.add_argument('--host', default='127.0.0.1')
+    serve_parser.add_argument('--port', type=int, default=8781)
+
+    args = parser.parse_args(argv)
+    max_bytes = args.max_mb << 20
+
+    if args.command == 'prefetch':
+        store = PhotoStore(args.dir, max_bytes,
+                           download_workers=args.workers)
+        start = time.monotonic()
+        count = 0
+        for input_file in args.inputs:
+            for restaurant in iter_restaurants(input_file):
+                store.prefetch(restaurant.get('photo_urls', []))
+                count += len(restaurant.get('photo_urls', []))
+        store.wait()
+        stats = store.stats()
+        store.close()
+        print(f"Prefetched {count} photos in {time.monotonic() - start:.1f}s: "
+              f"{stats['downloaded']} downloaded, {stats['hits']} already stored, "
+              f"{stats['failed']} failed, {stats['bytes'] >> 20} MB stored")
+    elif args.command == 'stats':
+        store = PhotoStore(args.dir, max_bytes)
+        stats = store.stats()
+        store.close()
+        for key, value in stats.items():
+            print(f"{key}: {value}")
+    elif args.command == 'serve':
+        PhotoStoreHandler.store = PhotoStore(args.dir, max_bytes)
+        server = ThreadingHTTPServer((args.host, args.port), PhotoStoreHandler)
+        print(f"Serving {args.dir}/ at http://{args.host}:{args.port}/objects/<sha>")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+import argparse
+import importlib
+import sys
+import threading
+import time
+
+import mongo_loader
+from metrics import add_metrics_arguments, metrics
+from rate_limiter import add_quota_arguments
+from work_queue import WorkQueue
+
+QUEUE_FILE = "pipeline_queue.sqlite"
+POLL_INTERVAL = 1.0  # Seconds between queue polls while the crawler runs
+
+
+def crawler():
+    """
+    The crawler stage script. Stage scripts have hyphenated file names, so
+    they are imported by name, and only by the subcommands using them:
+    the crawler needs apify_client, which analysis and loading don't
+    """
+    return importlib.import_module("place-scrawler")
+
+
+def marker():
+    """
+    The analysis stage script
+    """
+    return importlib.import_module("image-marker")
+
+
+def enqueue_restaurant(queue: WorkQueue, restaurant):
+    # New photos from a re-crawl are queued as work of their own
+    key = restaurant['place_id']
+    if restaurant.get('incremental'):
+        key = f"{key}@{restaurant['photo_fingerprint']}"
+    if queue.put(key, restaurant):
+        print(f"   → Queued {restaurant['restaurant_name']} for analysis")
+
+
+def run_crawl(args, queue: WorkQueue):
+    """
+    Crawl restaurants and queue each one for analysis as soon as it is saved
+    """
+    crawler().crawl(args, on_restaurant=lambda restaurant: enqueue_restaurant(
+        queue, restaurant))
+
+
+def enqueue_files(queue: WorkQueue, input_files):
+    analysis = marker()
+    for input_file in input_files:
+        for restaurant in analysis.load_restaurants(input_file):
+            enqueue_restaurant(queue, restaurant)
+    print(f"Queue: {queue.counts()}")
+
+
+def run_enqueue(args, queue: WorkQueue):
+    """
+    Queue restaurants from existing crawler output files
+    """
+    enqueue_files(queue, args.inputs or marker().find_input_files())
+
+
+def run_backfill(args, queue: WorkQueue):
+    """
+    Queue the photos sampling deferred, to be analyzed in full
+    """
+    input_files = marker().backfill_input_files()
+    if not input_files:
+        print(f"No deferred photos in {marker().DEFERRED_PHOTOS_FILE}")
+        return
+    enqueue_files(queue, input_files)
+
+
+def run_analyze(args, queue: WorkQueue, crawl_done: threading.Event = None):
+    """
+    Analyze queued restaurants until the queue is drained. While a crawl
+    is still running (`crawl_done` not set), wait for more work instead
+    of stopping
+    """
+    analysis = marker()
+    run = analysis.AnalysisRun(**analysis.analysis_options(args))
+    try:
+        while True:
+            finished_crawling = crawl_done is None or crawl_done.is_set()
+            item = queue.claim()
+            if item is None:
+                if finished_crawling:
+                    break
+                time.sleep(POLL_INTERVAL)
+                continue
+
+            item_id, restaurant = item
+            try:
+                finished = run.process_restaurant(restaurant)
+            except Exception as e:
+                print(
+                    f"Error processing {restaurant.get('restaurant_name')}: {e}")
+                finished = False
+
+            if finished:
+                queue.complete(item_id)
+            else:
+                queue.release(item_id)
+            if run.quota_exhausted:
+                print(f"Daily Dify budget used up, leaving the rest of the queue")
+                break
+    finally:
+        run.close()
+        print(f"Queue: {queue.counts()}")
+
+
+def run_pipeline(args, queue: WorkQueue):
+    """
+    Crawl and analyze at the same time, connected through the queue
+    """
+    crawl_done = threading.Event()
+
+    def crawl_stage():
+        try:
+            run_crawl(args, queue)
+        finally:
+            crawl_done.set()
+
+    crawl_thread = threading.Thread(target=crawl_stage, name="crawl")
+    crawl_thread.start()
+    run_analyze(args, queue, crawl_done)
+    crawl_thread.join()
+
+    if args.load:
+        mongo_loader.main(marker().ANALYSIS_RESULTS_FILE)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Resumable crawl → analyze → load pipeline")
+    parser.add_argument('--queue', default=QUEUE_FILE,
+                        help="Work queue database file")
+    add_metrics_arguments(parser)
+    add_quota_arguments(parser)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    subparsers.add_parser(
+        'crawl', help="Crawl restaurants and queue them for analysis")
+
+    enqueue_parser = subparsers.add_parser(
+        'enqueue', help="Queue restaurants from existing crawler output files")
+    enqueue_parser.add_argument('inputs', nargs='*',
+                                help="Crawler output files (default: every file in the crawler output directory)")
+
+    subparsers.add_parser(
+        'backfill', help="Queue the photos sampling deferred for full analysis")
+
+    analyze_parser = subparsers.add_parser(
+        'analyze', help="Analyze queued restaurants until the queue is empty")
+    analyze_parser.add_argument('--retry-failed', action='store_true',
+                                help="Requeue items that ran out of attempts")
+
+    load_parser = subparsers.add_parser(
+        'load', help="Upsert analyzed dishes into MongoDB")
+    load_parser.add_argument('--input', default=None,
+                             help="Analysis results JSON lines file (default: photo_analysis_results.jsonl)")
+
+    run_parser = subparsers.add_parser(
+        'run', help="Crawl and analyze concurrently through the queue")
+    run_parser.add_argument('--load', action='store_true',
+                            help="Load results into MongoDB when done")
+
+    subparsers.add_parser('status', help="Show work queue counts")
+
+    # Stage options come from the stage scripts, so they are added only
+    # to the subcommand being run
+    argv = sys.argv[1:] if argv is None else argv
+    command = next((arg for arg in argv if arg in subparsers.choices), None)
+    if command in ('crawl', 'run'):
+        crawler().add_crawl_arguments(subparsers.choices[command])
+    if command in ('analyze', 'run'):
+        marker().add_analysis_arguments(subparsers.choices[command])
+
+    args = parser.parse_args(argv)
+    metrics.configure(args.metrics_events, args.prometheus)
+
+    if args.command == 'load':
+        mongo_loader.main(args.input)
+        return
+
+    queue = WorkQueue(args.queue)
+    try:
+        recovered = queue.recover()
+        if recovered:
+            print(f"Recovered {recovered} interrupted queue items")
+
+        if args.command == 'crawl':
+            run_crawl(args, queue)
+            print(f"Queue: {queue.counts()}")
+        elif args.command == 'enqueue':
+            run_enqueue(args, queue)
+        elif args.command == 'backfill':
+            run_backfill(args, queue)
+        elif args.command == 'analyze':
+            if args.retry_failed:
+                print(f"Requeued {queue.requeue_failed()} failed items")
+            run_analyze(args, queue)
+        elif args.command == 'run':
+            run_pipeline(args, queue)
+        elif args.command == 'status':
+            print(f"Queue: {queue.counts()}")
+    finally:
+        queue.close()
+
+
+if __name__ == "__main__":
+    main()
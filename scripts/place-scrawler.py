@@ -1,20 +1,64 @@
-import requests
 from apify_client import ApifyClient
 import os
-import time
+import argparse
 import json
 import re
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List, Optional, Tuple
+
+from area_sweep import Point, Tile, sweep_area, tile_bounding_box, tile_polygon
+from http_client import HttpClient
+from metrics import Progress, add_metrics_arguments, http_client_collector, metrics
+from rate_limiter import QuotaExceeded, add_quota_arguments, make_limiter
+from restaurant_store import RestaurantStore, is_stale, new_photo_urls, photo_fingerprint
+
+# API base URLs, overridable to point the crawler at local mock servers
+APIFY_API_URL = "https://api.apify.com"
+PLACES_API_URL = "https://places.googleapis.com/v1"
 
 # Initialize the ApifyClient with your API token
-client = ApifyClient("XXXXX")
+client = ApifyClient("XXXXX", api_url=APIFY_API_URL)
 GOOGLE_MAPS_API_KEY = "XXXXXXX"
+# Pooled client with timeouts and 429/5xx backoff for Google Places
+places_client = HttpClient(timeout=(10, 30))
 latitude = 48.862824
 longitude = 2.322437
 
-# Create outputs directory if it doesn't exist
+# Photo discovery concurrency
+APIFY_ACTOR_ID = "nwua9Gu5YrADL7ZDj"
+MAX_CONCURRENT_RUNS = 4  # Apify actor runs in flight at once
+PLACES_PER_RUN = 5  # placeIds batched into a single actor run
+APIFY_RUNS_PER_SECOND = 0.5  # Pace actor run starts
+PLACES_REQUESTS_PER_SECOND = 10.0  # Pace Places searches
+
+# Requests per UTC day across every process sharing a quota file
+# (--quota-file, see rate_limiter.py); None is unlimited
+PLACES_DAILY_BUDGET = None
+APIFY_DAILY_BUDGET = None  # Actor runs
+
+# Area sweep settings
+SEARCH_RADIUS = 1000  # Radius of the single-circle search, in meters
+PLACES_RESULT_CAP = 20  # Max results Places returns for one query
+SWEEP_TILE_RADIUS = 500  # Initial tile radius for area sweeps, in meters
+SWEEP_MIN_RADIUS = 100  # Saturated tiles are not split below this radius
+SWEEP_WORKERS = 4  # Concurrent Places queries during a sweep
+SWEEP_ATTEMPTS = 3  # Tries per tile before a failed search is reported
+
+# Incremental refresh: saved places crawled longer ago than this are
+# crawled again when --refresh is given, and only their new photos are
+# passed on for analysis
+REFRESH_AFTER_DAYS = 30
+
 outputs_dir = "outputs"
-if not os.path.exists(outputs_dir):
-    os.makedirs(outputs_dir)
+
+# Pacing of both APIs, set up by crawl()
+places_limiter = None
+apify_limiter = None
+
+# Structured metrics, shared with image-marker.py in pipeline runs
+METRICS_EVENTS_FILE = "metrics_events.jsonl"
+PROGRESS_INTERVAL = 5.0  # Seconds between progress/ETA lines
 
 
 def sanitize_filename(text):
@@ -50,56 +94,23 @@ def generate_filename(lat, lng, first_restaurant_data):
         else:
             city = sanitize_filename(parts[0].strip())
 
-    filename = f"restaurants_photos_{lat_str}_{lng_str}_{city}_{restaurant_name}.json"
+    filename = f"restaurants_photos_{lat_str}_{lng_str}_{city}_{restaurant_name}.jsonl"
     return filename
 
 
-# Define output file path
-output_file = os.path.join(outputs_dir, "restaurants_photos.json")
-
-
-def load_existing_data():
-    """
-    Load existing restaurant data from JSON file
-    """
-    if os.path.exists(output_file):
-        try:
-            with open(output_file, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except:
-            return []
-    return []
-
-
-def save_restaurant_data(all_data):
-    """
-    Save restaurant data to JSON file
-    """
-    with open(output_file, 'w', encoding='utf-8') as f:
-        json.dump(all_data, f, ensure_ascii=False, indent=2)
-
-
-def is_restaurant_processed(place_id, existing_data):
-    """
-    Check if restaurant is already processed
-    """
-    for restaurant in existing_data:
-        if restaurant.get('place_id') == place_id:
-            return True
-    return False
-
-
 def get_nearby_restaurants(lat, lng, radius=1000, max_results=20):
     """
-    Get nearby restaurants using Google Places New API with direct HTTP request
+    Get nearby restaurants using Google Places New API with direct HTTP request.
+    Returns None when the search failed, so callers can tell it apart from
+    an area without restaurants
     """
     try:
-        url = "https://places.googleapis.com/v1/places:searchNearby"
+        url = f"{PLACES_API_URL}/places:searchNearby"
 
         headers = {
             "Content-Type": "application/json",
             "X-Goog-Api-Key": GOOGLE_MAPS_API_KEY,
-            "X-Goog-FieldMask": "places.id,places.displayName,places.rating,places.formattedAddress,places.types"
+            "X-Goog-FieldMask": "places.id,places.displayName,places.rating,places.formattedAddress,places.types,places.location"
         }
 
         body = {
@@ -117,7 +128,11 @@ def get_nearby_restaurants(lat, lng, radius=1000, max_results=20):
         }
 
         print(f"Requesting Google Places API...")
-        response = requests.post(url, headers=headers, json=body)
+        with metrics.timer('places_rate_limit_wait'):
+            places_limiter.acquire()
+        with metrics.timer('places_search'):
+            response = places_client.post(url, headers=headers, json=body)
+        metrics.inc('places_calls', status=response.status_code)
 
         if response.status_code == 200:
             data = response.json()
@@ -129,7 +144,9 @@ def get_nearby_restaurants(lat, lng, radius=1000, max_results=20):
                     'place_id': place.get('id', ''),
                     'rating': place.get('rating'),
                     'vicinity': place.get('formattedAddress', ''),
-                    'types': place.get('types', [])
+                    'types': place.get('types', []),
+                    'latitude': place.get('location', {}).get('latitude'),
+                    'longitude': place.get('location', {}).get('longitude')
                 }
                 restaurants.append(restaurant_info)
 
@@ -137,17 +154,20 @@ def get_nearby_restaurants(lat, lng, radius=1000, max_results=20):
         else:
             print(
                 f"API request failed: {response.status_code} - {response.text}")
-            return []
+            return None
 
     except Exception as e:
         print(f"Error fetching restaurants: {e}")
-        return []
+        return None
 
 
-def get_restaurant_photos(place_id, restaurant_name):
+def get_restaurants_photos(restaurants):
     """
-    Use Apify to get restaurant photos URLs
+    Use a single Apify actor run to get photo URLs for several restaurants.
+    Returns a dict of place_id -> photo URLs, or None when the run failed
     """
+    place_ids = [restaurant['place_id'] for restaurant in restaurants]
+    names = ", ".join(restaurant['name'] for restaurant in restaurants)
     try:
         # Prepare the Actor input
         run_input = {
@@ -156,9 +176,7 @@ def get_restaurant_photos(place_id, restaurant_name):
             "maxCrawledPlacesPerSearch": 1,
             "maxImages": 50,
             "maximumLeadsEnrichmentRecords": 0,
-            "placeIds": [
-                place_id
-            ],
+            "placeIds": place_ids,
             "scrapeContacts": False,
             "scrapeDirectories": False,
             "scrapeImageAuthors": False,
@@ -169,132 +187,403 @@ def get_restaurant_photos(place_id, restaurant_name):
         }
 
         # Run the Actor and wait for it to finish
-        print(f"Getting photos for {restaurant_name}...")
-        run = client.actor("nwua9Gu5YrADL7ZDj").call(run_input=run_input)
-
-        # Fetch Actor results from the run's dataset
-        photo_urls = []
-        for item in client.dataset(run["defaultDatasetId"]).iterate_items():
-            if 'imageUrls' in item and item['imageUrls']:
-                photo_urls = item['imageUrls']
-                print(f"Found {len(photo_urls)} photos")
-                break
-
-        return photo_urls
+        print(f"Getting photos for {names}...")
+        with metrics.timer('apify_run'):
+            run = client.actor(APIFY_ACTOR_ID).call(run_input=run_input)
+
+        # Fetch Actor results from the run's dataset; with a single place
+        # the item is matched even if it carries no placeId
+        # apify-client 1.x returns the run as a dict, later versions as a model
+        dataset_id = run["defaultDatasetId"] if isinstance(
+            run, dict) else run.default_dataset_id
+        photos = {}
+        with metrics.timer('apify_dataset'):
+            for item in client.dataset(dataset_id).iterate_items():
+                item_place_id = item.get('placeId') or (
+                    place_ids[0] if len(place_ids) == 1 else None)
+                if item_place_id in place_ids and item_place_id not in photos \
+                        and item.get('imageUrls'):
+                    photos[item_place_id] = item['imageUrls']
+
+        metrics.inc('apify_runs', outcome='ok')
+        return photos
 
     except Exception as e:
-        print(f"Error fetching restaurant photos for {restaurant_name}: {e}")
-        return []
-
-
-# Get nearby restaurants first to determine filename
-print(
-    f"Searching for restaurants near coordinates ({latitude}, {longitude})...")
-restaurants = get_nearby_restaurants(latitude, longitude, max_results=20)
-
-if not restaurants:
-    print("No restaurants found, exiting program")
-    exit()
-
-# Generate dynamic filename based on first restaurant
-output_filename = generate_filename(latitude, longitude, restaurants[0])
-output_file = os.path.join(outputs_dir, output_filename)
+        print(f"Error fetching restaurant photos for {names}: {e}")
+        metrics.inc('apify_runs', outcome='error')
+        return None
 
-print(f"Output file: {output_file}")
 
-# Load existing data
-all_restaurants_data = load_existing_data()
-print(f"Loaded {len(all_restaurants_data)} existing records")
+def get_restaurant_photos(place_id, restaurant_name):
+    """
+    Use Apify to get restaurant photos URLs
+    """
+    photos = get_restaurants_photos(
+        [{'place_id': place_id, 'name': restaurant_name}])
+    photo_urls = (photos or {}).get(place_id, [])
+    if photo_urls:
+        print(f"Found {len(photo_urls)} photos")
+    return photo_urls
 
-print(f"\nFound {len(restaurants)} restaurants:")
-print("-" * 80)
 
-# Process each restaurant
-processed_count = 0
-skipped_count = 0
+def discover_batch(batch):
+    """
+    Photos of a batch of restaurants from one paced actor run, or None
+    when the run failed or the daily Apify budget is used up. Those
+    restaurants are not saved, so the next run discovers them again
+    """
+    try:
+        apify_limiter.acquire()
+    except QuotaExceeded as e:
+        print(f"Skipping photos of {len(batch)} restaurants: {e}")
+        return None
+    return get_restaurants_photos(batch)
 
-for i, restaurant in enumerate(restaurants, 1):
-    print(f"\n{i}. Checking restaurant: {restaurant['name']}")
-    print(f"   Place ID: {restaurant['place_id']}")
 
-    # Check if already processed
-    if is_restaurant_processed(restaurant['place_id'], all_restaurants_data):
-        print(f"   ✓ Already processed, skipping")
-        skipped_count += 1
-        continue
+def discover_photos_concurrently(restaurants):
+    """
+    Fetch photos for restaurants in batched actor runs, several at a time.
+    Yields (restaurant, photo_urls) as each run finishes
+    """
+    batches = [restaurants[i:i + PLACES_PER_RUN]
+               for i in range(0, len(restaurants), PLACES_PER_RUN)]
 
-    print(f"   → Starting processing...")
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_RUNS) as executor:
+        futures = {executor.submit(discover_batch, batch): batch
+                   for batch in batches}
+        for future in as_completed(futures):
+            photos = future.result()
+            if photos is None:
+                continue
+            for restaurant in futures[future]:
+                yield restaurant, photos.get(restaurant['place_id'], [])
 
-    # Get restaurant photos from Apify
-    photo_urls = get_restaurant_photos(
-        restaurant['place_id'], restaurant['name'])
 
-    restaurant_data = {
+def restaurant_record(restaurant, photo_urls):
+    """
+    Store record of a Places search result and its photo URLs
+    """
+    return {
         'restaurant_name': restaurant['name'],
         'place_id': restaurant['place_id'],
         'rating': restaurant.get('rating'),
         'vicinity': restaurant.get('vicinity'),
         'photo_urls': photo_urls,
-        'photo_count': len(photo_urls)
+        'photo_count': len(photo_urls),
+        'last_crawled_at': round(time.time(), 3),
+        'photo_fingerprint': photo_fingerprint(photo_urls)
     }
 
-    # Add to data and save immediately
-    all_restaurants_data.append(restaurant_data)
-    save_restaurant_data(all_restaurants_data)
-    processed_count += 1
 
-    print(f"   ✓ Saved to JSON file")
+def setup_limiters(quota_file: Optional[str] = None):
+    """
+    Pace both APIs, across processes when they share `quota_file`
+    """
+    global places_limiter, apify_limiter
+    places_limiter = make_limiter('places', PLACES_REQUESTS_PER_SECOND,
+                                  daily_budget=PLACES_DAILY_BUDGET, quota_file=quota_file)
+    apify_limiter = make_limiter('apify', APIFY_RUNS_PER_SECOND, MAX_CONCURRENT_RUNS,
+                                 APIFY_DAILY_BUDGET, quota_file)
+    places_client.limiter = places_limiter
 
-    # Print photo URLs for this restaurant
-    if photo_urls:
-        print(f"   Photo URLs ({len(photo_urls)} photos):")
-        for j, url in enumerate(photo_urls[:5], 1):  # Show first 5 URLs
-            print(f"     {j}. {url}")
-        if len(photo_urls) > 5:
-            print(f"     ... and {len(photo_urls) - 5} more photos")
-
-    # Add delay between requests to avoid rate limiting
-    if i < len(restaurants):
-        time.sleep(2)
-
-# Generate summary from saved JSON file
-print(f"\nGenerating summary file...")
-saved_data = load_existing_data()
-
-# Generate summary filename with same pattern
-summary_filename = output_filename.replace('.json', '_summary.txt')
-summary_file = os.path.join(outputs_dir, summary_filename)
-
-with open(summary_file, 'w', encoding='utf-8') as f:
-    f.write(
-        f"Restaurant Photos URL Summary - Coordinates: ({latitude}, {longitude})\n")
-    f.write("=" * 50 + "\n\n")
-
-    total_photos = 0
-    for restaurant_data in saved_data:
-        total_photos += restaurant_data['photo_count']
-        f.write(f"Restaurant: {restaurant_data['restaurant_name']}\n")
-        f.write(f"Place ID: {restaurant_data['place_id']}\n")
-        f.write(f"Rating: {restaurant_data.get('rating', 'N/A')}\n")
-        f.write(f"Address: {restaurant_data.get('vicinity', 'N/A')}\n")
-        f.write(f"Photo count: {restaurant_data['photo_count']}\n")
-        f.write("Photo URLs:\n")
-
-        for j, url in enumerate(restaurant_data['photo_urls'], 1):
-            f.write(f"  {j}. {url}\n")
-
-        f.write("\n" + "-" * 50 + "\n\n")
-
-    f.write(f"Total: {len(saved_data)} restaurants, {total_photos} photos")
-
-# Print final summary
-print(f"\n" + "=" * 80)
-print(f"Run statistics:")
-print(f"  - Newly processed: {processed_count} restaurants")
-print(f"  - Skipped: {skipped_count} restaurants")
-print(f"Total data: {len(saved_data)} restaurants")
-total_photos = sum(data['photo_count'] for data in saved_data)
-print(f"Total photos: {total_photos}")
-print(f"Results saved to:")
-print(f"  - JSON format: {output_file}")
-print(f"  - Text summary: {summary_file}")
+
+def search_area(args) -> Tuple[List[Tile], Optional[List[Point]], Point]:
+    """
+    Search tiles of the area given by `args`, the polygon they are
+    clipped to and the area's center. A single-circle search is one tile
+    """
+    if args.bbox:
+        south, west, north, east = args.bbox
+        tiles = tile_bounding_box(south, west, north, east, args.tile_radius)
+        # Edge tiles reach past the box, so results are clipped to it
+        box = [(south, west), (south, east), (north, east), (north, west)]
+        return tiles, box, ((south + north) / 2, (west + east) / 2)
+    if args.polygon:
+        with open(args.polygon, 'r', encoding='utf-8') as f:
+            polygon = [tuple(point) for point in json.load(f)]
+        tiles = tile_polygon(polygon, args.tile_radius)
+        south, north = min(p[0] for p in polygon), max(
+            p[0] for p in polygon)
+        west, east = min(p[1] for p in polygon), max(
+            p[1] for p in polygon)
+        return tiles, polygon, ((south + north) / 2, (west + east) / 2)
+    return [(args.lat, args.lng, args.radius)], None, (args.lat, args.lng)
+
+
+def open_output_store(latitude: float, longitude: float,
+                      first_restaurant: Dict) -> Tuple[str, RestaurantStore]:
+    """
+    Output file name of a search and its store of saved restaurants
+    """
+    # Create outputs directory if it doesn't exist
+    if not os.path.exists(outputs_dir):
+        os.makedirs(outputs_dir)
+
+    # Generate dynamic filename based on first restaurant
+    output_filename = generate_filename(latitude, longitude, first_restaurant)
+    output_file = os.path.join(outputs_dir, output_filename)
+
+    print(f"Output file: {output_file}")
+
+    # Load the place_id index of existing data, importing an older
+    # .json output for the same search if there is one
+    store = RestaurantStore(
+        output_file, legacy_path=output_file[:-len('.jsonl')] + '.json')
+    print(f"Loaded {len(store)} existing records")
+    return output_filename, store
+
+
+def write_summary(store: RestaurantStore, output_filename: str,
+                  latitude: float, longitude: float) -> Tuple[str, int, int]:
+    """
+    Write the text summary of every saved restaurant by streaming the
+    store. Returns the summary file and the restaurant and photo totals
+    """
+    # Generate summary filename with same pattern
+    summary_filename = output_filename.replace('.jsonl', '_summary.txt')
+    summary_file = os.path.join(outputs_dir, summary_filename)
+
+    with open(summary_file, 'w', encoding='utf-8') as f:
+        f.write(
+            f"Restaurant Photos URL Summary - Coordinates: ({latitude}, {longitude})\n")
+        f.write("=" * 50 + "\n\n")
+
+        total_restaurants = 0
+        total_photos = 0
+        for restaurant_data in store:
+            total_restaurants += 1
+            total_photos += restaurant_data['photo_count']
+            f.write(f"Restaurant: {restaurant_data['restaurant_name']}\n")
+            f.write(f"Place ID: {restaurant_data['place_id']}\n")
+            f.write(f"Rating: {restaurant_data.get('rating', 'N/A')}\n")
+            f.write(f"Address: {restaurant_data.get('vicinity', 'N/A')}\n")
+            f.write(f"Photo count: {restaurant_data['photo_count']}\n")
+            f.write("Photo URLs:\n")
+
+            for j, url in enumerate(restaurant_data['photo_urls'], 1):
+                f.write(f"  {j}. {url}\n")
+
+            f.write("\n" + "-" * 50 + "\n\n")
+
+        f.write(f"Total: {total_restaurants} restaurants, {total_photos} photos")
+
+    return summary_file, total_restaurants, total_photos
+
+
+def add_crawl_arguments(parser):
+    parser.add_argument('--lat', type=float, default=latitude,
+                        help="Latitude of a single-circle search")
+    parser.add_argument('--lng', type=float, default=longitude,
+                        help="Longitude of a single-circle search")
+    parser.add_argument('--radius', type=float, default=SEARCH_RADIUS,
+                        help="Radius of a single-circle search, in meters")
+    area = parser.add_mutually_exclusive_group()
+    area.add_argument('--bbox', type=float, nargs=4,
+                      metavar=('SOUTH', 'WEST', 'NORTH', 'EAST'),
+                      help="Sweep a bounding box with tiled searches")
+    area.add_argument('--polygon',
+                      help="Sweep a polygon given as a JSON file of [lat, lng] points")
+    parser.add_argument('--tile-radius', type=float, default=SWEEP_TILE_RADIUS,
+                        help="Initial tile radius for area sweeps, in meters")
+    parser.add_argument('--refresh', action='store_true',
+                        help="Re-crawl saved places that are due and pass on only new photos")
+    parser.add_argument('--refresh-days', type=float, default=REFRESH_AFTER_DAYS,
+                        help="Age in days after which --refresh crawls a saved place again")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Collect nearby restaurants and their Google Maps photo URLs")
+    add_crawl_arguments(parser)
+    add_metrics_arguments(parser)
+    add_quota_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def crawl(args, on_restaurant=None):
+    """
+    Search for restaurants, discover their photos and save them to the
+    output store. `on_restaurant(record)` is called for every saved
+    restaurant, including ones saved by an earlier run.
+
+    With `args.refresh`, saved places last crawled more than
+    `args.refresh_days` ago are crawled again. Their saved photo list
+    grows by the photos not seen before, and only those new photos are
+    passed on: as an `incremental` record to `on_restaurant` and in a
+    `_refresh_<time>.jsonl` file next to the output file
+    """
+    metrics.configure(METRICS_EVENTS_FILE)
+    # Removed when the crawl ends, so later runs in this process don't
+    # report the Places client twice
+    places_metrics = http_client_collector('places', places_client)
+    metrics.add_collector(places_metrics)
+    started = time.monotonic()
+    setup_limiters(args.quota_file)
+
+    # Get nearby restaurants first to determine filename
+    tiles, polygon, (latitude, longitude) = search_area(args)
+    if args.bbox or args.polygon:
+        print(
+            f"Sweeping area with {len(tiles)} tiles of {args.tile_radius}m radius...")
+        restaurants = sweep_area(get_nearby_restaurants, tiles,
+                                 max_results=PLACES_RESULT_CAP,
+                                 min_radius=SWEEP_MIN_RADIUS,
+                                 max_workers=SWEEP_WORKERS, polygon=polygon,
+                                 attempts=SWEEP_ATTEMPTS)
+    else:
+        print(
+            f"Searching for restaurants near coordinates ({latitude}, {longitude})...")
+        restaurants = get_nearby_restaurants(
+            latitude, longitude, radius=args.radius, max_results=PLACES_RESULT_CAP)
+
+    if not restaurants:
+        print("No restaurants found, exiting program")
+        metrics.remove_collector(places_metrics)
+        return
+
+    output_filename, store = open_output_store(latitude, longitude, restaurants[0])
+    output_file = store.path
+
+    refresh = args.refresh
+    refresh_age = args.refresh_days * 86400
+    refresh_file = output_file[:-len('.jsonl')] + \
+        time.strftime('_refresh_%Y%m%d_%H%M%S.jsonl')
+    # Created on the first write, so runs without new photos leave no file
+    refresh_store = RestaurantStore(refresh_file) if refresh else None
+    previous_records = {}
+
+    print(f"\nFound {len(restaurants)} restaurants:")
+    print("-" * 80)
+
+    # Process each restaurant
+    processed_count = 0
+    skipped_count = 0
+    refreshed_count = 0
+    new_photo_count = 0
+    pending_restaurants = []
+    crawl_started = time.time()
+
+    for i, restaurant in enumerate(restaurants, 1):
+        print(f"\n{i}. Checking restaurant: {restaurant['name']}")
+        print(f"   Place ID: {restaurant['place_id']}")
+
+        # Check if already processed, and whether it is due for a refresh
+        if restaurant['place_id'] in store:
+            previous = store.get(restaurant['place_id'])
+            if refresh and is_stale(previous, refresh_age, crawl_started):
+                print(f"   → Due for refresh, queued for photo discovery")
+                previous_records[restaurant['place_id']] = previous
+                pending_restaurants.append(restaurant)
+                continue
+            print(f"   ✓ Already processed, skipping")
+            skipped_count += 1
+            if on_restaurant is not None:
+                on_restaurant(store.get(restaurant['place_id']))
+            continue
+
+        print(f"   → Queued for photo discovery")
+        pending_restaurants.append(restaurant)
+
+    print(f"\nDiscovering photos for {len(pending_restaurants)} restaurants "
+          f"({PLACES_PER_RUN} per actor run, {MAX_CONCURRENT_RUNS} runs at once)...")
+
+    progress = Progress('restaurants', total=len(pending_restaurants),
+                        interval=PROGRESS_INTERVAL, metrics=metrics)
+
+    # Get restaurant photos from Apify, saving each restaurant as its run finishes
+    for restaurant, photo_urls in discover_photos_concurrently(pending_restaurants):
+        print(f"\n{restaurant['name']}: {len(photo_urls)} photos")
+
+        # A refreshed place keeps the photos saved before, so photos
+        # already analyzed stay listed even if the actor no longer returns them
+        previous = previous_records.get(restaurant['place_id'])
+        new_urls = photo_urls
+        if previous is not None and not photo_urls:
+            # Most likely a failed actor run; retry on the next refresh
+            print(f"   No photos returned, keeping the saved record")
+            progress.advance()
+            continue
+        if previous is not None:
+            new_urls = new_photo_urls(previous['photo_urls'], photo_urls)
+            photo_urls = previous['photo_urls'] + new_urls
+            print(f"   {len(new_urls)} new photos since the last crawl")
+
+        restaurant_data = restaurant_record(restaurant, photo_urls)
+
+        # Append to the store immediately
+        with metrics.timer('store_write'):
+            store.add(restaurant_data)
+        processed_count += 1
+        metrics.inc('restaurants_crawled',
+                    mode='refresh' if previous is not None else 'new')
+        metrics.inc('photos_discovered', len(new_urls))
+        metrics.event('restaurant_crawled', place_id=restaurant['place_id'],
+                      restaurant_name=restaurant['name'], photos=len(photo_urls),
+                      new_photos=len(new_urls), refreshed=previous is not None)
+        progress.advance()
+
+        # Only photos not seen before are passed on; the fingerprint of
+        # the full list tells the analysis which refresh it has handled
+        passed_on = restaurant_data
+        if refresh_store is not None and new_urls:
+            passed_on = dict(restaurant_data, photo_urls=new_urls,
+                             photo_count=len(new_urls), incremental=True)
+            refresh_store.add(passed_on)
+            new_photo_count += len(new_urls)
+        if previous is not None:
+            refreshed_count += 1
+        if on_restaurant is not None:
+            on_restaurant(passed_on)
+
+        print(f"   ✓ Saved to JSON lines file")
+
+        # Print photo URLs for this restaurant
+        if photo_urls:
+            print(f"   Photo URLs ({len(photo_urls)} photos):")
+            for j, url in enumerate(photo_urls[:5], 1):  # Show first 5 URLs
+                print(f"     {j}. {url}")
+            if len(photo_urls) > 5:
+                print(f"     ... and {len(photo_urls) - 5} more photos")
+
+    # Generate summary by streaming the saved records
+    print(f"\nGenerating summary file...")
+
+    summary_file, total_restaurants, total_photos = write_summary(
+        store, output_filename, latitude, longitude)
+
+    store.close()
+    if refresh_store is not None:
+        refresh_store.close()
+
+    # Print final summary
+    print(f"\n" + "=" * 80)
+    print(f"Run statistics:")
+    print(f"  - Newly processed: {processed_count} restaurants")
+    print(f"  - Skipped: {skipped_count} restaurants")
+    if refresh:
+        print(f"  - Refreshed: {refreshed_count} restaurants, "
+              f"{new_photo_count} new photos passed on")
+    print(f"Total data: {total_restaurants} restaurants")
+    print(f"Total photos: {total_photos}")
+    for line in places_client.format_stats():
+        print(f"  {line}")
+    print(f"Results saved to:")
+    print(f"  - JSON lines format: {output_file}")
+    print(f"  - Text summary: {summary_file}")
+    if refresh_store is not None and len(refresh_store):
+        print(f"  - New photos for analysis: {refresh_file}")
+
+    metrics.observe('crawl', time.monotonic() - started)
+    metrics.flush()
+    metrics.remove_collector(places_metrics)
+    print(f"  - Metrics events: {metrics.events_path}")
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    metrics.configure(args.metrics_events, args.prometheus)
+    crawl(args)
+
+
+if __name__ == "__main__":
+    main()
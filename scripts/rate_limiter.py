@@ -0,0 +1,274 @@
+import argparse
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+
+# Default coordination file of the `python rate_limiter.py` commands
+QUOTA_FILE = "quota.sqlite"
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket used to pace outgoing API requests.
+
+    Tokens refill continuously at `rate` per second up to `capacity`;
+    `acquire()` blocks until enough tokens are available.
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1.0, rate))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity,
+                           self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self, tokens: float = 1.0) -> bool:
+        """
+        Take tokens without blocking, returning whether it succeeded
+        """
+        with self._lock:
+            self._refill()
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return True
+            return False
+
+    def acquire(self, tokens: float = 1.0):
+        """
+        Block until `tokens` can be taken from the bucket
+        """
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait = (tokens - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds: float):
+        """
+        Hold back every caller for `seconds`, e.g. after a 429
+        """
+        with self._lock:
+            self._refill()
+            self._tokens = min(self._tokens, -seconds * self.rate)
+
+
+class QuotaExceeded(RuntimeError):
+    """
+    Raised when a provider's daily request budget is used up
+    """
+
+
+def utc_day(now: float = None) -> str:
+    return time.strftime('%Y-%m-%d', time.gmtime(now))
+
+
+class SharedTokenBucket:
+    """
+    Token bucket kept in a SQLite file, so every process using the same
+    file shares one request rate and one daily budget per provider.
+
+    Each acquire is one short write transaction; SQLite's file lock
+    serializes them across processes and `_lock` across threads. Limits
+    are stored with the bucket: the first process to use a provider sets
+    them and later ones follow, so parallel workers cannot disagree (see
+    `python rate_limiter.py set` to change them). Budgets reset at
+    midnight UTC
+    """
+
+    def __init__(self, path: str, provider: str, rate: float, capacity: float = None,
+                 daily_budget: Optional[int] = None):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.path = path
+        self.provider = provider
+        self._lock = threading.Lock()
+        self._db = open_quota_db(path)
+
+        capacity = float(capacity if capacity is not None else max(1.0, rate))
+        with self._lock:
+            self._db.execute(
+                "INSERT OR IGNORE INTO buckets (provider, rate, capacity, daily_budget, "
+                "tokens, updated, day, used) VALUES (?, ?, ?, ?, ?, ?, ?, 0)",
+                (provider, float(rate), capacity, daily_budget, capacity, time.time(), utc_day()))
+            self.rate, self.capacity, self.daily_budget = self._db.execute(
+                "SELECT rate, capacity, daily_budget FROM buckets WHERE provider = ?",
+                (provider,)).fetchone()
+        if (self.rate, self.capacity, self.daily_budget) != (float(rate), capacity, daily_budget):
+            print(f"Using the shared {provider} quota in {path}: {self.rate:g}/s, "
+                  f"burst {self.capacity:g}, daily budget {self.daily_budget or 'unlimited'}")
+
+    def _update(self, tokens: float = 0.0, pause: float = 0.0) -> float:
+        """
+        Refill the shared bucket, then take `tokens` if they are all
+        there. Returns 0 once taken, or how long to wait before retrying
+        """
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                rate, capacity, daily_budget, level, updated, day, used = self._db.execute(
+                    "SELECT rate, capacity, daily_budget, tokens, updated, day, used "
+                    "FROM buckets WHERE provider = ?", (self.provider,)).fetchone()
+                now = time.time()
+                if day != utc_day(now):
+                    day, used = utc_day(now), 0
+                if daily_budget is not None and used + tokens > daily_budget:
+                    raise QuotaExceeded(
+                        f"Daily {self.provider} budget of {daily_budget} requests is used up")
+
+                level = min(capacity, level + max(0.0, now - updated) * rate)
+                if pause:
+                    level = min(level, -pause * rate)
+                wait = 0.0
+                if level >= tokens:
+                    level -= tokens
+                    used += tokens
+                else:
+                    wait = (tokens - level) / rate
+                self._db.execute(
+                    "UPDATE buckets SET tokens = ?, updated = ?, day = ?, used = ? "
+                    "WHERE provider = ?", (level, now, day, used, self.provider))
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self.rate, self.capacity, self.daily_budget = rate, capacity, daily_budget
+            return wait
+
+    def try_acquire(self, tokens: float = 1.0) -> bool:
+        """
+        Take tokens without blocking, returning whether it succeeded.
+        Raises QuotaExceeded once the daily budget is used up
+        """
+        return self._update(tokens) == 0
+
+    def acquire(self, tokens: float = 1.0):
+        """
+        Block until `tokens` can be taken from the shared bucket. Raises
+        QuotaExceeded once the daily budget is used up
+        """
+        while True:
+            wait = self._update(tokens)
+            if not wait:
+                return
+            time.sleep(wait)
+
+    def pause(self, seconds: float):
+        """
+        Hold back every process sharing the bucket for `seconds`
+        """
+        self._update(pause=seconds)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def open_quota_db(path: str) -> sqlite3.Connection:
+    db = sqlite3.connect(path, timeout=60, isolation_level=None,
+                         check_same_thread=False)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=NORMAL")
+    db.execute("CREATE TABLE IF NOT EXISTS buckets ("
+               "provider TEXT PRIMARY KEY, rate REAL NOT NULL, capacity REAL NOT NULL, "
+               "daily_budget INTEGER, tokens REAL NOT NULL, updated REAL NOT NULL, "
+               "day TEXT NOT NULL, used REAL NOT NULL)")
+    return db
+
+
+def make_limiter(provider: str, rate: float, capacity: float = None,
+                 daily_budget: Optional[int] = None, quota_file: Optional[str] = None):
+    """
+    A TokenBucket for this process alone, or with a quota file a
+    SharedTokenBucket coordinated with every other process using it.
+    Daily budgets are only enforced with a quota file
+    """
+    if quota_file:
+        return SharedTokenBucket(quota_file, provider, rate, capacity, daily_budget)
+    return TokenBucket(rate, capacity)
+
+
+def quota_status(path: str) -> List[Dict]:
+    db = open_quota_db(path)
+    try:
+        rows = db.execute("SELECT provider, rate, capacity, daily_budget, day, used "
+                          "FROM buckets ORDER BY provider").fetchall()
+    finally:
+        db.close()
+    today = utc_day()
+    return [{'provider': provider, 'rate': rate, 'capacity': capacity,
+             'daily_budget': daily_budget, 'used_today': used if day == today else 0}
+            for provider, rate, capacity, daily_budget, day, used in rows]
+
+
+def add_quota_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument('--quota-file', default=None,
+                        help="SQLite file sharing request rates and daily budgets "
+                             "between processes")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Inspect and change request quotas shared between processes")
+    parser.add_argument('--quota-file', default=QUOTA_FILE, help="Quota database file")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    subparsers.add_parser('status', help="Show limits and today's usage per provider")
+
+    set_parser = subparsers.add_parser('set', help="Change the limits of a provider")
+    set_parser.add_argument('provider', help="dify, places or apify")
+    set_parser.add_argument('--rps', type=float, help="Requests per second")
+    set_parser.add_argument('--burst', type=float, help="Requests allowed back-to-back")
+    set_parser.add_argument('--daily', type=int,
+                            help="Requests per UTC day, 0 for unlimited")
+
+    reset_parser = subparsers.add_parser('reset', help="Forget today's usage of a provider")
+    reset_parser.add_argument('provider')
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'status':
+        for row in quota_status(args.quota_file):
+            budget = row['daily_budget']
+            print(f"{row['provider']}: {row['rate']:g}/s, burst {row['capacity']:g}, "
+                  f"{row['used_today']:g}/{budget if budget else 'unlimited'} requests today")
+        return
+
+    db = open_quota_db(args.quota_file)
+    try:
+        if args.command == 'set':
+            if args.rps is not None and args.rps <= 0:
+                parser.error("--rps must be positive")
+            rate = args.rps or 1.0
+            db.execute("INSERT OR IGNORE INTO buckets (provider, rate, capacity, daily_budget, "
+                       "tokens, updated, day, used) VALUES (?, ?, ?, NULL, 0, ?, ?, 0)",
+                       (args.provider, rate, max(1.0, rate), time.time(), utc_day()))
+            if args.rps is not None:
+                db.execute("UPDATE buckets SET rate = ? WHERE provider = ?",
+                           (args.rps, args.provider))
+            if args.burst is not None:
+                db.execute("UPDATE buckets SET capacity = ? WHERE provider = ?",
+                           (args.burst, args.provider))
+            if args.daily is not None:
+                db.execute("UPDATE buckets SET daily_budget = ? WHERE provider = ?",
+                           (args.daily or None, args.provider))
+        elif args.command == 'reset':
+            db.execute("UPDATE buckets SET used = 0 WHERE provider = ?", (args.provider,))
+    finally:
+        db.close()
+    main([f'--quota-file={args.quota_file}', 'status'])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+import hashlib
+import json
+import os
+import re
+import time
+from typing import Dict, Iterator, List, Optional
+
+from image_utils import normalize_photo_url
+from output_writers import truncate_torn_line
+
+
+def photo_fingerprint(photo_urls: List[str]) -> str:
+    """
+    Order-independent hash of a photo list, ignoring size variants
+    """
+    keys = sorted({normalize_photo_url(url) for url in photo_urls})
+    return hashlib.sha1("\n".join(keys).encode('utf-8')).hexdigest()[:16]
+
+
+def new_photo_urls(previous: List[str], current: List[str]) -> List[str]:
+    """
+    Photos of `current` not seen in `previous`, in `current` order
+    """
+    seen = {normalize_photo_url(url) for url in previous}
+    new = []
+    for url in current:
+        key = normalize_photo_url(url)
+        if key not in seen:
+            seen.add(key)
+            new.append(url)
+    return new
+
+
+JSON_SKIP = re.compile(r'[\s,]*')
+
+
+def iter_json_array(path: str, chunk_size: int = 1 << 16) -> Iterator:
+    """
+    Stream the elements of a file holding one top-level JSON array,
+    decoding one element at a time from a small rolling buffer
+    """
+    decoder = json.JSONDecoder()
+    with open(path, 'r', encoding='utf-8') as f:
+        buffer = f.read(chunk_size).lstrip()
+        if not buffer.startswith('['):
+            raise ValueError(f"Expected a JSON array in {path}")
+        position = 1
+        eof = False
+        while True:
+            position = JSON_SKIP.match(buffer, position).end()
+            if buffer.startswith(']', position):
+                return
+            try:
+                item, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                # The element continues past the buffer; keep only the
+                # unread tail and read on
+                if eof:
+                    raise
+                chunk = f.read(chunk_size)
+                eof = not chunk
+                buffer = buffer[position:] + chunk
+                position = 0
+                continue
+            yield item
+            position = end
+
+
+def iter_restaurants(path: str) -> Iterator[Dict]:
+    """
+    Stream restaurants from a crawler output file: a .jsonl store or a
+    legacy .json list
+    """
+    if path.endswith('.jsonl'):
+        store = RestaurantStore(path)
+        try:
+            yield from store
+        finally:
+            store.close()
+    else:
+        yield from iter_json_array(path)
+
+
+def is_stale(record: Dict, max_age_seconds: float, now: float = None) -> bool:
+    """
+    Whether a place was last crawled longer ago than `max_age_seconds`.
+    Records from before crawl times were kept always count as stale
+    """
+    crawled_at = record.get('last_crawled_at')
+    if crawled_at is None:
+        return True
+    return (now or time.time()) - crawled_at > max_age_seconds
+
+
+class RestaurantStore:
+    """
+    Append-only JSON lines store of crawled restaurants.
+
+    Only a place_id -> byte offset index is kept in memory, so membership
+    checks are O(1) and each save appends a single line instead of
+    rewriting the whole file. Saving a place again supersedes its earlier
+    line; `compact()` drops superseded lines.
+    """
+
+    def __init__(self, path: str, legacy_path: str = None):
+        self.path = path
+        self._index: Dict[str, int] = {}
+        self._file = None
+
+        self._load_index()
+        if legacy_path and not self._index:
+            self._import_legacy(legacy_path)
+
+    def _load_index(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb') as f:
+            offset = 0
+            for line in f:
+                try:
+                    place_id = json.loads(line).get('place_id')
+                except ValueError:
+                    # Torn write from an interrupted run
+                    place_id = None
+                if place_id:
+                    self._index[place_id] = offset
+                offset += len(line)
+
+    def _import_legacy(self, legacy_path: str):
+        """
+        Copy records from an older pretty-printed JSON list file
+        """
+        if not os.path.exists(legacy_path):
+            return
+        try:
+            with open(legacy_path, 'r', encoding='utf-8') as f:
+                records = json.load(f)
+        except (OSError, ValueError):
+            print(f"Warning: could not read legacy data {legacy_path}")
+            return
+        for record in records:
+            self.add(record)
+        print(f"Imported {len(records)} records from {legacy_path}")
+
+    def __contains__(self, place_id: str) -> bool:
+        return place_id in self._index
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def get(self, place_id: str) -> Optional[Dict]:
+        offset = self._index.get(place_id)
+        if offset is None:
+            return None
+        if self._file is not None:
+            self._file.flush()
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            return json.loads(f.readline())
+
+    def __iter__(self) -> Iterator[Dict]:
+        """
+        Stream the current record of every place, in first-seen order
+        """
+        if not os.path.exists(self.path):
+            return
+        if self._file is not None:
+            self._file.flush()
+        with open(self.path, 'rb') as f:
+            offset = 0
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    record = None
+                if record and self._index.get(record.get('place_id')) == offset:
+                    yield record
+                offset += len(line)
+
+    def add(self, record: Dict):
+        """
+        Append a restaurant record, replacing any earlier one for its place
+        """
+        if self._file is None:
+            truncate_torn_line(self.path)
+            self._file = open(self.path, 'ab')
+        line = (json.dumps(record, ensure_ascii=False) + "\n").encode('utf-8')
+        offset = self._file.tell()
+        self._file.write(line)
+        self._file.flush()
+        self._index[record['place_id']] = offset
+
+    def compact(self):
+        """
+        Rewrite the file without superseded records
+        """
+        temp_path = self.path + ".tmp"
+        index = {}
+        with open(temp_path, 'wb') as f:
+            for record in self:
+                index[record['place_id']] = f.tell()
+                f.write((json.dumps(record, ensure_ascii=False) +
+                        "\n").encode('utf-8'))
+        self.close()
+        os.replace(temp_path, self.path)
+        self._index = index
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,49 @@
+"""
+Behaviour tests of the crawler and analysis scripts, run against the
+stub servers in mock_servers.py and mongomock. From scripts/:
+
+    python -m unittest discover tests
+"""
+import contextlib
+import importlib
+import io
+import os
+import sys
+import tempfile
+import unittest
+
+SCRIPTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if SCRIPTS_DIR not in sys.path:
+    sys.path.insert(0, SCRIPTS_DIR)
+
+
+def import_script(name: str):
+    """
+    Import a hyphenated script such as image-marker.py
+    """
+    return importlib.import_module(name)
+
+
+def quiet(function, *args, **kwargs):
+    """
+    Call a script entry point with its progress output captured, and
+    return what it printed
+    """
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        function(*args, **kwargs)
+    return output.getvalue()
+
+
+class WorkingDirectoryTestCase(unittest.TestCase):
+    """
+    Runs each test in a fresh temporary directory, since the scripts
+    write their outputs to the current one
+    """
+
+    def setUp(self):
+        self._directory = tempfile.TemporaryDirectory()
+        self._previous = os.getcwd()
+        os.chdir(self._directory.name)
+        self.addCleanup(self._directory.cleanup)
+        self.addCleanup(os.chdir, self._previous)
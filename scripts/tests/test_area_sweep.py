@@ -0,0 +1,104 @@
+import math
+import random
+import threading
+import unittest
+
+from tests import quiet
+
+from area_sweep import _to_meters, offset_point, sweep_area, tile_bounding_box
+
+SOUTH, WEST, NORTH, EAST = 48.85, 2.31, 48.87, 2.33
+AREA = [(SOUTH, WEST), (SOUTH, EAST), (NORTH, EAST), (NORTH, WEST)]
+
+
+def synthetic_places(count, seed=3):
+    """
+    Places scattered over the area and a margin around it
+    """
+    rng = random.Random(seed)
+    return [{'place_id': f'place-{i}',
+             'latitude': rng.uniform(SOUTH - 0.005, NORTH + 0.005),
+             'longitude': rng.uniform(WEST - 0.005, EAST + 0.005)}
+            for i in range(count)]
+
+
+def nearby_search(places):
+    """
+    Stub of the Places nearby search: the closest places within the
+    radius, at most `max_results` of them
+    """
+    def search(lat, lng, radius, max_results):
+        found = []
+        for place in places:
+            distance = math.hypot(*_to_meters((lat, lng), (place['latitude'], place['longitude'])))
+            if distance <= radius:
+                found.append((distance, place))
+        found.sort(key=lambda match: match[0])
+        return [place for _, place in found[:max_results]]
+    return search
+
+
+def inside(place):
+    return SOUTH <= place['latitude'] <= NORTH and WEST <= place['longitude'] <= EAST
+
+
+class AreaSweepTest(unittest.TestCase):
+
+    def test_tiles_cover_the_whole_box(self):
+        tiles = tile_bounding_box(SOUTH, WEST, NORTH, EAST, 500)
+        for north in range(0, 2200, 100):
+            for east in range(0, 1400, 100):
+                point = offset_point(SOUTH, WEST, north, east)
+                self.assertTrue(any(math.hypot(*_to_meters(tile[:2], point)) <= tile[2]
+                                    for tile in tiles), point)
+
+    def test_capped_tiles_are_subdivided_until_every_place_is_found(self):
+        places = synthetic_places(400)
+        tiles = tile_bounding_box(SOUTH, WEST, NORTH, EAST, 800)
+        found = []
+        output = quiet(lambda: found.extend(sweep_area(
+            nearby_search(places), tiles, max_results=20, min_radius=50, polygon=AREA)))
+
+        self.assertEqual(sorted(place['place_id'] for place in found),
+                         sorted(place['place_id'] for place in places if inside(place)))
+        self.assertRegex(output, r"[1-9]\d* tiles subdivided")
+
+    def test_failed_searches_are_retried(self):
+        places = synthetic_places(50)
+        search = nearby_search(places)
+        attempts = {}
+        lock = threading.Lock()
+
+        def flaky_search(lat, lng, radius, max_results):
+            with lock:
+                attempts[(lat, lng)] = attempts.get((lat, lng), 0) + 1
+                first = attempts[(lat, lng)] == 1
+            return None if first else search(lat, lng, radius, max_results)
+
+        tiles = tile_bounding_box(SOUTH, WEST, NORTH, EAST, 800)
+        found = []
+        quiet(lambda: found.extend(sweep_area(flaky_search, tiles, max_results=60,
+                                              polygon=AREA)))
+        self.assertEqual(len(found), sum(1 for place in places if inside(place)))
+        self.assertEqual(set(attempts.values()), {2})
+
+    def test_tile_that_keeps_failing_is_reported(self):
+        places = synthetic_places(50)
+        search = nearby_search(places)
+        tiles = tile_bounding_box(SOUTH, WEST, NORTH, EAST, 800)
+        broken = tiles[0]
+
+        def search_with_a_broken_tile(lat, lng, radius, max_results):
+            if (lat, lng, radius) == broken:
+                return None
+            return search(lat, lng, radius, max_results)
+
+        found = []
+        output = quiet(lambda: found.extend(sweep_area(
+            search_with_a_broken_tile, tiles, max_results=60, polygon=AREA, attempts=2)))
+        self.assertIn("search failed 2 times", output)
+        self.assertTrue(found)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import json
+import os
+import unittest
+
+from tests import WorkingDirectoryTestCase, quiet
+
+import benchmark
+from mock_servers import MockCorpus, mock_analysis
+
+try:
+    import apify_client
+except ImportError:  # only the crawl stage needs it
+    apify_client = None
+
+CORPUS = ['--latency', '0', '--restaurants', '6', '--photos', '3']
+
+
+class BenchmarkTest(WorkingDirectoryTestCase):
+
+    def run_benchmark(self, stage_args):
+        quiet(benchmark.main, CORPUS + ['--json', 'report.json'] + stage_args)
+        with open('report.json', encoding='utf-8') as f:
+            return json.load(f)
+
+    def test_analyze_reports_every_corpus_photo(self):
+        report = self.run_benchmark(['analyze', '--rps', '1000'])
+        photo_urls = [url for restaurant in MockCorpus.synthetic(6, 3).restaurants.values()
+                      for url in restaurant['photo_urls']]
+        self.assertEqual(report['photos'], len(photo_urls))
+        self.assertEqual(report['dishes'], sum(mock_analysis(url)['is_a_dish']
+                                               for url in photo_urls))
+        self.assertEqual(report['dify']['status_counts'], {'200': len(photo_urls)})
+        self.assertEqual(os.listdir('.'), ['report.json'])
+
+    @unittest.skipIf(apify_client is None, "needs apify-client")
+    def test_crawl_reports_restaurants_and_photos(self):
+        report = self.run_benchmark(['crawl'])
+        self.assertEqual(report['failed_actor_runs'], 0)
+        self.assertGreater(report['restaurants'], 0)
+        self.assertEqual(report['photos'], report['restaurants'] * 3)
+        self.assertIsNone(benchmark.report_failure(report))
+
+
+class ReportFailureTest(unittest.TestCase):
+
+    def test_errored_actor_runs_fail_the_benchmark(self):
+        report = {'stage': 'crawl', 'failed_actor_runs': 2, 'restaurants': 10}
+        self.assertIn("2 actor runs errored", benchmark.report_failure(report))
+
+    def test_empty_crawl_fails_the_benchmark(self):
+        report = {'stage': 'crawl', 'failed_actor_runs': 0, 'restaurants': 0}
+        self.assertIn("no restaurants", benchmark.report_failure(report))
+
+    def test_analysis_runs_are_not_judged(self):
+        self.assertIsNone(benchmark.report_failure({'stage': 'analyze'}))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+import json
+import os
+import tempfile
+import unittest
+
+from checkpoint_store import CheckpointStore
+from output_writers import truncate_torn_line
+
+
+class CheckpointStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'checkpoint.jsonl')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def reopen(self, **kwargs):
+        return CheckpointStore(self.path, fsync=False, **kwargs)
+
+    def test_marks_survive_a_restart(self):
+        store = self.reopen()
+        store.mark_photo('p1', 'a.jpg', {'is_a_dish': 1, 'name': 'Soup'})
+        store.mark_place('p2', 'fp-1')
+        store.close()
+
+        store = self.reopen()
+        self.assertEqual(store.photo_result('p1', 'a.jpg'), {'is_a_dish': 1, 'name': 'Soup'})
+        self.assertFalse(store.is_place_done('p1'))
+        self.assertTrue(store.is_place_done('p2', 'fp-1'))
+        self.assertFalse(store.is_place_done('p2', 'fp-2'))
+        store.close()
+
+    def test_completing_a_place_drops_its_photo_marks(self):
+        store = self.reopen()
+        store.mark_photo('p1', 'a.jpg', {'is_a_dish': 0})
+        store.mark_place('p1')
+        store.close()
+        store = self.reopen()
+        self.assertTrue(store.is_place_done('p1'))
+        self.assertIsNone(store.photo_result('p1', 'a.jpg'))
+        store.close()
+
+    def test_torn_last_line_is_dropped_before_appending(self):
+        store = self.reopen()
+        store.mark_photo('p1', 'a.jpg', {'is_a_dish': 0})
+        store.close()
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write('{"place_id": "p1", "photo_url": "b.j')
+
+        store = self.reopen()
+        self.assertIsNotNone(store.photo_result('p1', 'a.jpg'))
+        self.assertIsNone(store.photo_result('p1', 'b.jpg'))
+        store.mark_photo('p1', 'c.jpg', {'is_a_dish': 1})
+        store.close()
+
+        with open(self.path, encoding='utf-8') as f:
+            records = [json.loads(line) for line in f]
+        self.assertEqual([record['photo_url'] for record in records], ['a.jpg', 'c.jpg'])
+        store = self.reopen()
+        self.assertIsNotNone(store.photo_result('p1', 'c.jpg'))
+        store.close()
+
+    def test_base_journal_is_read_but_not_written(self):
+        base_path = os.path.join(self.directory.name, 'base.jsonl')
+        base = CheckpointStore(base_path, fsync=False)
+        base.mark_place('p1')
+        base.close()
+        size = os.path.getsize(base_path)
+
+        store = self.reopen(base_path=base_path)
+        self.assertTrue(store.is_place_done('p1'))
+        store.mark_place('p2')
+        store.close()
+        self.assertEqual(os.path.getsize(base_path), size)
+        store = self.reopen()
+        self.assertFalse(store.is_place_done('p1'))
+        self.assertTrue(store.is_place_done('p2'))
+        store.close()
+
+
+class TruncateTornLineTest(unittest.TestCase):
+
+    def truncated(self, content: bytes) -> bytes:
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'journal.jsonl')
+            with open(path, 'wb') as f:
+                f.write(content)
+            truncate_torn_line(path)
+            with open(path, 'rb') as f:
+                return f.read()
+
+    def test_complete_lines_are_kept(self):
+        self.assertEqual(self.truncated(b'{"a": 1}\n{"b": 2}\n'), b'{"a": 1}\n{"b": 2}\n')
+
+    def test_partial_line_longer_than_a_read_block(self):
+        self.assertEqual(self.truncated(b'{"a": 1}\n' + b'x' * 10000), b'{"a": 1}\n')
+
+    def test_single_partial_line(self):
+        self.assertEqual(self.truncated(b'{"a": '), b'')
+
+
+if __name__ == '__main__':
+    unittest.main()
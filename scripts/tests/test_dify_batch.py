@@ -0,0 +1,82 @@
+import unittest
+
+from tests import import_script, quiet
+
+from mock_servers import MockBehavior, MockDifyHandler, image_key, mock_analysis, start_server
+from rate_limiter import TokenBucket
+
+PHOTOS = [f"https://lh3.googleusercontent.com/p/batch-{i}=w400" for i in range(4)]
+
+
+class ScriptedDifyHandler(MockDifyHandler):
+    """
+    Dify workflow whose batched runs succeed, leave one image without a
+    result, return too few results, or are rejected outright
+    """
+
+    batch_mode = 'ok'
+    image_counts = None  # Images per workflow run, in request order
+
+    def do_POST(self):
+        inputs = self.read_json().get('inputs', {})
+        images = inputs.get('images')
+        self.image_counts.append(len(images) if images is not None else 1)
+        if images is None:
+            outputs = mock_analysis(image_key(inputs['image']))
+        elif self.batch_mode == 'reject':
+            self.send_error_json(400, 'invalid_param', 'images is not a workflow input')
+            return
+        else:
+            results = [mock_analysis(image_key(image)) for image in images]
+            if self.batch_mode == 'partial':
+                results[1] = None
+            elif self.batch_mode == 'short':
+                results.pop()
+            outputs = {'results': results}
+        self.send_json(200, {'data': {'status': 'succeeded', 'outputs': outputs}})
+
+
+class AnalyzePhotoBatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.marker = import_script('image-marker')
+        self.image_counts = []
+        self.server = start_server(
+            ScriptedDifyHandler, MockBehavior(latency=0.0), image_counts=self.image_counts)
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        url = self.marker.DIFY_WORKFLOW_URL
+        self.marker.DIFY_WORKFLOW_URL = \
+            f"http://127.0.0.1:{self.server.server_address[1]}/v1/workflows/run"
+        self.addCleanup(setattr, self.marker, 'DIFY_WORKFLOW_URL', url)
+
+    def analyze(self, batch_mode):
+        self.server.RequestHandlerClass.batch_mode = batch_mode
+        results = {}
+        quiet(lambda: results.update(self.marker.analyze_photo_batch(
+            PHOTOS, TokenBucket(1000))))
+        return results
+
+    def assertAnalyzedAll(self, results):
+        self.assertEqual(results, {photo_url: mock_analysis(photo_url)
+                                   for photo_url in PHOTOS})
+
+    def test_whole_batch_in_one_run(self):
+        self.assertAnalyzedAll(self.analyze('ok'))
+        self.assertEqual(self.image_counts, [4])
+
+    def test_image_missing_from_the_batch_is_retried_alone(self):
+        self.assertAnalyzedAll(self.analyze('partial'))
+        self.assertEqual(self.image_counts, [4, 1])
+
+    def test_mismatched_result_count_retries_every_image(self):
+        self.assertAnalyzedAll(self.analyze('short'))
+        self.assertEqual(self.image_counts, [4, 1, 1, 1, 1])
+
+    def test_rejected_batch_falls_back_to_single_runs(self):
+        self.assertAnalyzedAll(self.analyze('reject'))
+        self.assertEqual(self.image_counts, [4, 1, 1, 1, 1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import unittest
+
+from dish_dedup import canonicalize_dishes, cluster_names
+
+
+class ClusterNamesTest(unittest.TestCase):
+
+    def assertClusters(self, names, expected):
+        self.assertEqual(sorted(map(sorted, cluster_names(names))),
+                         sorted(map(sorted, expected)))
+
+    def test_spelling_variants_and_generic_words_merge(self):
+        names = ['Croque Monsieur', 'croque-monsieur', 'Croque monsieur sandwich']
+        self.assertClusters(names, [names])
+
+    def test_typos_merge(self):
+        for names in (['Chicken curry', 'Chiken curry'],
+                      ['Margherita Pizza', 'Margarita Pizza'],
+                      ['Pad thai', 'Phad thai']):
+            self.assertClusters(names, [names])
+
+    def test_fillers_merge(self):
+        names = ['Tiramisu maison', 'Le tiramisu', 'Tiramisu']
+        self.assertClusters(names, [names])
+
+    def test_different_dishes_stay_apart(self):
+        self.assertClusters(['Chicken curry', 'Chicken curry rice', 'Chicken salad'],
+                            [['Chicken curry'], ['Chicken curry rice'], ['Chicken salad']])
+        self.assertClusters(['Ham sandwich', 'Jam sandwich'],
+                            [['Ham sandwich'], ['Jam sandwich']])
+
+    def test_no_chaining_through_near_matches(self):
+        counts = {'Pizza margherita': 5, 'Pizza margarita': 1, 'Pizza marinara': 3}
+        clusters = cluster_names(list(counts), counts)
+        self.assertIn(['Pizza marinara'], clusters)
+
+
+class CanonicalizeDishesTest(unittest.TestCase):
+
+    def test_clusters_per_place_with_merged_photos(self):
+        rows = [
+            {'place_id': 'a', 'restaurant_name': 'A', 'dish_name': 'Croque Monsieur',
+             'photo_url': 'u1', 'description': 'toast'},
+            {'place_id': 'a', 'restaurant_name': 'A', 'dish_name': 'croque-monsieur',
+             'photo_url': 'u2', 'description': 'ham and cheese toast'},
+            {'place_id': 'a', 'restaurant_name': 'A', 'dish_name': 'Croque Monsieur',
+             'photo_url': 'u3', 'description': ''},
+            {'place_id': 'b', 'restaurant_name': 'B', 'dish_name': 'Croque monsieur',
+             'photo_url': 'u4', 'description': ''},
+        ]
+        dishes = sorted(canonicalize_dishes(rows), key=lambda dish: dish['place_id'])
+        self.assertEqual(len(dishes), 2)
+        self.assertEqual(dishes[0]['dish_name'], 'Croque Monsieur')
+        self.assertEqual(dishes[0]['photo_urls'].split('\n'), ['u1', 'u3', 'u2'])
+        self.assertEqual(dishes[0]['aliases'], 'croque-monsieur')
+        self.assertEqual(dishes[0]['photo_count'], '3')
+        self.assertEqual(dishes[1]['photo_urls'], 'u4')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+import json
+import os
+import tempfile
+import threading
+import unittest
+from http.server import ThreadingHTTPServer
+from urllib.request import urlopen
+
+from dish_index import DishIndex, DishIndexHandler, build_index
+from kb_store import CANONICAL_COLUMNS, write_segment
+
+DISHES = [
+    {'restaurant_name': 'Chez Paul', 'place_id': 'place-a', 'dish_name': 'Croque monsieur',
+     'photo_url': 'a/1.jpg', 'photo_urls': 'a/1.jpg\na/2.jpg\na/3.jpg'},
+    {'restaurant_name': 'Chez Paul', 'place_id': 'place-a', 'dish_name': 'Croque madame',
+     'photo_url': 'a/4.jpg', 'photo_urls': 'a/4.jpg\na/1.jpg'},
+    {'restaurant_name': 'Chez Paul', 'place_id': 'place-a', 'dish_name': 'Tarte tatin',
+     'photo_url': 'a/5.jpg'},
+    {'restaurant_name': 'Le Zinc', 'place_id': 'place-b', 'dish_name': 'Croque monsieur',
+     'photo_url': 'b/1.jpg'},
+]
+
+
+class DishIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        kb_dir = os.path.join(self.directory.name, 'kb')
+        os.makedirs(kb_dir)
+        write_segment(kb_dir, DISHES, columns=CANONICAL_COLUMNS)
+        index_dir = os.path.join(self.directory.name, 'index')
+        self.assertEqual(build_index(kb_dir, index_dir), len(DISHES))
+        self.index = DishIndex(index_dir)
+
+    def tearDown(self):
+        self.index.close()
+        self.directory.cleanup()
+
+    def test_search_ranks_closest_names_first(self):
+        matches = self.index.search('croque monsieur')
+        self.assertEqual([dish['dish_name'] for dish in matches[:2]],
+                         ['Croque monsieur', 'Croque monsieur'])
+        self.assertEqual(matches[0]['score'], 1.0)
+        self.assertNotIn('Tarte tatin', [dish['dish_name'] for dish in matches])
+
+    def test_search_tolerates_typos(self):
+        matches = self.index.search('croque monsier', 'place-a')
+        self.assertEqual(matches[0]['dish_name'], 'Croque monsieur')
+
+    def test_search_within_a_place(self):
+        self.assertEqual({dish['place_id'] for dish in self.index.search('croque', 'place-b')},
+                         {'place-b'})
+        self.assertEqual(self.index.search('croque', 'place-unknown'), [])
+
+    def test_image_urls_are_unique_and_capped(self):
+        self.assertCountEqual(self.index.image_urls('croque', 'place-a', count=10),
+                              ['a/1.jpg', 'a/2.jpg', 'a/3.jpg', 'a/4.jpg'])
+        self.assertEqual(len(self.index.image_urls('croque', 'place-a', count=2)), 2)
+
+    def test_http_lookup_returns_at_most_count_urls(self):
+        DishIndexHandler.index = self.index
+        server = ThreadingHTTPServer(('127.0.0.1', 0), DishIndexHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            url = (f"http://127.0.0.1:{server.server_port}/search"
+                   f"?name=croque+monsieur&place_id=place-a&count=2")
+            with urlopen(url) as response:
+                body = json.load(response)
+        finally:
+            server.shutdown()
+            server.server_close()
+        self.assertEqual(body['imageUrls'], ['a/1.jpg', 'a/2.jpg'])
+        self.assertEqual(body['matches'][0]['dish_name'], 'Croque monsieur')
+
+
+if __name__ == '__main__':
+    unittest.main()
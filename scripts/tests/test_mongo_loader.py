@@ -0,0 +1,155 @@
+import json
+import os
+import unittest
+
+from tests import WorkingDirectoryTestCase, import_script, quiet
+
+try:
+    import mongomock
+    from pymongo.errors import AutoReconnect
+except ImportError:
+    mongomock = None
+
+from mongo_loader import MongoBulkLoader, build_dish_document, load_analysis_results
+
+
+def analysis_result(place_id, photo_url, name):
+    return {'restaurant_name': 'R', 'place_id': place_id, 'photo_url': photo_url,
+            'analysis': {'is_a_dish': 1 if name else 0, 'name': name, 'desc': ''}}
+
+
+class UnreachableCollection:
+    """
+    Fails every write like a server that is down, until `up` is set
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.up = False
+
+    def bulk_write(self, operations, ordered=True):
+        if not self.up:
+            raise AutoReconnect("connection refused")
+        return self.collection.bulk_write(operations, ordered=ordered)
+
+
+@unittest.skipIf(mongomock is None, "needs pymongo and mongomock")
+class MongoBulkLoaderTest(WorkingDirectoryTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.dishes = mongomock.MongoClient().db.dishes
+
+    def write_results(self, results):
+        with open('results.jsonl', 'w', encoding='utf-8') as f:
+            for result in results:
+                f.write(json.dumps(result) + '\n')
+
+    def test_reloading_results_updates_instead_of_duplicating(self):
+        self.write_results([analysis_result('p1', 'a.jpg', 'Soup'),
+                            analysis_result('p1', 'b.jpg', ''),
+                            analysis_result('p2', 'c.jpg', 'Salad')])
+        loader = MongoBulkLoader(self.dishes, batch_size=1)
+        self.assertEqual(load_analysis_results('results.jsonl', loader), 2)
+        self.assertEqual((loader.upserted, loader.modified), (2, 0))
+        created_at = self.dishes.find_one({'photo_url': 'a.jpg'})['created_at']
+
+        loader = MongoBulkLoader(self.dishes)
+        load_analysis_results('results.jsonl', loader)
+        self.assertEqual((loader.upserted, loader.modified), (0, 0))
+        self.assertEqual(self.dishes.count_documents({}), 2)
+
+        self.write_results([analysis_result('p1', 'a.jpg', 'Tomato soup')])
+        loader = MongoBulkLoader(self.dishes)
+        load_analysis_results('results.jsonl', loader)
+        self.assertEqual((loader.upserted, loader.modified), (0, 1))
+        dish = self.dishes.find_one({'photo_url': 'a.jpg'})
+        self.assertEqual(dish['dish_name'], 'Tomato soup')
+        self.assertEqual(dish['created_at'], created_at)
+        self.assertEqual(self.dishes.count_documents({}), 2)
+
+    def test_unwritten_keys_are_returned_when_the_server_is_down(self):
+        collection = UnreachableCollection(self.dishes)
+        loader = MongoBulkLoader(collection, batch_size=2)
+        self.assertIsNone(loader.add(build_dish_document('R', 'p1', 'a.jpg', 'Soup', '')))
+        failed = []
+        quiet(lambda: failed.extend(
+            loader.add(build_dish_document('R', 'p1', 'b.jpg', 'Salad', ''))))
+        self.assertEqual(failed, [{'place_id': 'p1', 'photo_url': 'a.jpg'},
+                                  {'place_id': 'p1', 'photo_url': 'b.jpg'}])
+        self.assertEqual(loader.errors, 2)
+
+        collection.up = True
+        loader.add(build_dish_document('R', 'p1', 'a.jpg', 'Soup', ''))
+        self.assertEqual(loader.flush(), [])
+        self.assertEqual(self.dishes.count_documents({}), 1)
+
+
+@unittest.skipIf(mongomock is None, "needs pymongo and mongomock")
+class DirectUpsertRunTest(WorkingDirectoryTestCase):
+    """
+    A dish photo is checkpointed only once its upsert is written, so
+    an outage never loses dishes and recovery never duplicates them
+    """
+
+    def setUp(self):
+        super().setUp()
+        import mock_servers
+        self.marker = import_script('image-marker')
+        dify = mock_servers.start_server(mock_servers.MockDifyHandler,
+                                         mock_servers.MockBehavior(latency=0.0))
+        self.addCleanup(dify.server_close)
+        self.addCleanup(dify.shutdown)
+        url = self.marker.DIFY_WORKFLOW_URL
+        self.marker.DIFY_WORKFLOW_URL = \
+            f"http://127.0.0.1:{dify.server_address[1]}/v1/workflows/run"
+        self.addCleanup(setattr, self.marker, 'DIFY_WORKFLOW_URL', url)
+
+        self.dishes = mongomock.MongoClient().db.dishes
+        self.collection = UnreachableCollection(self.dishes)
+        open_collection = self.marker.open_collection
+        self.marker.open_collection = lambda: self.collection
+        self.addCleanup(setattr, self.marker, 'open_collection', open_collection)
+
+        os.makedirs('outputs')
+        with open('outputs/restaurants.jsonl', 'w', encoding='utf-8') as f:
+            for i in range(3):
+                f.write(json.dumps({
+                    'restaurant_name': f'R{i}', 'place_id': f'p{i}', 'photo_count': 6,
+                    'photo_urls': [f'https://lh3.googleusercontent.com/p/r{i}-{j}=w400'
+                                   for j in range(6)]}) + '\n')
+
+    def analyze(self, output_mode):
+        quiet(self.marker.main, ['--output-mode', output_mode, '--rps', '1000'])
+
+    def places_done(self):
+        with open(self.marker.CHECKPOINT_FILE, encoding='utf-8') as f:
+            return sum(1 for line in f if json.loads(line).get('done'))
+
+    def dish_photos(self):
+        with open(self.marker.ANALYSIS_RESULTS_FILE, encoding='utf-8') as f:
+            return {result['photo_url'] for result in map(json.loads, f)
+                    if result['analysis'].get('is_a_dish') == 1}
+
+    def test_outage_is_recovered_on_the_next_mongo_run(self):
+        self.analyze('mongo')
+        self.assertEqual(self.places_done(), 0)
+        self.assertEqual(self.dishes.count_documents({}), 0)
+
+        # Without a loader the pending upserts are kept for later
+        self.collection.up = True
+        self.analyze('js')
+        self.assertEqual(self.places_done(), 0)
+
+        self.analyze('mongo')
+        self.assertEqual(self.places_done(), 3)
+        self.assertTrue(self.dish_photos())
+        self.assertEqual({dish['photo_url'] for dish in self.dishes.find()},
+                         self.dish_photos())
+
+        self.analyze('mongo')
+        self.assertEqual(self.dishes.count_documents({}), len(self.dish_photos()))
+
+
+if __name__ == '__main__':
+    unittest.main()
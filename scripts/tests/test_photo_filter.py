@@ -0,0 +1,86 @@
+import json
+import os
+import random
+import tempfile
+import unittest
+
+from photo_filter import PhotoPreFilter, fit_model, load_audit_samples, main
+
+
+def audit_record(features, is_a_dish, enforced=False):
+    decision = {'score': 0.5, 'rejected': False, 'features': features}
+    if enforced:
+        decision['enforced'] = True
+    return {'photo_url': 'x', 'analysis': {'is_a_dish': is_a_dish}, 'prefilter': decision}
+
+
+def synthetic_audit(count=400, seed=7):
+    """
+    Dishes are saturated with few text-like pixels, non-dishes the reverse,
+    with enough noise that the classes overlap
+    """
+    rng = random.Random(seed)
+    records = []
+    for i in range(count):
+        dish = i % 3 != 0
+        records.append(audit_record({
+            'saturation': rng.gauss(0.6 if dish else 0.3, 0.12),
+            'text_fraction': rng.gauss(0.1 if dish else 0.4, 0.12),
+            'edge_density': rng.random()
+        }, 1 if dish else 0))
+    return records
+
+
+class FitModelTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.results = os.path.join(self.directory.name, 'results.jsonl')
+        self.model_path = os.path.join(self.directory.name, 'model.json')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write_results(self, records):
+        with open(self.results, 'w', encoding='utf-8') as f:
+            for record in records:
+                f.write(json.dumps(record) + '\n')
+
+    def test_skipped_and_unscored_photos_are_not_training_data(self):
+        self.write_results([audit_record({'saturation': 0.5}, 1),
+                            audit_record({'saturation': 0.1}, 0, enforced=True),
+                            {'photo_url': 'y', 'analysis': {'is_a_dish': 0}}])
+        samples, labels = load_audit_samples(self.results)
+        self.assertEqual((samples, labels), ([{'saturation': 0.5}], [1]))
+
+    def test_fit_learns_the_signal_and_keeps_recall(self):
+        records = synthetic_audit()
+        samples = [record['prefilter']['features'] for record in records]
+        labels = [record['analysis']['is_a_dish'] for record in records]
+        model = fit_model(samples, labels, min_recall=0.95)
+
+        self.assertGreater(model['weights']['saturation'], 0)
+        self.assertLess(model['weights']['text_fraction'], 0)
+        self.assertGreaterEqual(model['fit']['recall'], 0.95)
+        self.assertGreater(model['fit']['skipped_non_dishes'], 0.5)
+
+    def test_fit_needs_both_classes(self):
+        with self.assertRaises(ValueError):
+            fit_model([{'saturation': 0.5}] * 3, [1, 1, 1])
+
+    def test_fitted_file_is_enforced(self):
+        self.write_results(synthetic_audit())
+        main(['fit', '--results', self.results, '--output', self.model_path])
+
+        prefilter = PhotoPreFilter(self.model_path, enforce=True)
+        self.assertTrue(prefilter.enforce)
+        with open(self.model_path, encoding='utf-8') as f:
+            self.assertEqual(prefilter.model['threshold'], json.load(f)['threshold'])
+
+    def test_enforce_without_fitted_model_only_audits(self):
+        prefilter = PhotoPreFilter(self.model_path, enforce=True)
+        self.assertFalse(prefilter.enforce)
+
+
+if __name__ == '__main__':
+    unittest.main()
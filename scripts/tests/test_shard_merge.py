@@ -0,0 +1,101 @@
+import json
+import os
+import unittest
+
+from tests import WorkingDirectoryTestCase, import_script
+
+import kb_store
+
+
+def read(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return f.read()
+
+
+def write(path, content):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(content)
+
+
+class AppendFileTest(WorkingDirectoryTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.marker = import_script('image-marker')
+        write('main.jsonl', 'a\n')
+        write('shard/part.jsonl', 'b\nc\n')
+
+    def test_append_removes_the_shard_file(self):
+        self.marker.append_file('shard/part.jsonl', 'main.jsonl')
+        self.assertEqual(read('main.jsonl'), 'a\nb\nc\n')
+        self.assertEqual(os.listdir('shard'), [])
+
+    def test_interrupted_append_is_completed_once(self):
+        # Crashed after recording the offset and writing part of the file
+        write('shard/part.jsonl.merging', str(len('a\n')))
+        with open('main.jsonl', 'a', encoding='utf-8') as f:
+            f.write('b\n')
+        self.marker.append_file('shard/part.jsonl', 'main.jsonl')
+        self.assertEqual(read('main.jsonl'), 'a\nb\nc\n')
+        self.assertEqual(os.listdir('shard'), [])
+
+    def test_append_finished_before_the_crash_is_not_repeated(self):
+        write('shard/part.jsonl.merging', str(len('a\n')))
+        with open('main.jsonl', 'a', encoding='utf-8') as f:
+            f.write('b\nc\n')
+        self.marker.append_file('shard/part.jsonl', 'main.jsonl')
+        self.assertEqual(read('main.jsonl'), 'a\nb\nc\n')
+
+
+class MergeShardTest(WorkingDirectoryTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.marker = import_script('image-marker')
+
+    def make_shard(self, name, place_id):
+        shard = os.path.abspath(os.path.join(self.marker.SHARDS_DIR, name))
+        result = {'restaurant_name': 'R', 'place_id': place_id, 'photo_url': f'{place_id}.jpg',
+                  'analysis': {'is_a_dish': 1, 'name': 'Soup', 'desc': ''}}
+        write(os.path.join(shard, self.marker.ANALYSIS_RESULTS_FILE), json.dumps(result) + '\n')
+        write(os.path.join(shard, self.marker.MONGODB_COMMANDS_FILE),
+              self.marker.MONGODB_COMMANDS_HEADER + f'db.dishes.insertOne({{"place_id": "{place_id}"}});\n')
+        write(os.path.join(shard, self.marker.CHECKPOINT_FILE),
+              json.dumps({'place_id': place_id, 'done': True}) + '\n')
+        kb_dir = os.path.join(shard, self.marker.KNOWLEDGE_BASE_DIR)
+        os.makedirs(kb_dir)
+        kb_store.write_segment(kb_dir, [dict(result, dish_name='Soup', description='')])
+        return shard
+
+    def merged_lines(self, path):
+        with open(path, 'r', encoding='utf-8') as f:
+            return f.read().splitlines()
+
+    def test_shards_merge_into_the_main_outputs(self):
+        self.marker.merge_shard(self.make_shard('one', 'p1'))
+        self.marker.merge_shard(self.make_shard('two', 'p2'))
+
+        self.assertEqual(len(self.merged_lines(self.marker.ANALYSIS_RESULTS_FILE)), 2)
+        self.assertEqual(len(self.merged_lines(self.marker.CHECKPOINT_FILE)), 2)
+        commands = read(self.marker.MONGODB_COMMANDS_FILE)
+        self.assertTrue(commands.startswith(self.marker.MONGODB_COMMANDS_HEADER))
+        self.assertEqual(commands.count(self.marker.MONGODB_COMMANDS_HEADER), 1)
+        self.assertEqual(len(kb_store.segment_paths(self.marker.KNOWLEDGE_BASE_DIR)), 2)
+        self.assertEqual(os.listdir(self.marker.SHARDS_DIR), [])
+
+    def test_merge_interrupted_before_the_checkpoint_is_resumed_once(self):
+        shard = self.make_shard('one', 'p1')
+        # Crashed after the results were merged, before the checkpoint was
+        self.marker.append_file(os.path.join(shard, self.marker.ANALYSIS_RESULTS_FILE),
+                                self.marker.ANALYSIS_RESULTS_FILE)
+        self.assertFalse(os.path.exists(self.marker.CHECKPOINT_FILE))
+
+        self.marker.merge_shard(shard)
+        self.assertEqual(len(self.merged_lines(self.marker.ANALYSIS_RESULTS_FILE)), 1)
+        self.assertEqual(len(self.merged_lines(self.marker.CHECKPOINT_FILE)), 1)
+        self.assertFalse(os.path.exists(shard))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+import json
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+
+class WorkQueue:
+    """
+    Durable SQLite-backed work queue shared by the pipeline stages.
+
+    Items are keyed (e.g. by place_id) so enqueuing the same work twice is
+    a no-op. Claimed items are marked in progress; on restart anything
+    still in progress goes back to pending, so the pipeline resumes
+    exactly where the queue left off.
+    """
+
+    def __init__(self, path: str, max_attempts: int = 3):
+        self.path = path
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(
+            path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS items (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                key TEXT UNIQUE NOT NULL,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                updated_at REAL NOT NULL
+            )""")
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS items_status ON items (status, id)")
+
+    def recover(self) -> int:
+        """
+        Return items left in progress by an interrupted run to pending
+        """
+        with self._lock:
+            return self._db.execute(
+                "UPDATE items SET status = 'pending', updated_at = ? WHERE status = 'in_progress'",
+                (time.time(),)).rowcount
+
+    def put(self, key: str, payload: Dict) -> bool:
+        """
+        Enqueue work, returning False if the key was already queued
+        """
+        with self._lock:
+            cursor = self._db.execute(
+                "INSERT OR IGNORE INTO items (key, payload, updated_at) VALUES (?, ?, ?)",
+                (key, json.dumps(payload, ensure_ascii=False), time.time()))
+            return cursor.rowcount > 0
+
+    def claim(self) -> Optional[Tuple[int, Dict]]:
+        """
+        Take the oldest pending item, or None if there is none
+        """
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._db.execute(
+                    "SELECT id, payload FROM items WHERE status = 'pending' ORDER BY id LIMIT 1").fetchone()
+                if row is not None:
+                    self._db.execute(
+                        "UPDATE items SET status = 'in_progress', attempts = attempts + 1, "
+                        "updated_at = ? WHERE id = ?", (time.time(), row[0]))
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        if row is None:
+            return None
+        return row[0], json.loads(row[1])
+
+    def complete(self, item_id: int):
+        self._set_status(item_id, 'done')
+
+    def release(self, item_id: int):
+        """
+        Put an unfinished item back, or park it as failed after max attempts
+        """
+        with self._lock:
+            self._db.execute(
+                "UPDATE items SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                "updated_at = ? WHERE id = ?", (self.max_attempts, time.time(), item_id))
+
+    def requeue_failed(self) -> int:
+        """
+        Give items that ran out of attempts another round
+        """
+        with self._lock:
+            return self._db.execute(
+                "UPDATE items SET status = 'pending', attempts = 0, updated_at = ? "
+                "WHERE status = 'failed'", (time.time(),)).rowcount
+
+    def _set_status(self, item_id: int, status: str):
+        with self._lock:
+            self._db.execute("UPDATE items SET status = ?, updated_at = ? WHERE id = ?",
+                             (status, time.time(), item_id))
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT status, COUNT(*) FROM items GROUP BY status").fetchall()
+        return {status: count for status, count in rows}
+
+    def close(self):
+        with self._lock:
+            self._db.close()